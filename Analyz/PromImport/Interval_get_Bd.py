@@ -1,7 +1,8 @@
 from pymongo import MongoClient
 import matplotlib.pyplot as plt
 import numpy as np
-from datetime import datetime
+from sensor_repository import SensorRepository
+from history_cache import HistoryCache
 
 
 def remove_outliers(data, threshold=2):
@@ -12,7 +13,7 @@ def remove_outliers(data, threshold=2):
     std = np.std(data)
     lower_bound = mean - threshold * std
     upper_bound = mean + threshold * std
-    return [v for v in data if lower_bound <= v <= upper_bound]
+    return data[(data >= lower_bound) & (data <= upper_bound)]
 
 
 def plot_sensor_data(ax, timestamps, values, sensor_name, value_name):
@@ -27,9 +28,9 @@ def plot_sensor_data(ax, timestamps, values, sensor_name, value_name):
         else:
             filtered_values = values
         # Определение границ
-        if filtered_values:
-            min_value = min(filtered_values)
-            max_value = max(filtered_values)
+        if len(filtered_values) > 0:
+            min_value = filtered_values.min()
+            max_value = filtered_values.max()
         else:
             min_value = None
             max_value = None
@@ -39,8 +40,8 @@ def plot_sensor_data(ax, timestamps, values, sensor_name, value_name):
         ax.plot(x_indices, filtered_values, 'b-', linewidth=1)
 
         # Устанавливаем подпись на оси X (первая и последняя точка)
-        start_time = timestamps[0].strftime('%Y-%m-%d %H:%M:%S')
-        end_time = timestamps[-1].strftime('%Y-%m-%d %H:%M:%S')
+        start_time = timestamps[0].astype('datetime64[s]').item().strftime('%Y-%m-%d %H:%M:%S')
+        end_time = timestamps[-1].astype('datetime64[s]').item().strftime('%Y-%m-%d %H:%M:%S')
         ax.set_xticks([0, len(filtered_values) - 1])
         ax.set_xticklabels([start_time, end_time])
 
@@ -61,17 +62,17 @@ def main():
     # Настройки
     DB_NAME = "mqtt_database"
     COLLECTION_NAME = "your_collection"
-    MAC_FIELD = "MacAddress"
     VALUE_FIELD = "TemperatureC"  # Измените на нужное поле
     TIME_FIELD = "MsgTimeStamp"  # Измените если нужно
 
     # Подключение к MongoDB
     client = MongoClient('mongodb://localhost:27017/', connectTimeoutMS=30000)
     db = client[DB_NAME]
-    collection = db[COLLECTION_NAME]
+    repository = SensorRepository(db[COLLECTION_NAME])
+    cache = HistoryCache(repository)
 
     # Получаем список уникальных датчиков
-    unique_macs = collection.distinct(MAC_FIELD)
+    unique_macs = repository.sensors()
     print(f"Найдено датчиков: {len(unique_macs)}")
 
     # Создаем фигуру с 4 subplots (2x2)
@@ -81,20 +82,12 @@ def main():
     # Для каждого датчика получаем данные и рисуем график
     for i, mac in enumerate(unique_macs[:4]):
         # Получаем данные для конкретного датчика
-        query = {MAC_FIELD: mac}
-        projection = {VALUE_FIELD: 1, TIME_FIELD: 1, "_id": 0}
-        data = list(collection.find(query, projection).limit(100000000000))
+        columns = cache.columns(mac, fields=(TIME_FIELD, VALUE_FIELD))
 
         # Подготовка данных
-        values = []
-        timestamps = []
-        for doc in data:
-            try:
-                val = float(doc.get(VALUE_FIELD))
-                values.append(val)
-                timestamps.append(datetime.fromisoformat(doc.get(TIME_FIELD)))
-            except ValueError:
-                continue
+        mask = ~np.isnan(columns[VALUE_FIELD])
+        values = columns[VALUE_FIELD][mask]
+        timestamps = columns[TIME_FIELD][mask]
 
         # Выбираем оси для текущего графика
         ax = axes[i // 2, i % 2]
@@ -1,24 +1,31 @@
 import os
 import matplotlib.pyplot as plt
-from datetime import datetime
+from datetime import datetime, timedelta
 from pymongo import MongoClient
 import numpy as np
 from scipy.stats import pearsonr
 from multiprocessing import Process
+from sensor_repository import SensorRepository
+from history_cache import HistoryCache
 
+FIELDS = ("MsgTimeStamp", "TemperatureC", "Humidity")
 
-def load_all_data_from_mongodb(connection_string, database_name, collection_name, query={}):
+
+def load_all_data_from_mongodb(repository, start_date=None, end_date=None):
+    """Показания за интервал [start_date, end_date) по датчикам: {MacAddress: {поле: массив numpy}}.
+    Читаются через локальный кэш истории, из MongoDB догружаются только новые показания"""
     try:
-        client = MongoClient(connection_string)
-        db = client[database_name]
-        collection = db[collection_name]
-        data = list(collection.find(query))
-        client.close()
-        print(f"Загружено {len(data)} записей из MongoDB.")
-        return data
+        cache = HistoryCache(repository)
+        sensor_data = {}
+        for mac_address in repository.sensors():
+            columns = cache.columns(mac_address, start_date, end_date, fields=FIELDS)
+            if len(columns["MsgTimeStamp"]):
+                sensor_data[mac_address] = columns
+        print(f"Загружено {sum(len(c['MsgTimeStamp']) for c in sensor_data.values())} записей из MongoDB.")
+        return sensor_data
     except Exception as e:
         print(f"Ошибка при загрузке данных из MongoDB: {e}")
-        return []
+        return {}
 
 
 def plot_correlation_between_sensors(sensor1_data, sensor2_data, sensor1_mac, sensor2_mac, parameter="TemperatureC", save_dir="sensor_plots", show_plots=True, save_plots=True):
@@ -27,41 +34,31 @@ def plot_correlation_between_sensors(sensor1_data, sensor2_data, sensor1_mac, se
     """
     try:
         # Проверка наличия данных
-        if not sensor1_data or not sensor2_data:
+        if not len(sensor1_data["MsgTimeStamp"]) or not len(sensor2_data["MsgTimeStamp"]):
             print(f"Нет данных для одного из датчиков: {sensor1_mac} или {sensor2_mac}.")
             return
 
         # Проверка наличия параметра в данных
-        if parameter not in sensor1_data[0] or parameter not in sensor2_data[0]:
+        if parameter not in sensor1_data or parameter not in sensor2_data:
             print(f"Параметр '{parameter}' отсутствует в данных.")
             return
 
-        # Извлечение данных для первого датчика
-        sensor1_values = [float(entry[parameter]) for entry in sensor1_data]
-        sensor1_timestamps = [round_to_minute(datetime.strptime(entry["MsgTimeStamp"], "%Y-%m-%d %H:%M:%S")) for entry in sensor1_data]
-
-        # Извлечение данных для второго датчика
-        sensor2_values = [float(entry[parameter]) for entry in sensor2_data]
-        sensor2_timestamps = [round_to_minute(datetime.strptime(entry["MsgTimeStamp"], "%Y-%m-%d %H:%M:%S")) for entry in sensor2_data]
-
-        # Сопоставление данных по временным меткам (округленным до минут)
-        common_timestamps = list(set(sensor1_timestamps).intersection(set(sensor2_timestamps)))
-        common_timestamps.sort()
+        # Сопоставление данных по временным меткам (округленным до минут), первое показание в минуте
+        common_timestamps, idx1, idx2 = np.intersect1d(
+            sensor1_data["MsgTimeStamp"].astype("datetime64[m]"),
+            sensor2_data["MsgTimeStamp"].astype("datetime64[m]"),
+            return_indices=True,
+        )
 
         # Отладочный вывод
         print(f"Общие временные метки для {sensor1_mac} и {sensor2_mac}: {len(common_timestamps)}")
 
-        if not common_timestamps:
+        if not len(common_timestamps):
             print(f"Нет общих временных меток для {sensor1_mac} и {sensor2_mac}.")
             return
 
-        sensor1_aligned = []
-        sensor2_aligned = []
-        for timestamp in common_timestamps:
-            idx1 = sensor1_timestamps.index(timestamp)
-            idx2 = sensor2_timestamps.index(timestamp)
-            sensor1_aligned.append(sensor1_values[idx1])
-            sensor2_aligned.append(sensor2_values[idx2])
+        sensor1_aligned = sensor1_data[parameter][idx1]
+        sensor2_aligned = sensor2_data[parameter][idx2]
 
         # Построение графика корреляции
         plt.figure(figsize=(10, 6))
@@ -122,13 +119,9 @@ def plot_correlation_between_sensors(sensor1_data, sensor2_data, sensor1_mac, se
     except Exception as e:
         print(f"Ошибка при построении графика корреляции: {e}")
 
-def round_to_minute(dt):
-    """Округляет временную метку до минут."""
-    return dt.replace(second=0, microsecond=0)
-def get_date_range(data):
+def get_date_range(repository):
     """Определение минимальной и максимальной даты в данных."""
-    timestamps = [datetime.strptime(entry["MsgTimeStamp"], "%Y-%m-%d %H:%M:%S") for entry in data]
-    return min(timestamps), max(timestamps)
+    return repository.time_bounds()
 
 
 def parse_date_input(date_str, year):
@@ -141,17 +134,7 @@ def parse_date_input(date_str, year):
         return None
 
 
-def filter_data_by_date_range(data, start_date, end_date):
-    """Фильтрация данных по диапазону дат."""
-    filtered_data = []
-    for entry in data:
-        entry_date = datetime.strptime(entry["MsgTimeStamp"], "%Y-%m-%d %H:%M:%S")
-        if start_date <= entry_date <= end_date:
-            filtered_data.append(entry)
-    return filtered_data
-
-
-def plot_sensor_data_for_sensor(mac_address, entries, color, linestyle, show_plots=True, save_plots=True, save_dir="sensor_plots"):
+def plot_sensor_data_for_sensor(mac_address, columns, color, linestyle, show_plots=True, save_plots=True, save_dir="sensor_plots"):
     """Функция для построения графиков для одного датчика."""
     try:
         # Создание новой фигуры для датчика
@@ -159,9 +142,9 @@ def plot_sensor_data_for_sensor(mac_address, entries, color, linestyle, show_plo
         fig.suptitle(f"Датчик {mac_address}", fontsize=16, fontweight='bold')
 
         # Извлечение данных
-        timestamps = [datetime.strptime(entry["MsgTimeStamp"], "%Y-%m-%d %H:%M:%S") for entry in entries]
-        temperature_c = [float(entry["TemperatureC"]) for entry in entries]
-        humidity = [float(entry["Humidity"]) for entry in entries]
+        timestamps = columns["MsgTimeStamp"]
+        temperature_c = columns["TemperatureC"]
+        humidity = columns["Humidity"]
 
         # Преобразование времени в числовой формат для построения тренда
         time_numeric = np.arange(len(timestamps))
@@ -292,30 +275,22 @@ def plot_sensor_data_for_sensor(mac_address, entries, color, linestyle, show_plo
         print(f"Ошибка при построении графиков для датчика {mac_address}: {e}")
 
 
-def plot_sensor_data(data, save_dir="sensor_plots", show_plots=True, save_plots=True):
+def plot_sensor_data(sensor_data, save_dir="sensor_plots", show_plots=True, save_plots=True):
     """Визуализация данных для датчиков."""
-    if not data:
+    if not sensor_data:
         print("Нет данных для построения графиков.")
         return
 
-    # Группировка данных по MacAddress
-    sensor_data = {}
-    for entry in data:
-        mac_address = entry["MacAddress"]
-        if mac_address not in sensor_data:
-            sensor_data[mac_address] = []
-        sensor_data[mac_address].append(entry)
-
     # Переменные для настройки графиков
     colors = ["red", "blue", "green", "purple"]
     linestyles = ['-', '--', ':', '-.']
 
     # Создание процессов для каждого датчика
     processes = []
-    for i, (mac_address, entries) in enumerate(sensor_data.items()):
+    for i, (mac_address, columns) in enumerate(sensor_data.items()):
         p = Process(
             target=plot_sensor_data_for_sensor,
-            args=(mac_address, entries, colors[i], linestyles[i], show_plots, save_plots, save_dir)
+            args=(mac_address, columns, colors[i], linestyles[i], show_plots, save_plots, save_dir)
         )
         processes.append(p)
         p.start()
@@ -352,15 +327,14 @@ if __name__ == "__main__":
     database_name = "my_database"  # Замените на имя вашей базы данных
     collection_name = "your_collection"  # Замените на имя вашей коллекции
 
-    query = {}  # Пример запроса (можно оставить пустым для выбора всех документов)
-    data = load_all_data_from_mongodb(mongodb_connection_string, database_name, collection_name, query)
+    client = MongoClient(mongodb_connection_string)
+    repository = SensorRepository(client[database_name][collection_name])
 
-    if not data:
+    # Определение доступного интервала дат
+    min_date, max_date = get_date_range(repository)
+    if min_date is None:
         print("Данные из MongoDB не найдены.")
         exit()
-
-    # Определение доступного интервала дат
-    min_date, max_date = get_date_range(data)
     print(f"Доступный интервал данных: с {min_date.day}.{min_date.month} по {max_date.day}.{max_date.month}")
 
     # Запрос диапазона дат у пользователя
@@ -379,22 +353,16 @@ if __name__ == "__main__":
         print("Ошибка при разборе дат. Проверьте формат ввода.")
         exit()
 
-    filtered_data = filter_data_by_date_range(data, start_date, end_date)
+    # Конечная дата включительно
+    sensor_data = load_all_data_from_mongodb(repository, start_date, end_date + timedelta(days=1))
+    client.close()
 
-    if not filtered_data:
+    if not sensor_data:
         print("Нет данных для выбранного диапазона дат.")
         exit()
 
     # Визуализация данных
-    plot_sensor_data(filtered_data, save_dir="sensor_plots", show_plots=True, save_plots=False)
-
-    # Группировка данных по MacAddress
-    sensor_data = {}
-    for entry in filtered_data:
-        mac_address = entry["MacAddress"]
-        if mac_address not in sensor_data:
-            sensor_data[mac_address] = []
-        sensor_data[mac_address].append(entry)
+    plot_sensor_data(sensor_data, save_dir="sensor_plots", show_plots=True, save_plots=False)
 
     # Выбор параметра для анализа
     parameter = input("Введите параметр для анализа (TemperatureC или Humidity): ").strip()
@@ -1,49 +1,24 @@
+import threading
 import time
-from collections import deque
-import statistics
 import numpy as np
-import pandas as pd
-from typing import Dict, Any
+from typing import Dict, Optional
 import logging
-from prometheus_client import Gauge
+from sensor_reading import SensorReading
+from Analyz.ring_buffer import SensorRingBuffer
+from Analyz.sliding_stats import SlidingMoments, SlidingTrend, SlidingCoMoments, window_quantiles
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def create_sensor_metrics(sensor_name: str) -> Dict[str, Gauge]:
-    return {
-        'pm25': Gauge(f'mqtt_{sensor_name}_pm25', f'PM2.5 value for {sensor_name}'),
-        'humidity': Gauge(f'mqtt_{sensor_name}_humidity', f'Humidity for {sensor_name}'),
-        'temperature_c': Gauge(f'mqtt_{sensor_name}_temperature_c', f'Temperature (C) for {sensor_name}'),
-        'temperature_f': Gauge(f'mqtt_{sensor_name}_temperature_f', f'Temperature (F) for {sensor_name}'),
-        'dew_point_c': Gauge(f'mqtt_{sensor_name}_dew_point_c', f'Dew point (C) for {sensor_name}'),
-        'dew_point_f': Gauge(f'mqtt_{sensor_name}_dew_point_f', f'Dew point (F) for {sensor_name}'),
-        'alarm_status': Gauge(f'mqtt_{sensor_name}_alarm_status', f'Alarm status for {sensor_name}'),
-        'pm25_rate': Gauge(f'mqtt_{sensor_name}_pm25_rate', f'PM2.5 change rate for {sensor_name}'),
-        'temp_rate': Gauge(f'mqtt_{sensor_name}_temp_rate', f'Temperature change rate for {sensor_name}'),
-        'humidity_rate': Gauge(f'mqtt_{sensor_name}_humidity_rate', f'Humidity change rate for {sensor_name}'),
-        'dew_point_rate': Gauge(f'mqtt_{sensor_name}_dew_point_rate', f'Dew point change rate for {sensor_name}'),
-        'pm25_stddev': Gauge(f'mqtt_{sensor_name}_pm25_stddev', f'PM2.5 standard deviation for {sensor_name}'),
-        'temp_stddev': Gauge(f'mqtt_{sensor_name}_temp_stddev', f'Temperature standard deviation for {sensor_name}'),
-        'temp_upper_quantile': Gauge(f'mqtt_{sensor_name}_temp_upper_quantile', f'Temperature upper quantile for {sensor_name}'),
-        'temp_lower_quantile': Gauge(f'mqtt_{sensor_name}_temp_lower_quantile', f'Temperature lower quantile for {sensor_name}'),
-        'temp_upper_stddev': Gauge(f'mqtt_{sensor_name}_temp_upper_stddev', f'Temperature upper stddev for {sensor_name}'),
-        'temp_lower_stddev': Gauge(f'mqtt_{sensor_name}_temp_lower_stddev', f'Temperature lower stddev for {sensor_name}'),
-        'humidity_upper_quantile': Gauge(f'mqtt_{sensor_name}_humidity_upper_quantile', f'Humidity upper quantile for {sensor_name}'),
-        'humidity_lower_quantile': Gauge(f'mqtt_{sensor_name}_humidity_lower_quantile', f'Humidity lower quantile for {sensor_name}'),
-        'dew_point_upper_quantile': Gauge(f'mqtt_{sensor_name}_dew_point_upper_quantile', f'Dew point upper quantile for {sensor_name}'),
-        'dew_point_lower_quantile': Gauge(f'mqtt_{sensor_name}_dew_point_lower_quantile', f'Dew point lower quantile for {sensor_name}'),
-        'temp_trend': Gauge(f'mqtt_{sensor_name}_temp_trend', f'Temperature trend for {sensor_name}'),
-        'humidity_trend': Gauge(f'mqtt_{sensor_name}_humidity_trend', f'Humidity trend for {sensor_name}'),
-        'dew_point_trend': Gauge(f'mqtt_{sensor_name}_dew_point_trend', f'Dew point trend for {sensor_name}'),
-        'temp_humidity_corr': Gauge(f'mqtt_{sensor_name}_temp_humidity_corr', f'Temperature-humidity correlation for {sensor_name}'),
-        'pm25_alert': Gauge(f'mqtt_{sensor_name}_pm25_alert', f'PM2.5 alert status for {sensor_name}')
-    }
-
 class MetricsProcessor:
-    def __init__(self, window_size: int = 100, trend_window: int = 100):
+    RATES = (('pm25', 'pm25_rate'), ('temperature_c', 'temp_rate'),
+             ('humidity', 'humidity_rate'), ('dew_point_c', 'dew_point_rate'))
+
+    def __init__(self, window_size: int = 100, trend_window: int = 10, trend_horizon: float = 600.0):
+        # trend_window - минимальное число точек в окне тренда длиной trend_horizon секунд
         self.window_size = window_size
         self.trend_window = trend_window
+        self.trend_horizon = trend_horizon
         self.sensor_data = {}
         self.last_update_time = {}
         self.trend_coefficients = {}
@@ -51,14 +26,28 @@ class MetricsProcessor:
 
     def init_sensor(self, sensor_id: str):
         if sensor_id not in self.sensor_data:
+            # Окно хранится только в кольцевом буфере: моменты и тренды держат суммы,
+            # квантили считаются по представлениям буфера при опросе (snapshot)
+            history = SensorRingBuffer(self.window_size)
             self.sensor_data[sensor_id] = {
-                'pm25': deque(maxlen=self.window_size),
-                'temperature_c': deque(maxlen=self.window_size),
-                'humidity': deque(maxlen=self.window_size),
-                'dew_point_c': deque(maxlen=self.window_size),
-                'timestamps': deque(maxlen=self.window_size),
-                'last_values': {}
+                'history': history,
+                'moments': {
+                    'pm25': SlidingMoments(),
+                    'temperature_c': SlidingMoments()
+                },
+                'trend': {
+                    'temperature_c': SlidingTrend(history, 'temperature_c', self.trend_horizon),
+                    'humidity': SlidingTrend(history, 'humidity', self.trend_horizon),
+                    'dew_point_c': SlidingTrend(history, 'dew_point_c', self.trend_horizon)
+                },
+                'last_values': {},
+                'rates': {},
+                'last_reading': None,
+                'version': 0,
+                'snapshot': (None, {}),
+                'lock': threading.Lock()
             }
+            self.correlation_cache[sensor_id] = SlidingCoMoments(('temp', 'humidity', 'pm25'))
             self.trend_coefficients[sensor_id] = {
                 'temp_trend': 0,
                 'humidity_trend': 0,
@@ -66,123 +55,155 @@ class MetricsProcessor:
             }
             self.last_update_time[sensor_id] = time.time()
 
+    def remove_sensor(self, sensor_id: str):
+        self.sensor_data.pop(sensor_id, None)
+        self.last_update_time.pop(sensor_id, None)
+        self.trend_coefficients.pop(sensor_id, None)
+        self.correlation_cache.pop(sensor_id, None)
+
+    def _record(self, sensor_id: str, reading: SensorReading):
+        """Записать показание в кольцевой буфер и обновить все скользящие оценки"""
+        sensor_history = self.sensor_data[sensor_id]
+        history = sensor_history['history']
+        row = (reading.pm25, reading.temperature_c, reading.humidity, reading.dew_point_c)
+        # Тренды - до append: вытесняемые из окна точки они читают из буфера
+        for name, value in zip(history.CHANNELS, row):
+            trend = sensor_history['trend'].get(name)
+            if trend is not None:
+                trend.push(reading.ts, value)
+        evicted = history.append(reading.ts, row) or (None,) * len(row)
+        for name, value, old in zip(history.CHANNELS, row, evicted):
+            moments = sensor_history['moments'].get(name)
+            if moments is not None:
+                moments.push(value, old)
+                if moments.stale:
+                    moments.reset(history.present(name).tolist())
+
+        pm25, temp, humidity, _ = row
+        new_row = (temp, humidity, pm25) if None not in (temp, humidity, pm25) else None
+        old_pm25, old_temp, old_humidity, _ = evicted
+        old_row = (old_temp, old_humidity, old_pm25) if None not in (old_temp, old_humidity, old_pm25) else None
+        corr = self.correlation_cache[sensor_id]
+        corr.push(new_row, old_row)
+        if corr.stale:
+            window = np.column_stack([history.window('temperature_c'), history.window('humidity'), history.window('pm25')])
+            corr.reset(window[~np.isnan(window).any(axis=1)].tolist())
+
+    def calculate_trend(self, sensor_id: str, name: str) -> Optional[float]:
+        trend = self.sensor_data[sensor_id]['trend'][name]
+        if trend.n < self.trend_window:
+            return None
+        return trend.slope_per_minute()
+
     def calculate_correlations(self, sensor_id):
-        data = self.sensor_data[sensor_id]
-        df = pd.DataFrame({
-            'temp': list(data['temperature_c']),
-            'humidity': list(data['humidity']),
-            'pm25': list(data['pm25'])
-        })
-        corr = df.corr()
-        self.correlation_cache[sensor_id] = corr
-        return corr
+        return self.correlation_cache[sensor_id].matrix()
 
     def get_correlation_metric(self, sensor_id, metric1, metric2):
         corr = self.correlation_cache.get(sensor_id, None)
         if corr is not None:
-            return corr.at[metric1, metric2]
+            return corr.correlation(metric1, metric2)
         return 0
 
-    def calculate_trend(self, values: deque, timestamps: deque) -> float:
-        if len(values) < 2:
-            return 0.0
-        x = np.array(timestamps)
-        y = np.array(values)
-        slope, _ = np.polyfit(x, y, 1)
-        return slope * 60
-
-    def process_metrics(self, sensor_id: str, metrics: Dict[str, Any], new_data: Dict[str, Any]):
+    def process_metrics(self, sensor_id: str, reading: SensorReading):
+        """Учесть новое показание. Gauge здесь не трогаются: значения метрик
+        собираются при опросе Prometheus через sensor_snapshots()."""
         try:
             self.init_sensor(sensor_id)
-            current_time = time.time()
             sensor_history = self.sensor_data[sensor_id]
-            last_values = sensor_history['last_values']
-            if 'PM25' in new_data:
-                pm25 = float(new_data['PM25'])
-                sensor_history['pm25'].append(pm25)
-                metrics['pm25'].set(pm25)
-                metrics['pm25_alert'].set(1 if pm25 > 0 else 0)
-                if 'pm25' in last_values:
-                    time_diff = max(current_time - self.last_update_time[sensor_id], 0.1)
-                    metrics['pm25_rate'].set((pm25 - last_values['pm25']) / time_diff)
-                if len(sensor_history['pm25']) >= 2:
-                    data = list(sensor_history['pm25'])
-                    metrics['pm25_stddev'].set(statistics.stdev(data))
-                last_values['pm25'] = pm25
-
-            if 'TemperatureC' in new_data:
-                temp = float(new_data['TemperatureC'])
-                sensor_history['temperature_c'].append(temp)
-                metrics['temperature_c'].set(temp)
-                if 'temperature_c' in last_values:
-                    time_diff = max(current_time - self.last_update_time[sensor_id], 0.1)
-                    metrics['temp_rate'].set((temp - last_values['temperature_c']) / time_diff)
-                if len(sensor_history['temperature_c']) >= 10:
-                    data = list(sensor_history['temperature_c'])
-                    std = statistics.stdev(data)
-                    metrics['temp_stddev'].set(std)
-                    metrics['temp_upper_quantile'].set(np.percentile(data, 95))
-                    metrics['temp_lower_quantile'].set(np.percentile(data, 5))
-                    mean = statistics.mean(data)
-                    metrics['temp_upper_stddev'].set(mean + 2 * std)
-                    metrics['temp_lower_stddev'].set(mean - 2 * std)
-                if len(sensor_history['temperature_c']) >= self.trend_window:
-                    metrics['temp_trend'].set(
-                        self.calculate_trend(
-                            sensor_history['temperature_c'],
-                            sensor_history['timestamps']
-                        )
-                    )
-                if len(sensor_history['temperature_c']) >= self.window_size:
-                    self.calculate_correlations(sensor_id)
-                    metrics['temp_humidity_corr'].set(
-                        self.get_correlation_metric(sensor_id, 'temp', 'humidity')
-                    )
-                last_values['temperature_c'] = temp
-
-            if 'Humidity' in new_data:
-                humidity = float(new_data['Humidity'])
-                sensor_history['humidity'].append(humidity)
-                metrics['humidity'].set(humidity)
-                if 'humidity' in last_values:
-                    time_diff = max(current_time - self.last_update_time[sensor_id], 0.1)
-                    metrics['humidity_rate'].set((humidity - last_values['humidity']) / time_diff)
-                if len(sensor_history['humidity']) >= 15:
-                    data = list(sensor_history['humidity'])
-                    metrics['humidity_upper_quantile'].set(np.percentile(data, 95))
-                    metrics['humidity_lower_quantile'].set(np.percentile(data, 5))
-                if len(sensor_history['humidity']) >= self.trend_window:
-                    metrics['humidity_trend'].set(
-                        self.calculate_trend(
-                            sensor_history['humidity'],
-                            sensor_history['timestamps']
-                        )
-                    )
-                last_values['humidity'] = humidity
-
-            if 'DewPointC' in new_data:
-                dew_point = float(new_data['DewPointC'])
-                sensor_history['dew_point_c'].append(dew_point)
-                metrics['dew_point_c'].set(dew_point)
-                if 'dew_point_c' in last_values:
-                    time_diff = max(current_time - self.last_update_time[sensor_id], 0.1)
-                    metrics['dew_point_rate'].set((dew_point - last_values['dew_point_c']) / time_diff)
-                if len(sensor_history['dew_point_c']) >= 10:
-                    data = list(sensor_history['dew_point_c'])
-                    metrics['dew_point_upper_quantile'].set(np.percentile(data, 95))
-                    metrics['dew_point_lower_quantile'].set(np.percentile(data, 5))
-                if len(sensor_history['dew_point_c']) >= self.trend_window:
-                    metrics['dew_point_trend'].set(
-                        self.calculate_trend(
-                            sensor_history['dew_point_c'],
-                            sensor_history['timestamps']
-                        )
-                    )
-                last_values['dew_point_c'] = dew_point
-
-            self.last_update_time[sensor_id] = current_time
-
+            with sensor_history['lock']:
+                current_time = time.time()
+                last_values = sensor_history['last_values']
+                rates = sensor_history['rates']
+                time_diff = max(current_time - self.last_update_time[sensor_id], 0.1)
+                for name, rate in self.RATES:
+                    value = getattr(reading, name)
+                    if value is None:
+                        continue
+                    if name in last_values:
+                        rates[rate] = (value - last_values[name]) / time_diff
+                    last_values[name] = value
+                self._record(sensor_id, reading)
+                sensor_history['last_reading'] = reading
+                sensor_history['version'] += 1
+                self.last_update_time[sensor_id] = current_time
         except Exception as e:
             logger.error(f"Error processing metrics for {sensor_id}: {str(e)}")
 
+    def snapshot(self, sensor_id: str) -> Dict[str, float]:
+        """Текущие значения всех метрик датчика (ключи metricsPromet.SENSOR_METRICS).
+
+        Результат кешируется до следующего показания, поэтому производные величины
+        считаются не чаще одного раза между опросами.
+        """
+        sensor_history = self.sensor_data[sensor_id]
+        with sensor_history['lock']:
+            version, values = sensor_history['snapshot']
+            if version == sensor_history['version']:
+                return values
+            values = self._compute_snapshot(sensor_id, sensor_history)
+            sensor_history['snapshot'] = (sensor_history['version'], values)
+            return values
+
+    def _compute_snapshot(self, sensor_id, sensor_history):
+        values = dict(sensor_history['rates'])
+        reading = sensor_history['last_reading']
+        if reading is None:
+            return values
+        for name in ('pm25', 'humidity', 'temperature_c', 'temperature_f', 'dew_point_c', 'dew_point_f'):
+            value = getattr(reading, name)
+            if value is not None:
+                values[name] = value
+        values['alarm_status'] = reading.alarm_status
+
+        last_values = sensor_history['last_values']
+        if 'pm25' in last_values:
+            values['pm25_alert'] = 1 if last_values['pm25'] > 0 else 0
+        moments = sensor_history['moments']['pm25']
+        if moments.n >= 2:
+            values['pm25_stddev'] = moments.stddev
+
+        history = sensor_history['history']
+        moments = sensor_history['moments']['temperature_c']
+        window = history.present('temperature_c')
+        if len(window) >= 10:
+            std = moments.stddev
+            values['temp_stddev'] = std
+            values['temp_upper_quantile'], values['temp_lower_quantile'] = window_quantiles(window, (95, 5))
+            values['temp_upper_stddev'] = moments.mean + 2 * std
+            values['temp_lower_stddev'] = moments.mean - 2 * std
+
+        window = history.present('humidity')
+        if len(window) >= 15:
+            values['humidity_upper_quantile'], values['humidity_lower_quantile'] = window_quantiles(window, (95, 5))
+
+        window = history.present('dew_point_c')
+        if len(window) >= 10:
+            values['dew_point_upper_quantile'], values['dew_point_lower_quantile'] = window_quantiles(window, (95, 5))
+
+        trends = self.trend_coefficients[sensor_id]
+        for name, key in (('temperature_c', 'temp_trend'), ('humidity', 'humidity_trend'), ('dew_point_c', 'dew_point_trend')):
+            slope = self.calculate_trend(sensor_id, name)
+            if slope is not None:
+                trends[key] = slope
+                values[key] = slope
+
+        if len(sensor_history['history']) >= self.window_size:
+            values['temp_humidity_corr'] = self.get_correlation_metric(sensor_id, 'temp', 'humidity')
+        return values
+
+    def sensor_snapshots(self):
+        for sensor_id in list(self.sensor_data):
+            try:
+                yield sensor_id, self.snapshot(sensor_id)
+            except KeyError:
+                continue
+
+    def expire_idle(self, idle_ttl: float):
+        """Удалить состояние датчиков, от которых нет данных дольше idle_ttl секунд"""
+        limit = time.time() - idle_ttl
+        expired = [sensor_id for sensor_id, seen in list(self.last_update_time.items()) if seen < limit]
+        for sensor_id in expired:
+            self.remove_sensor(sensor_id)
+        return expired
+
 metrics_processor = MetricsProcessor()
\ No newline at end of file
@@ -0,0 +1,78 @@
+import numpy as np
+
+
+class SensorRingBuffer:
+    """Кольцевой буфер истории датчика на numpy: один непрерывный float64-блок
+    (каналы x отсчёты) и int64-столбец времени в миллисекундах.
+
+    Буфер выделяется с запасом slack: пока запас не исчерпан, новые отсчёты пишутся
+    в конец, затем последнее окно одним копированием переносится в начало
+    (амортизированное O(1)). Поэтому окно любого канала всегда непрерывно и
+    window()/timestamps() возвращают представления без копирования.
+    Отсутствующие значения хранятся как NaN.
+    """
+
+    CHANNELS = ('pm25', 'temperature_c', 'humidity', 'dew_point_c')
+    _INDEX = {name: i for i, name in enumerate(CHANNELS)}
+
+    def __init__(self, capacity, slack=None):
+        self.capacity = capacity
+        size = capacity + (slack or max(capacity // 4, 16))
+        self._values = np.full((len(self.CHANNELS), size), np.nan, dtype=np.float64)
+        self._ts = np.zeros(size, dtype=np.int64)
+        self._start = 0
+        self._end = 0
+        self.appended = 0  # номер следующего отсчёта (всего добавлено)
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def nbytes(self):
+        return self._values.nbytes + self._ts.nbytes
+
+    def append(self, ts, row):
+        """Добавить отсчёт (ts в секундах, row в порядке CHANNELS, None - нет значения).
+
+        Возвращает вытесненную строку (список с None вместо NaN) или None.
+        """
+        evicted = None
+        if self._end - self._start == self.capacity:
+            evicted = [None if v != v else v for v in self._values[:, self._start].tolist()]
+            self._start += 1
+        if self._end == self._ts.shape[0]:
+            n = self._end - self._start
+            self._values[:, :n] = self._values[:, self._start:self._end]
+            self._ts[:n] = self._ts[self._start:self._end]
+            self._start, self._end = 0, n
+        self._values[:, self._end] = [np.nan if v is None else v for v in row]
+        self._ts[self._end] = int(ts * 1000)
+        self._end += 1
+        self.appended += 1
+        return evicted
+
+    @property
+    def first(self):
+        """Номер самого старого отсчёта окна"""
+        return self.appended - (self._end - self._start)
+
+    def sample(self, channel, number):
+        """Время (секунды) и значение (NaN - нет значения) отсчёта окна с номером number"""
+        i = self._start + number - self.first
+        return self._ts[i] / 1000, float(self._values[self._INDEX[channel], i])
+
+    def window(self, channel):
+        """Представление окна канала без копирования (может содержать NaN)"""
+        return self._values[self._INDEX[channel], self._start:self._end]
+
+    def present(self, channel):
+        """Значения канала без пропусков"""
+        values = self.window(channel)
+        return values[~np.isnan(values)]
+
+    def timestamps(self):
+        """Время отсчётов окна, мс с эпохи"""
+        return self._ts[self._start:self._end]
+
+    def last(self, channel, count=1):
+        return self.window(channel)[-count:]
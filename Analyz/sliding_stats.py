@@ -0,0 +1,372 @@
+import bisect
+import math
+from collections import deque
+
+import numpy as np
+
+try:
+    from sortedcontainers import SortedList
+except ImportError:
+    SortedList = None
+
+
+class SlidingMoments:
+    """Среднее/дисперсия скользящего окна за O(1) на отсчёт (Уэлфорд с удалением).
+
+    Окно хранит вызывающий код: в push передаётся новое значение и значение,
+    вытесненное из окна (если оно заполнено); любое из них может быть None. Накопленная ошибка округления
+    периодически сбрасывается точным пересчётом через reset(values), что даёт
+    амортизированное O(1) и для окон в десятки тысяч отсчётов.
+    """
+
+    __slots__ = ('n', 'mean', '_m2', '_removals', 'resync_every')
+
+    def __init__(self, resync_every=None):
+        self.resync_every = resync_every
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._removals = 0
+
+    def push(self, value, evicted=None):
+        if value is None:
+            if evicted is not None:
+                self._remove(evicted)
+            return
+        if evicted is None:
+            self.n += 1
+            delta = value - self.mean
+            self.mean += delta / self.n
+            self._m2 += delta * (value - self.mean)
+            return
+        # Замена вытесненного значения новым при неизменном n
+        old_mean = self.mean
+        self.mean += (value - evicted) / self.n
+        self._m2 += (value - evicted) * (value - self.mean + evicted - old_mean)
+        if self._m2 < 0.0:
+            self._m2 = 0.0
+        self._removals += 1
+
+    def _remove(self, value):
+        self.n -= 1
+        self._removals += 1
+        if self.n == 0:
+            self.mean = 0.0
+            self._m2 = 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / self.n
+        self._m2 -= delta * (value - self.mean)
+        if self._m2 < 0.0:
+            self._m2 = 0.0
+
+    def reset(self, values):
+        """Точный пересчёт по текущему содержимому окна"""
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._removals = 0
+        for value in values:
+            self.push(value)
+
+    @property
+    def stale(self):
+        limit = self.resync_every or max(self.n, 1000)
+        return self._removals >= limit
+
+    @property
+    def variance(self):
+        """Выборочная дисперсия (как statistics.variance)"""
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def pvariance(self):
+        """Дисперсия генеральной совокупности (как np.var)"""
+        return self._m2 / self.n if self.n > 0 else 0.0
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def pstddev(self):
+        return math.sqrt(self.pvariance)
+
+
+class _BisectList:
+    """Запасной вариант SortedList на bisect, если sortedcontainers не установлен (он есть
+    в requirements.txt). Вставка и удаление здесь O(n) из-за сдвига списка, а не O(log n),
+    поэтому годится только для небольших окон"""
+
+    __slots__ = ('_items',)
+
+    def __init__(self):
+        self._items = []
+
+    def add(self, value):
+        bisect.insort(self._items, value)
+
+    def remove(self, value):
+        del self._items[bisect.bisect_left(self._items, value)]
+
+    def clear(self):
+        self._items.clear()
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SlidingOrderStats:
+    """Отсортированное скользящее окно: квантили за O(log n), min/max за O(1).
+
+    Окно хранится в sortedcontainers.SortedList; без него - в _BisectList с O(n) на обновление.
+    quantile совпадает с np.percentile(window, q) (линейная интерполяция).
+    """
+
+    __slots__ = ('_sorted',)
+
+    def __init__(self):
+        self._sorted = SortedList() if SortedList is not None else _BisectList()
+
+    def push(self, value, evicted=None):
+        if evicted is not None:
+            self._sorted.remove(evicted)
+        if value is not None:
+            self._sorted.add(value)
+
+    def reset(self, values):
+        self._sorted.clear()
+        for value in values:
+            self._sorted.add(value)
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def quantile(self, q):
+        """q в процентах, как у np.percentile"""
+        n = len(self._sorted)
+        if n == 0:
+            return math.nan
+        position = (n - 1) * q / 100.0
+        lower = int(position)
+        if lower + 1 >= n:
+            return self._sorted[n - 1]
+        fraction = position - lower
+        low, high = self._sorted[lower], self._sorted[lower + 1]
+        return low + (high - low) * fraction
+
+    @property
+    def min(self):
+        return self._sorted[0] if len(self._sorted) else math.nan
+
+    @property
+    def max(self):
+        return self._sorted[-1] if len(self._sorted) else math.nan
+
+
+def window_quantiles(values, qs):
+    """Квантили (q в процентах) массива numpy, как np.percentile(values, qs), - через np.partition
+    без полной сортировки. Для окон кольцевого буфера, считаемых при опросе, а не на каждый отсчёт"""
+    n = len(values)
+    if n == 0:
+        return [math.nan] * len(qs)
+    bounds = []
+    for q in qs:
+        position = (n - 1) * q / 100.0
+        lower = int(position)
+        bounds.append((lower, min(lower + 1, n - 1), position - lower))
+    parted = np.partition(values, sorted({i for lower, upper, _ in bounds for i in (lower, upper)}))
+    result = []
+    for lower, upper, fraction in bounds:
+        low, high = float(parted[lower]), float(parted[upper])
+        result.append(low + (high - low) * fraction)
+    return result
+
+
+class SlidingMinMax:
+    """Минимум и максимум скользящего окна на монотонных очередях, амортизированное O(1)"""
+
+    __slots__ = ('_min', '_max')
+
+    def __init__(self):
+        self._min = deque()
+        self._max = deque()
+
+    def push(self, value, evicted=None):
+        if evicted is not None:
+            if self._min and self._min[0] == evicted:
+                self._min.popleft()
+            if self._max and self._max[0] == evicted:
+                self._max.popleft()
+        if value is None:
+            return
+        while self._min and self._min[-1] > value:
+            self._min.pop()
+        self._min.append(value)
+        while self._max and self._max[-1] < value:
+            self._max.pop()
+        self._max.append(value)
+
+    @property
+    def min(self):
+        return self._min[0] if self._min else math.nan
+
+    @property
+    def max(self):
+        return self._max[0] if self._max else math.nan
+
+
+class SlidingTrend:
+    """Наклон линейной регрессии y(t) канала кольцевого буфера (SensorRingBuffer) по точкам
+    не старше horizon секунд, амортизированное O(1).
+
+    Окно не копируется: хранятся только суммы Σx, Σy, Σxy, Σx² с x = t - origin и номер самой
+    старой учтённой точки, а уходящие из окна точки читаются обратно из буфера. Поэтому push
+    вызывается до history.append той же точки (пока вытесняемый отсчёт ещё в буфере) и для
+    каждого отсчёта, в том числе без значения. Окно тренда не длиннее окна буфера. Начало
+    отсчёта периодически переносится на самую старую точку окна с точным пересчётом сумм.
+    """
+
+    __slots__ = ('history', 'channel', 'horizon', 'n', 'origin', '_tail', '_sx', '_sy', '_sxy', '_sxx', '_removals')
+
+    def __init__(self, history, channel, horizon=600.0):
+        self.history = history
+        self.channel = channel
+        self.horizon = horizon
+        self.n = 0
+        self.origin = None
+        self._tail = history.appended
+        self._sx = self._sy = self._sxy = self._sxx = 0.0
+        self._removals = 0
+
+    def push(self, t, y=None):
+        history = self.history
+        t = int(t * 1000) / 1000  # с точностью буфера, чтобы удаление точно вычитало добавленное
+        # Отсчёт, который буфер вытеснит при добавлении этой точки, из окна тренда уходит сразу
+        evicted = history.first if len(history) == history.capacity else history.first - 1
+        limit = t - self.horizon
+        while self._tail < history.appended:
+            old_t, old_y = history.sample(self.channel, self._tail)
+            if self._tail > evicted and old_t >= limit:
+                break
+            self._tail += 1
+            if old_y != old_y:
+                continue
+            x = old_t - self.origin
+            self.n -= 1
+            self._sx -= x
+            self._sy -= old_y
+            self._sxy -= x * old_y
+            self._sxx -= x * x
+            self._removals += 1
+        if y is None or y != y:
+            return
+        if self.origin is None:
+            self.origin = t
+        x = t - self.origin
+        self.n += 1
+        self._sx += x
+        self._sy += y
+        self._sxy += x * y
+        self._sxx += x * x
+        if self._removals >= max(self.n, 1000):
+            self._recenter(t, y)
+
+    def _recenter(self, t, y):
+        """Точный пересчёт сумм по точкам окна в буфере и новой точке (t, y), ещё не добавленной в него"""
+        lo = self._tail - self.history.first
+        times = self.history.timestamps()[lo:] / 1000
+        values = self.history.window(self.channel)[lo:]
+        present = ~np.isnan(values)
+        times = np.append(times[present], t)
+        values = np.append(values[present], y)
+        self.origin = float(times[0])
+        x = times - self.origin
+        self.n = len(values)
+        self._sx = float(x.sum())
+        self._sy = float(values.sum())
+        self._sxy = float(x @ values)
+        self._sxx = float(x @ x)
+        self._removals = 0
+
+    def slope(self):
+        """Наклон в единицах y в секунду, 0 если окно вырождено"""
+        n = self.n
+        if n < 2:
+            return 0.0
+        denominator = n * self._sxx - self._sx * self._sx
+        if denominator <= 1e-12 * max(n * self._sxx, 1.0):
+            return 0.0
+        return (n * self._sxy - self._sx * self._sy) / denominator
+
+    def slope_per_minute(self):
+        return self.slope() * 60
+
+
+class SlidingCoMoments:
+    """Скользящая матрица ковариаций/корреляций для нескольких каналов за O(k²) на отсчёт.
+
+    Как и SlidingMoments, окно хранит вызывающий код и передаёт вытесненную строку.
+    """
+
+    __slots__ = ('names', '_index', 'n', 'mean', '_c', '_removals')
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self._index = {name: i for i, name in enumerate(self.names)}
+        self.reset(())
+
+    def reset(self, rows):
+        k = len(self.names)
+        self.n = 0
+        self.mean = [0.0] * k
+        self._c = [[0.0] * k for _ in range(k)]
+        self._removals = 0
+        for row in rows:
+            self.push(row)
+
+    def _update(self, row, sign):
+        mean = self.mean
+        k = len(mean)
+        delta = [row[i] - mean[i] for i in range(k)]
+        for i in range(k):
+            mean[i] += sign * delta[i] / self.n
+        for i in range(k):
+            c_i = self._c[i]
+            d_i = sign * delta[i]
+            for j in range(k):
+                c_i[j] += d_i * (row[j] - mean[j])
+
+    def push(self, row, evicted=None):
+        if evicted is not None:
+            self.n -= 1
+            if self.n == 0:
+                self.reset(())
+            else:
+                self._update(evicted, -1.0)
+            self._removals += 1
+        if row is not None:
+            self.n += 1
+            self._update(row, 1.0)
+
+    @property
+    def stale(self):
+        return self._removals >= max(self.n, 1000)
+
+    def covariance(self, first, second):
+        if self.n < 2:
+            return math.nan
+        return self._c[self._index[first]][self._index[second]] / (self.n - 1)
+
+    def correlation(self, first, second):
+        i, j = self._index[first], self._index[second]
+        denominator = self._c[i][i] * self._c[j][j]
+        if self.n < 2 or denominator <= 0.0:
+            return math.nan
+        return self._c[i][j] / math.sqrt(denominator)
+
+    def matrix(self):
+        return {a: {b: self.correlation(a, b) for b in self.names} for a in self.names}
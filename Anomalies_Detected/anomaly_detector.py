@@ -1,39 +1,108 @@
-from pymongo import MongoClient
 from datetime import datetime
 from dotenv import load_dotenv
+from collections import deque
 import os
-import numpy as np
+import threading
+from Analyz.sliding_stats import SlidingOrderStats
+from event_bus import bus, ANOMALY_STARTED, ANOMALY_ENDED
+from metricsPromet import anomaly_events, anomally_detected
 
-# Подключение к MongoDB
 load_dotenv()
-MONGO_URL = os.getenv("MONGO_URL")
-MONGO_DB = os.getenv("MONGO_DB")
-MONGO_COLLECTION = os.getenv("MONGO_COLLECTION")
-ANOMALY_COLLECTION = os.getenv("ANOMALY_COLLECTION")
-client = MongoClient(MONGO_URL)
-db = client[MONGO_DB]
-sensors_collection = db[MONGO_COLLECTION]
-anomalies_collection = db[ANOMALY_COLLECTION]
-
 
 SENSOR_IDS = ["000DE0163B57", "000DE0163B59", "000DE0163B58", "000DE0163B56"]
 
-# Глобальный словарь для отслеживания состояний аномалий
+# Глобальный словарь для отслеживания состояний аномалий (датчики добавляются при первом показании).
+# Состояние датчика меняет только его рабочий поток MQTT.
 anomaly_states = {sensor_id: False for sensor_id in SENSOR_IDS}
+analysis_enabled = True
 
-# Функция вычисления динамических границ
-def calculate_dynamic_bounds(sensor_id):
-    data = list(sensors_collection.find({"sensor_id": sensor_id}).sort("timestamp", -1).    limit(100))
+# Размер окна для IQR-границ (последние N значений датчика)
+ANOMALY_WINDOW = int(os.getenv("ANOMALY_WINDOW", "100"))
+
+
+class SensorWindow:
+    """Последние значения датчика в отсортированном окне: квартили за O(log n)"""
+
+    __slots__ = ('values', 'order', 'lock')
+
+    def __init__(self, size):
+        self.values = deque(maxlen=size)
+        self.order = SlidingOrderStats()
+        self.lock = threading.Lock()
+
+    def push(self, value):
+        with self.lock:
+            evicted = self.values[0] if len(self.values) == self.values.maxlen else None
+            self.values.append(value)
+            self.order.push(value, evicted)
+
+    def quartiles(self):
+        with self.lock:
+            if len(self.order) < 10:
+                return None, None  # Недостаточно данных
+            return self.order.quantile(25), self.order.quantile(75)
 
-    if not data:
-        return None, None  # Нет данных
 
-    values = [entry["value"] for entry in data if "value" in entry]
+# Окна значений по датчикам, заполняются из потока MQTT через observe()
+sensor_windows = {}
+_windows_lock = threading.Lock()
 
-    if len(values) < 10:
-        return None, None  # Недостаточно данных
 
-    q1, q3 = np.percentile(values, [25, 75])
+def observe(sensor_id, value):
+    """Учесть новое значение датчика в окне для динамических границ"""
+    if value is None:
+        return
+    window = sensor_windows.get(sensor_id)
+    if window is None:
+        with _windows_lock:
+            window = sensor_windows.setdefault(sensor_id, SensorWindow(ANOMALY_WINDOW))
+    window.push(value)
+
+
+def forget(sensor_id):
+    sensor_windows.pop(sensor_id, None)
+    anomaly_states.pop(sensor_id, None)
+
+
+class AnomalyEvent:
+    """Событие начала/окончания аномалии, публикуется в event_bus"""
+
+    __slots__ = ('sensor_id', 'started', 'timestamp', 'value', 'pm25', 'alarm_status')
+
+    def __init__(self, sensor_id, started, timestamp, value, pm25, alarm_status):
+        self.sensor_id = sensor_id
+        self.started = started
+        self.timestamp = timestamp
+        self.value = value
+        self.pm25 = pm25
+        self.alarm_status = alarm_status
+
+    def to_document(self):
+        return {
+            "sensor_id": self.sensor_id,
+            "MsgTimeStamp": self.timestamp,
+            "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+            "data": {
+                "TemperatureC": self.value,
+                "PM25": self.pm25,
+                "AlarmStatus": self.alarm_status
+            }
+        }
+
+    def __repr__(self):
+        kind = "start" if self.started else "end"
+        return f"AnomalyEvent({kind}, {self.sensor_id}, {self.timestamp})"
+
+
+# Функция вычисления динамических границ
+def calculate_dynamic_bounds(sensor_id):
+    window = sensor_windows.get(sensor_id)
+    if window is None:
+        return None, None  # Нет данных
+
+    q1, q3 = window.quartiles()
+    if q1 is None:
+        return None, None
     iqr = q3 - q1
     lower_bound = q1 - 1.5 * iqr  # Оптимальная граница
     upper_bound = q3 + 1.5 * iqr  # Экстремальная граница
@@ -46,46 +115,55 @@ def check_anomaly(sensor_id, value, pm25, alarm_status):
     is_anomaly = False
 
     if lower_bound is not None and upper_bound is not None:
-        if value < lower_bound or value > upper_bound:
+        if value is not None and (value < lower_bound or value > upper_bound):
             is_anomaly = True  # Выход за границы
 
-    if alarm_status == "On" or pm25 != "0":
+    if alarm_status == "On" or (pm25 is not None and float(pm25) != 0):
         is_anomaly = True  # Условия аномалии
 
     return is_anomaly
 
-# Функция обработки новых данных
-def process_sensor_data(sensor_id, value, pm25, alarm_status):
-    global anomaly_states
+# Функция обработки новых данных: этап конвейера MQTT, вызывается для каждого показания
+def process_sensor_data(sensor_id, value, pm25, alarm_status, timestamp=None):
+    observe(sensor_id, value)
+    if not analysis_enabled:
+        return False
 
     is_anomaly = check_anomaly(sensor_id, value, pm25, alarm_status)
+    active = anomaly_states.get(sensor_id, False)
 
-    if is_anomaly and not anomaly_states[sensor_id]:
+    if is_anomaly and not active:
         # Фиксируем начало аномалии
         anomaly_states[sensor_id] = True
-        anomaly_record = {
-            "sensor_id": sensor_id,
-            "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-            "data": {
-                "TemperatureC": value,
-                "PM25": pm25,
-                "AlarmStatus": alarm_status
-            }
-        }
-        anomalies_collection.insert_one(anomaly_record)
-        print(f"⚠ Аномалия зафиксирована: {anomaly_record}")
+        event = AnomalyEvent(sensor_id, True, timestamp or datetime.now(), value, pm25, alarm_status)
+        print(f"⚠ Аномалия зафиксирована: {event}")
+        bus.publish(ANOMALY_STARTED, event)
         return True  # Возвращаем True, если аномалия обнаружена
 
-    elif not is_anomaly and anomaly_states[sensor_id]:
+    elif not is_anomaly and active:
         # Завершаем аномалию
         anomaly_states[sensor_id] = False
         print(f"✅ Аномалия на датчике {sensor_id} закончилась.")
+        bus.publish(ANOMALY_ENDED, AnomalyEvent(sensor_id, False, timestamp or datetime.now(), value, pm25, alarm_status))
         return False  # Возвращаем False, если аномалия завершена
 
     return False  # Возвращаем False, если аномалии нет
 
+
+# Подписчики событий аномалий
+def subscribe_anomaly_writer(writer):
+    """Запись начала аномалий в коллекцию аномалий через фоновый MongoBatchWriter"""
+    return bus.subscribe(ANOMALY_STARTED, lambda event: writer.submit(event.to_document()))
+
+
+def subscribe_anomaly_metrics():
+    anomally_detected.set_function(lambda: sum(anomaly_states.values()))
+    bus.subscribe(ANOMALY_STARTED, lambda event: anomaly_events.labels(sensor=event.sensor_id, event="start").inc())
+    bus.subscribe(ANOMALY_ENDED, lambda event: anomaly_events.labels(sensor=event.sensor_id, event="end").inc())
+
+
 # Функция для включения/выключения анализа
 def toggle_analysis():
     global analysis_enabled
     analysis_enabled = not analysis_enabled
-    return analysis_enabled
\ No newline at end of file
+    return analysis_enabled
@@ -1,17 +1,22 @@
 from pymongo import MongoClient
 import matplotlib.pyplot as plt
 import numpy as np
-from datetime import datetime
+import pandas as pd
+from datetime import timedelta
+from sensor_repository import SensorRepository
+from rollups import RESOLUTIONS, RollupRepository
+from downsample import downsample_indices
 
-def plot_sensor_data(ax, timestamps, values, sensor_name, value_name):
+def plot_sensor_data(ax, timestamps, values, sensor_name, value_name, summary=None):
     if len(values) > 0:
-        min_val = min(values)
-        max_val = max(values)
+        # Точные min/max/среднее за всю историю берутся из суточных агрегатов, если они переданы
+        min_val = summary["min"] if summary else min(values)
+        max_val = summary["max"] if summary else max(values)
         x_indices = range(len(values))
         ax.plot(x_indices, values, 'b-', linewidth=1)
         ax.axhline(y=min_val, color='r', linestyle='--', label=f'{min_val:.2f}')
         ax.axhline(y=max_val, color='g', linestyle='--', label=f'{max_val:.2f}')
-        mean_value = np.mean(values)
+        mean_value = summary["mean"] if summary else np.mean(values)
         ax.axhline(y=mean_value, color='m', linestyle=':', label=f'{mean_value:.2f}')
         start_time = timestamps[0].strftime('%H:%M:%S')
         end_time = timestamps[-1].strftime('%H:%M:%S')
@@ -24,18 +29,45 @@ def plot_sensor_data(ax, timestamps, values, sensor_name, value_name):
     else:
         ax.text(0.5, 0.5, f'Нет данных для датчика {sensor_name}', ha='center', va='center')
 
+def hourly_frame(repository, rollups, mac, field, start, end):
+    """Почасовые корзины [start, end): агрегаты rollup_hour, а части окна, которые они не покрывают
+    (история до включения агрегатов, backfill не запускался), - группировка показаний на сервере.
+    Второй элемент - покрыто ли окно агрегатами целиком"""
+    df = rollups.frame(mac, start, end, fields=(field,), resolution="hour")
+    gaps = rollups.missing(df, start, end, "hour")
+    parts = [df]
+    for lo, hi in gaps:
+        print(f"Агрегаты {mac} не покрывают {lo:%Y-%m-%d %H:%M} - {hi:%Y-%m-%d %H:%M}, дополняю из показаний")
+        parts.append(repository.buckets(mac, lo, hi, fields=(field,), width=RESOLUTIONS["hour"][0]))
+    parts = [part for part in parts if not part.empty]
+    if len(parts) > 1:
+        df = pd.concat(parts, ignore_index=True).sort_values("start", ignore_index=True)
+    elif parts:
+        df = parts[0]
+    return df.dropna(subset=[field]), not gaps
+
+
+def frame_summary(df, field):
+    """min/max по почасовым корзинам (точные), среднее - взвешенное по числу показаний в корзине"""
+    if df.empty:
+        return None
+    weights = df["count"].to_numpy(dtype=float)
+    return {"min": float(df[f"{field}_min"].min()), "max": float(df[f"{field}_max"].max()),
+            "mean": float(np.average(df[field], weights=weights)) if weights.sum() else df[field].mean(),
+            "count": int(weights.sum())}
+
+
 def main():
     DB_NAME = "mqtt_database"
     COLLECTION_NAME = "your_collection"
-    MAC_FIELD = "MacAddress"
     VALUE_FIELD = "Humidity"
-    TIME_FIELD = "MsgTimeStamp"
 
     client = MongoClient('mongodb://localhost:27017/', connectTimeoutMS=30000)
     db = client[DB_NAME]
-    collection = db[COLLECTION_NAME]
+    repository = SensorRepository(db[COLLECTION_NAME])
+    rollups = RollupRepository(db)
 
-    mac_addresses = collection.distinct(MAC_FIELD)
+    mac_addresses = repository.sensors()
 
     if not mac_addresses:
         print("В базе данных не найдено ни одного датчика.")
@@ -50,22 +82,25 @@ def main():
         row = i // 2
         col = i % 2
         ax = axes[row][col]
-        query = {MAC_FIELD: mac}
-        projection = {VALUE_FIELD: 1, TIME_FIELD: 1, "_id": 0}
-        cursor = collection.find(query, projection).sort(TIME_FIELD, 1).limit(10000000)
-
-        values = []
-        timestamps = []
-        for doc in cursor:
-            try:
-                val = float(doc[VALUE_FIELD])
-                ts = datetime.fromisoformat(doc[TIME_FIELD])
-                values.append(val)
-                timestamps.append(ts)
-            except (ValueError, KeyError, TypeError):
-                continue
+        # Линия - почасовые средние, границы - по суточным агрегатам, если они покрывают всю историю
+        first, last = repository.time_bounds(mac)
+        if first is None:
+            plot_sensor_data(ax, [], [], mac[-4:], VALUE_FIELD)
+            continue
+        df, covered = hourly_frame(repository, rollups, mac, VALUE_FIELD,
+                                   first.replace(minute=0, second=0, microsecond=0), last + timedelta(hours=1))
+        days = rollups.days(mac)
+        if covered and days and days[0] <= first.date():
+            summary = rollups.summary(mac, VALUE_FIELD)
+        else:
+            # Суточные агрегаты неполные - их min/max не точные, считаем по почасовому ряду
+            summary = frame_summary(df, VALUE_FIELD)
+        # Огибающая min/max почасовых средних: число точек не зависит от длины истории, пики сохраняются
+        index = downsample_indices(df["start"], df[VALUE_FIELD], mode="minmax")
+        values = df[VALUE_FIELD].to_numpy()[index]
+        timestamps = df["start"].iloc[index].tolist()
 
-        plot_sensor_data(ax, timestamps, values, mac[-4:], VALUE_FIELD)
+        plot_sensor_data(ax, timestamps, values, mac[-4:], VALUE_FIELD, summary)
 
     plt.tight_layout(rect=[0, 0, 1, 0.96])
     plt.show()
@@ -1,31 +1,61 @@
-import pandas as pd
-from tkinter import messagebox
+from datetime import datetime, time, timedelta
 
 import pymongo
 
 import os
 
-def parse_and_plot_mongodb_data(database_name, collection_name, mac_address):
-    client = pymongo.MongoClient(os.getenv("MONGO_URL"))
-    db = client[database_name]
-    collection = db[collection_name]
-
-    query = {"MacAddress": mac_address}
-    results = collection.find(query)
-    #
-    data = []
-    for result in results:
-        data.append({
-            "MsgTimeStamp": pd.to_datetime(result["MsgTimeStamp"]),
-            "Humidity": float(result["Humidity"]),
-            "TemperatureC": float(result["TemperatureC"]),
-            "TemperatureF": float(result["TemperatureF"]),
-            "DewPointC": float(result["DewPointC"]),
-            "DewPointF": float(result["DewPointF"]),
-        })
-
-    if not data:
-        return pd.DataFrame()
-
-    df = pd.DataFrame(data)
-    return df
\ No newline at end of file
+from downsample import DEFAULT_POINTS
+from rollups import RollupRepository
+from sensor_repository import SensorRepository
+
+FIELDS = ("MsgTimeStamp", "Humidity", "TemperatureC", "TemperatureF", "DewPointC", "DewPointF")
+
+
+class SensorHistoryLoader:
+    """Данные датчиков для GUI: каталог суток и суточные ряды для графика. Показания целиком
+    не загружаются - и то и другое считается на сервере."""
+
+    def __init__(self, database_name, collection_name, mongo_url=None):
+        self.client = pymongo.MongoClient(mongo_url or os.getenv("MONGO_URL"))
+        self.repository = SensorRepository(self.client[database_name][collection_name])
+        self.rollups = RollupRepository(self.client[database_name])
+
+    def dates(self, mac_address):
+        """Каталог суток датчика без загрузки показаний: суточные агрегаты, а сутки до их
+        появления (история до включения агрегатов) - группировкой на сервере"""
+        first, _ = self.repository.time_bounds(mac_address)
+        if first is None:
+            return []
+        days = self.rollups.days(mac_address)
+        if not days or first.date() < days[0]:
+            end = datetime.combine(days[0], time()) if days else None
+            days = self.repository.days(mac_address, end=end) + days
+        return days
+
+    def day_series(self, mac_address, day, max_points=DEFAULT_POINTS):
+        """Сутки для графика, сгруппированные по корзинам на сервере: не больше max_points точек
+        с first/min/max/среднее/last на корзину"""
+        start = datetime.combine(day, time())
+        return self.repository.buckets(mac_address, start, start + timedelta(days=1), fields=FIELDS[1:],
+                                       max_points=max_points)
+
+    def close(self):
+        self.client.close()
+
+
+_loaders = {}
+
+
+def get_loader(database_name, collection_name):
+    """Общий загрузчик (и клиент MongoDB) на пару база/коллекция"""
+    key = (database_name, collection_name)
+    if key not in _loaders:
+        _loaders[key] = SensorHistoryLoader(database_name, collection_name)
+    return _loaders[key]
+
+
+def parse_and_plot_mongodb_data(database_name, collection_name, mac_address, start=None, end=None):
+    """Показания датчика за [start, end) (по умолчанию - вся история) одним DataFrame.
+    Прежняя публичная точка входа: читает столбцами через SensorRepository, без кэша истории"""
+    repository = get_loader(database_name, collection_name).repository
+    return repository.frame(mac_address, start, end, fields=FIELDS, raw=True)
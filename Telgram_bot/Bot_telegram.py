@@ -9,10 +9,16 @@ from pymongo import MongoClient
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
 import io
+import pandas as pd
 import requests
 import re
 from prometheus_client import Gauge
-from Anomalies_Detected.anomaly_detector import process_sensor_data, toggle_analysis
+from Anomalies_Detected.anomaly_detector import toggle_analysis
+from event_bus import bus, ANOMALY_STARTED, ANOMALY_ENDED
+from sensor_repository import SensorRepository
+from rollups import RESOLUTIONS, RollupRepository
+from downsample import DEFAULT_POINTS, downsample
+from prom_query import PrometheusQueryClient, RangeQueryCache
 
 load_dotenv()
 BOT_TOKEN = os.getenv("TELEGRAM_TOKEN")
@@ -22,207 +28,50 @@ MONGO_URL = os.getenv("MONGO_URL")
 MONGO_DB = os.getenv("MONGO_DB")
 MONGO_COLLECTION = os.getenv("MONGO_COLLECTION")
 ANOMALY_COLLECTION = os.getenv("ANOMALY_COLLECTION")
+# Чаты для уведомлений об аномалиях; чаты, отправившие /start, добавляются автоматически
+ALERT_CHAT_IDS = {int(chat_id) for chat_id in os.getenv("TELEGRAM_ALERT_CHATS", "").split(",") if chat_id.strip()}
 
 client = MongoClient(MONGO_URL)
 db = client[MONGO_DB]
 sensors_collection = db[MONGO_COLLECTION]
+sensor_repository = SensorRepository(sensors_collection)
+# Графики строятся по агрегатам (поминутные средние за 24 часа), а не по сырым показаниям
+sensor_rollups = RollupRepository(db)
+CHART_FIELDS = ("TemperatureC", "Humidity", "DewPointC")
 anomalies_collection = db[ANOMALY_COLLECTION]
+# Запросы к Prometheus - асинхронно, по общему пулу соединений, не блокируя цикл событий бота;
+# окна графиков аномалий кэшируются, из Prometheus догружается только новый хвост
+prometheus = PrometheusQueryClient(PROMETHEUS_URL, cache=RangeQueryCache())
 
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 
-analysis_enabled = True
 SENSOR_IDS = ["000DE0163B57", "000DE0163B59", "000DE0163B58", "000DE0163B56"]
-
-
-def query_prometheus(metric_name, start_time, end_time, step="2m"):
-    try:
-        query = f'{metric_name}'
-        params = {
-            "query": query,
-            "start": start_time.timestamp(),
-            "end": end_time.timestamp(),
-            "step": step
-        }
-        response = requests.get(f"{PROMETHEUS_URL}/api/v1/query_range", params=params)
-        response.raise_for_status()
-        result = response.json()
-        if result["status"] == "success" and result["data"]["result"]:
-            values = result["data"]["result"][0]["values"]
-            return [(float(timestamp), float(value)) for timestamp, value in values]
-        return []
-    except Exception as e:
-        logging.error(f"Ошибка при запросе Prometheus: {e}")
-        return []
-
-
-def send_test_timeseries(metric_name, values, timestamps):
-    try:
-        data = ""
-        for ts, value in zip(timestamps, values):
-            data += f'{metric_name} {value} {int(ts.timestamp() * 1000)}\n'
-        response = requests.post(f"{PUSHGATEWAY_URL}/metrics/job/test_job", data=data)
-        response.raise_for_status()
-        logging.info(f"Тестовый временной ряд для {metric_name} отправлен")
-    except Exception as e:
-        logging.error(f"Ошибка при отправке временного ряда в Pushgateway: {e}")
-
-
-async def send_test_alert_graph(chat_id):
-    end_time = datetime.now()
-    start_time = end_time - timedelta(minutes=10)
-
-    test_data = query_prometheus('anomaly_test', start_time, end_time)
-
-    if not test_data:
-        await application.bot.send_message(chat_id=chat_id,
-                                           text="⚠ Нет данных для anomaly_test за последние 10 минут в Prometheus.")
-        return
-
-    timestamps = [datetime.fromtimestamp(ts) for ts, _ in test_data]
-    values = [value for _, value in test_data]
-
-    plt.figure(figsize=(8, 4))
-    plt.plot(timestamps, values, label="anomaly_test", color="blue", marker="o")
-    plt.axhline(y=1.0, color="red", linestyle="--", label="Порог алерта")
-    if values:
-        plt.plot(timestamps[-1], values[-1], 'bo', markersize=10, label="Последняя точка")
-    plt.title("Тестовый алерт (anomaly_test) за последние 10 минут")
-    plt.xlabel("Время")
-    plt.ylabel("Значение")
-    plt.legend()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png")
-    buf.seek(0)
-    plt.close()
-
-    await application.bot.send_photo(chat_id=chat_id, photo=buf, caption="График тестового алерта (anomaly_test)")
-
-
-# тест построения графика в интервал
-async def send_anomaly_graph(chat_id, sensor_id):
-    end_time = datetime.now()
-    start_time = end_time - timedelta(minutes=30)
-
-    temp_data = query_prometheus(f'mqtt_{sensor_id}_temperature_c', start_time, end_time)
-    humidity_data = query_prometheus(f'mqtt_{sensor_id}_humidity', start_time, end_time)
-    dewpoint_data = query_prometheus(f'mqtt_{sensor_id}_dew_point_c', start_time, end_time)
-
-    temp_upper = query_prometheus(f'mqtt_{sensor_id}_temp_upper_q', start_time, end_time)[-1][1] if query_prometheus(
-        f'mqtt_{sensor_id}_temp_upper_q', start_time, end_time) else 30.0
-    temp_lower = query_prometheus(f'mqtt_{sensor_id}_temp_lower_q', start_time, end_time)[-1][1] if query_prometheus(
-        f'mqtt_{sensor_id}_temp_lower_q', start_time, end_time) else 10.0
-    humidity_upper = query_prometheus(f'mqtt_{sensor_id}_humidity_upper_q', start_time, end_time)[-1][
-        1] if query_prometheus(f'mqtt_{sensor_id}_humidity_upper_q', start_time, end_time) else 80.0
-    humidity_lower = query_prometheus(f'mqtt_{sensor_id}_humidity_lower_q', start_time, end_time)[-1][
-        1] if query_prometheus(f'mqtt_{sensor_id}_humidity_lower_q', start_time, end_time) else 20.0
-    dewpoint_upper = query_prometheus(f'mqtt_{sensor_id}_dew_point_upper_q', start_time, end_time)[-1][
-        1] if query_prometheus(f'mqtt_{sensor_id}_dew_point_upper_q', start_time, end_time) else 20.0
-    dewpoint_lower = query_prometheus(f'mqtt_{sensor_id}_dew_point_lower_q', start_time, end_time)[-1][
-        1] if query_prometheus(f'mqtt_{sensor_id}_dew_point_lower_q', start_time, end_time) else 0.0
-
-    if not temp_data or not humidity_data or not dewpoint_data:
-        await application.bot.send_message(chat_id=chat_id,
-                                           text=f"⚠ Нет данных для датчика {sensor_id} за последние 30 минут в Prometheus.")
-        return
-
-    timestamps = [datetime.fromtimestamp(ts) for ts, _ in temp_data]
-    temperature = [value for _, value in temp_data]
-    humidity = [value for _, value in humidity_data]
-    dewpoint = [value for _, value in dewpoint_data]
-
-    plt.figure(figsize=(10, 8))
-
-    plt.subplot(3, 1, 1)
-    plt.plot(timestamps, temperature, label="Температура (°C)", color="red", marker="o")
-    plt.axhline(y=temp_upper, color="orange", linestyle="--", label="Верхняя граница (95%)")
-    plt.axhline(y=temp_lower, color="purple", linestyle="--", label="Нижняя граница (5%)")
-    if temperature:
-        plt.plot(timestamps[-1], temperature[-1], 'ro', markersize=10, label="Аномалия")
-    plt.title(f"Датчик {sensor_id} - Температура (последние 30 минут)")
-    plt.xlabel("Время")
-    plt.ylabel("Температура (°C)")
-    plt.legend()
-
-    plt.subplot(3, 1, 2)
-    plt.plot(timestamps, humidity, label="Влажность (%)", color="blue", marker="o")
-    plt.axhline(y=humidity_upper, color="orange", linestyle="--", label="Верхняя граница (95%)")
-    plt.axhline(y=humidity_lower, color="purple", linestyle="--", label="Нижняя граница (5%)")
-    if humidity:
-        plt.plot(timestamps[-1], humidity[-1], 'bo', markersize=10, label="Аномалия")
-    plt.title(f"Датчик {sensor_id} - Влажность")
-    plt.xlabel("Время")
-    plt.ylabel("Влажность (%)")
-    plt.legend()
-
-    plt.subplot(3, 1, 3)
-    plt.plot(timestamps, dewpoint, label="Точка росы (°C)", color="green", marker="o")
-    plt.axhline(y=dewpoint_upper, color="purple", linestyle="--", label="Верхняя граница (95%)")
-    plt.axhline(y=dewpoint_lower, color="orange", linestyle="--", label="Нижняя граница (5%)")
-    if dewpoint:
-        plt.plot(timestamps[-1], dewpoint[-1], 'go', markersize=10, label="Аномалия")
-    plt.title(f"Датчик {sensor_id} - Точка росы")
-    plt.xlabel("Время")
-    plt.ylabel("Точка росы (°C)")
-    plt.legend()
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png")
-    buf.seek(0)
-    plt.close()
-
-    await application.bot.send_photo(chat_id=chat_id, photo=buf,
-                                     caption=f"График аномалии для {sensor_id} за последние 30 минут")
-
-
-# Middleware для перехвата сообщений
-async def message_interceptor(update: Update, context: CallbackContext) -> None:
-    if update.message and update.message.text:
-        message_text = update.message.text
-        if "🚨" in message_text or "⚠️" in message_text:
-            match = re.search(r"Датчик: ([^\s]+)", message_text)
-            if match:
-                sensor_id = match.group(1)
-                if sensor_id in SENSOR_IDS:
-                    await send_anomaly_graph(update.message.chat_id, sensor_id)
-        elif "Тестовый алерт" in message_text:
-            await send_test_alert_graph(update.message.chat_id)
-
-
-# /test_alert запуск
-async def test_alert(update: Update, context: CallbackContext) -> None:
-    end_time = datetime.now()
-    start_time = end_time - timedelta(minutes=10)
-    num_points = 5
-    timestamps = [start_time + timedelta(minutes=i * 10 / (num_points - 1)) for i in range(num_points)]
-    test_values = [0.0] * (num_points - 1) + [1.0]
-    send_test_timeseries("anomaly_test", test_values, timestamps)
-    test_alert.set(1.0)
-    await update.message.reply_text(
-        f"✅ Тестовый временной ряд для anomaly_test отправлен. Ожидайте алерт и график через ~5 минут.",
-        parse_mode="HTML"
-    )
-
-# geter из prometheus
-def query_prometheus(metric_name, start_time, end_time, step="2m"):
-    try:
-        query = f'{metric_name}'
-        params = {
-            "query": query,
-            "start": start_time.timestamp(),
-            "end": end_time.timestamp(),
-            "step": step
-        }
-        response = requests.get(f"{PROMETHEUS_URL}/api/v1/query_range", params=params)
-        response.raise_for_status()
-        result = response.json()
-        if result["status"] == "success" and result["data"]["result"]:
-            values = result["data"]["result"][0]["values"]
-            return [(float(timestamp), float(value)) for timestamp, value in values]
-        return []
-    except Exception as e:
-        logging.error(f"Ошибка при запросе Prometheus: {e}")
-        return []
+# Метрики графика аномалии: сначала показания, затем границы (квантили)
+ANOMALY_GRAPH_METRICS = tuple(f"mqtt_sensor_{suffix}" for suffix in (
+    "temperature_c", "humidity", "dew_point_c",
+    "temp_upper_q", "temp_lower_q", "humidity_upper_q", "humidity_lower_q", "dew_point_upper_q", "dew_point_lower_q"))
+
+
+def chart_series(sensor_id, start, end):
+    """Ряд для графика: готовые агрегаты rollup_*, а части окна, которые они не покрывают
+    (или всё окно, если агрегатов нет), - группировка показаний по корзинам на сервере.
+    Приходит не больше ~1500 документов"""
+    resolution = sensor_rollups.resolution_for(start, end)
+    frame = sensor_rollups.frame(sensor_id, start, end, fields=CHART_FIELDS, resolution=resolution)
+    parts = [frame]
+    for lo, hi in sensor_rollups.missing(frame, start, end, resolution):
+        if frame.empty:
+            # Агрегатов за окно нет совсем - ширина корзины подбирается под DEFAULT_POINTS
+            parts.append(sensor_repository.buckets(sensor_id, lo, hi, fields=CHART_FIELDS, max_points=DEFAULT_POINTS))
+            continue
+        logging.warning(f"Агрегаты {sensor_id} не покрывают {lo:%Y-%m-%d %H:%M} - {hi:%Y-%m-%d %H:%M}, "
+                        f"дополняю из показаний")
+        parts.append(sensor_repository.buckets(sensor_id, lo, hi, fields=CHART_FIELDS,
+                                               width=RESOLUTIONS[resolution][0]))
+    parts = [part for part in parts if not part.empty]
+    if len(parts) <= 1:
+        return parts[0] if parts else frame
+    return pd.concat(parts, ignore_index=True).sort_values("start", ignore_index=True)
 
 
 ## это для создания job в прометеус
@@ -242,20 +91,20 @@ async def send_test_alert_graph(chat_id):
     end_time = datetime.now()
     start_time = end_time - timedelta(minutes=10)
 
-    test_data = query_prometheus('anomaly_test', start_time, end_time)
+    test_data = await prometheus.query_range('anomaly_test', start_time, end_time)
 
-    if not test_data:
+    if not test_data or not len(test_data[0]):
         await application.bot.send_message(chat_id=chat_id,
                                            text="⚠ Нет данных для anomaly_test за последние 10 минут в Prometheus.")
         return
 
-    timestamps = [datetime.fromtimestamp(ts) for ts, _ in test_data]
-    values = [value for _, value in test_data]
+    timestamps = test_data[0].times()
+    values = test_data[0].values
 
     plt.figure(figsize=(8, 4))
     plt.plot(timestamps, values, label="anomaly_test", color="blue", marker="o")
     plt.axhline(y=1.0, color="red", linestyle="--", label="Порог алерта")
-    if values:
+    if len(values):
         plt.plot(timestamps[-1], values[-1], 'bo', markersize=10, label="Последняя точка")
     plt.title("Тестовый алерт (anomaly_test) за последние 10 минут")
     plt.xlabel("Время")
@@ -275,44 +124,41 @@ async def send_anomaly_graph(chat_id, sensor_id):
     start_time_30 = end_time - timedelta(minutes=30)
     start_time_10 = end_time - timedelta(minutes=10)
 
-    temp_data = query_prometheus(f'mqtt_{sensor_id}_temperature_c', start_time_30, end_time)
-    humidity_data = query_prometheus(f'mqtt_{sensor_id}_humidity', start_time_30, end_time)
-    dewpoint_data = query_prometheus(f'mqtt_{sensor_id}_dew_point_c', start_time_30, end_time)
+    # Показания и границы датчика - один запрос query_range с селектором по именам метрик
+    series = await prometheus.series_by_name(ANOMALY_GRAPH_METRICS, {"sensor": sensor_id}, start_time_30, end_time)
+    data_metrics = ANOMALY_GRAPH_METRICS[:3]
 
     interval = 30
-    if not any([temp_data, humidity_data, dewpoint_data]):
+    if not any(name in series for name in data_metrics):
         interval = 10
-        temp_data = query_prometheus(f'mqtt_{sensor_id}_temperature_c', start_time_10, end_time)
-        humidity_data = query_prometheus(f'mqtt_{sensor_id}_humidity', start_time_10, end_time)
-        dewpoint_data = query_prometheus(f'mqtt_{sensor_id}_dew_point_c', start_time_10, end_time)
+        series.update(await prometheus.series_by_name(data_metrics, {"sensor": sensor_id}, start_time_10, end_time))
 
+    temp_data, humidity_data, dewpoint_data = (series.get(name) for name in data_metrics)
     if not any([temp_data, humidity_data, dewpoint_data]):
         logging.warning(f"Нет данных для датчика {sensor_id} за {interval} минут")
         await application.bot.send_message(chat_id=chat_id,
                                            text=f"⚠ Нет данных для датчика {sensor_id} за последние {interval} минут в Prometheus.")
         return
 
-    temp_upper = query_prometheus(f'mqtt_{sensor_id}_temp_upper_q', start_time_30, end_time)[-1][1] if query_prometheus(
-        f'mqtt_{sensor_id}_temp_upper_q', start_time_30, end_time) else 30.0
-    temp_lower = query_prometheus(f'mqtt_{sensor_id}_temp_lower_q', start_time_30, end_time)[-1][1] if query_prometheus(
-        f'mqtt_{sensor_id}_temp_lower_q', start_time_30, end_time) else 10.0
-    humidity_upper = query_prometheus(f'mqtt_{sensor_id}_humidity_upper_q', start_time_30, end_time)[-1][
-        1] if query_prometheus(f'mqtt_{sensor_id}_humidity_upper_q', start_time_30, end_time) else 80.0
-    humidity_lower = query_prometheus(f'mqtt_{sensor_id}_humidity_lower_q', start_time_30, end_time)[-1][
-        1] if query_prometheus(f'mqtt_{sensor_id}_humidity_lower_q', start_time_30, end_time) else 20.0
-    dewpoint_upper = query_prometheus(f'mqtt_{sensor_id}_dew_point_upper_q', start_time_30, end_time)[-1][
-        1] if query_prometheus(f'mqtt_{sensor_id}_dew_point_upper_q', start_time_30, end_time) else 20.0
-    dewpoint_lower = query_prometheus(f'mqtt_{sensor_id}_dew_point_lower_q', start_time_30, end_time)[-1][
-        1] if query_prometheus(f'mqtt_{sensor_id}_dew_point_lower_q', start_time_30, end_time) else 0.0
+    def bound(suffix, default):
+        item = series.get(f"mqtt_sensor_{suffix}")
+        return item.values[-1] if item else default
+
+    temp_upper = bound("temp_upper_q", 30.0)
+    temp_lower = bound("temp_lower_q", 10.0)
+    humidity_upper = bound("humidity_upper_q", 80.0)
+    humidity_lower = bound("humidity_lower_q", 20.0)
+    dewpoint_upper = bound("dew_point_upper_q", 20.0)
+    dewpoint_lower = bound("dew_point_lower_q", 0.0)
     plt.figure(figsize=(10, 8))
     plot_count = 0
 
     if temp_data:
         plot_count += 1
-        timestamps = [datetime.fromtimestamp(ts) for ts, _ in temp_data]
-        temperature = [value for _, value in temp_data]
+        timestamps = temp_data.times()
+        temperature = temp_data.values
         plt.subplot(3, 1, plot_count)
-        plt.plot(timestamps, temperature, label="Температура (°C)", color="red", marker="o")
+        plt.plot(*downsample(timestamps, temperature), label="Температура (°C)", color="red", marker="o")
         plt.axhline(y=temp_upper, color="orange", linestyle="--", label="Верхняя граница (95%)")
         plt.axhline(y=temp_lower, color="purple", linestyle="--", label="Нижняя граница (5%)")
         plt.plot(timestamps[-1], temperature[-1], 'ro', markersize=10, label="Последняя точка")
@@ -323,10 +169,10 @@ async def send_anomaly_graph(chat_id, sensor_id):
 
     if humidity_data:
         plot_count += 1
-        timestamps = [datetime.fromtimestamp(ts) for ts, _ in humidity_data]
-        humidity = [value for _, value in humidity_data]
+        timestamps = humidity_data.times()
+        humidity = humidity_data.values
         plt.subplot(3, 1, plot_count)
-        plt.plot(timestamps, humidity, label="Влажность (%)", color="blue", marker="o")
+        plt.plot(*downsample(timestamps, humidity), label="Влажность (%)", color="blue", marker="o")
         plt.axhline(y=humidity_upper, color="orange", linestyle="--", label="Верхняя граница (95%)")
         plt.axhline(y=humidity_lower, color="purple", linestyle="--", label="Нижняя граница (5%)")
         plt.plot(timestamps[-1], humidity[-1], 'bo', markersize=10, label="Последняя точка")
@@ -337,10 +183,10 @@ async def send_anomaly_graph(chat_id, sensor_id):
 
     if dewpoint_data:
         plot_count += 1
-        timestamps = [datetime.fromtimestamp(ts) for ts, _ in dewpoint_data]
-        dewpoint = [value for _, value in dewpoint_data]
+        timestamps = dewpoint_data.times()
+        dewpoint = dewpoint_data.values
         plt.subplot(3, 1, plot_count)
-        plt.plot(timestamps, dewpoint, label="Точка росы (°C)", color="green", marker="o")
+        plt.plot(*downsample(timestamps, dewpoint), label="Точка росы (°C)", color="green", marker="o")
         plt.axhline(y=dewpoint_upper, color="orange", linestyle="--", label="Верхняя граница (95%)")
         plt.axhline(y=dewpoint_lower, color="purple", linestyle="--", label="Нижняя граница (5%)")
         plt.plot(timestamps[-1], dewpoint[-1], 'go', markersize=10, label="Последняя точка")
@@ -417,6 +263,7 @@ async def start(update: Update, context: CallbackContext) -> None:
         "Этот бот анализирует данные с датчиков и уведомляет об аномалиях. "
         "Вы можете управлять анализом данных и просматривать статистику."
     )
+    ALERT_CHAT_IDS.add(update.message.chat_id)
     await update.message.reply_text(commands, parse_mode="HTML")
 
 # /count_anomalies
@@ -437,49 +284,38 @@ async def handle_sensor_selection_previous(update: Update, context: CallbackCont
     if sensor_id not in SENSOR_IDS:
         await update.message.reply_text("⚠ Неверный выбор датчика.")
         return
-    latest_data = sensors_collection.find_one(
-        {"MacAddress": sensor_id},
-        sort=[("MsgTimeStamp", -1)]
-    )
+    latest_data = sensor_repository.latest(sensor_id, fields=("MsgTimeStamp",))
     if not latest_data:
         await update.message.reply_text(f"⚠ Нет данных для датчика {sensor_id}.")
         return
-    latest_timestamp = datetime.strptime(latest_data["MsgTimeStamp"], "%Y-%m-%d %H:%M:%S")
+    latest_timestamp = latest_data["MsgTimeStamp"]
     time_24_hours_before_latest = latest_timestamp - timedelta(hours=24)
-    sensor_data = list(sensors_collection.find(
-        {
-            "MacAddress": sensor_id,
-            "MsgTimeStamp": {
-                "$gte": time_24_hours_before_latest.strftime("%Y-%m-%d %H:%M:%S"),
-                "$lt": latest_data["MsgTimeStamp"]
-            }
-        }
-    ).sort("MsgTimeStamp", 1))
-    if not sensor_data:
+    sensor_data = chart_series(sensor_id, time_24_hours_before_latest, latest_timestamp)
+    if sensor_data.empty:
         await update.message.reply_text(f"⚠ Нет данных для датчика {sensor_id} за предыдущие 24 часа.")
         return
-    timestamps = [datetime.strptime(data["MsgTimeStamp"], "%Y-%m-%d %H:%M:%S") for data in sensor_data]
-    temperature = [float(data["TemperatureC"]) for data in sensor_data]
-    humidity = [float(data["Humidity"]) for data in sensor_data]
-    dewpoint = [float(data["DewPointC"]) for data in sensor_data]
-    start_time = timestamps[0].strftime("%Y-%m-%d %H:%M:%S")
-    end_time = timestamps[-1].strftime("%Y-%m-%d %H:%M:%S")
+    timestamps = sensor_data["start"]
+    temperature = sensor_data["TemperatureC"]
+    humidity = sensor_data["Humidity"]
+    dewpoint = sensor_data["DewPointC"]
+    start_time = timestamps.iloc[0].strftime("%Y-%m-%d %H:%M:%S")
+    end_time = timestamps.iloc[-1].strftime("%Y-%m-%d %H:%M:%S")
     plt.figure(figsize=(10, 8))
     plt.subplot(3, 1, 1)
 
-    plt.plot(timestamps, temperature, label="Temperature (°C)", color="red")
+    plt.plot(*downsample(timestamps, temperature), label="Temperature (°C)", color="red")
     plt.title(f"Датчик {sensor_id} - Температура")
     plt.xlabel("Время")
     plt.ylabel("Температура (°C)")
     plt.legend()
     plt.subplot(3, 1, 2)
-    plt.plot(timestamps, humidity, label="Humidity (%)", color="blue")
+    plt.plot(*downsample(timestamps, humidity), label="Humidity (%)", color="blue")
     plt.title(f"Датчик {sensor_id} - Влажность")
     plt.xlabel("Время")
     plt.ylabel("Влажность (%)")
     plt.legend()
     plt.subplot(3, 1, 3)
-    plt.plot(timestamps, dewpoint, label="Dew Point (°C)", color="green")
+    plt.plot(*downsample(timestamps, dewpoint), label="Dew Point (°C)", color="green")
     plt.title(f"Датчик {sensor_id} - Точка росы")
     plt.xlabel("Время")
     plt.ylabel("Точка росы (°C)")
@@ -508,8 +344,7 @@ async def list_anomalies(update: Update, context: CallbackContext) -> None:
 
 # /toggle_analysis
 async def toggle_analysis_command(update: Update, context: CallbackContext) -> None:
-    global analysis_enabled
-    analysis_enabled = not analysis_enabled
+    analysis_enabled = toggle_analysis()
     status = "включен" if analysis_enabled else "выключен"
     await update.message.reply_text(f"Анализ данных {status}.")
 
@@ -526,40 +361,39 @@ async def handle_sensor_selection(update: Update, context: CallbackContext) -> N
     if sensor_id not in SENSOR_IDS:
         await update.message.reply_text("⚠ Неверный выбор датчика.")
         return
-    time_24_hours_ago = datetime.now() - timedelta(hours=24)
+    now = datetime.now()
+    time_24_hours_ago = now - timedelta(hours=24)
 
-    sensor_data = list(sensors_collection.find(
-        {"MacAddress": sensor_id, "MsgTimeStamp": {"$gte": time_24_hours_ago.strftime("%Y-%m-%d %H:%M:%S")}}
-    ).sort("MsgTimeStamp", 1))
+    sensor_data = chart_series(sensor_id, time_24_hours_ago, now)
 
-    if not sensor_data:
+    if sensor_data.empty:
         await update.message.reply_text("⚠ Нет данных для выбранного датчика за последние 24 часа.")
         return
-    timestamps = [datetime.strptime(data["MsgTimeStamp"], "%Y-%m-%d %H:%M:%S") for data in sensor_data]
-    temperature = [float(data["TemperatureC"]) for data in sensor_data]
-    humidity = [float(data["Humidity"]) for data in sensor_data]
-    dewpoint = [float(data["DewPointC"]) for data in sensor_data]
+    timestamps = sensor_data["start"]
+    temperature = sensor_data["TemperatureC"]
+    humidity = sensor_data["Humidity"]
+    dewpoint = sensor_data["DewPointC"]
 
-    start_time = timestamps[0].strftime("%Y-%m-%d %H:%M:%S")
-    end_time = timestamps[-1].strftime("%Y-%m-%d %H:%M:%S")
+    start_time = timestamps.iloc[0].strftime("%Y-%m-%d %H:%M:%S")
+    end_time = timestamps.iloc[-1].strftime("%Y-%m-%d %H:%M:%S")
     plt.figure(figsize=(10, 8))
 
     plt.subplot(3, 1, 1)
-    plt.plot(timestamps, temperature, label="Temperature (°C)", color="red")
+    plt.plot(*downsample(timestamps, temperature), label="Temperature (°C)", color="red")
     plt.title(f"Датчик {sensor_id} - Температура")
     plt.xlabel("Время")
     plt.ylabel("Температура (°C)")
     plt.legend()
 
     plt.subplot(3, 1, 2)
-    plt.plot(timestamps, humidity, label="Humidity (%)", color="blue")
+    plt.plot(*downsample(timestamps, humidity), label="Humidity (%)", color="blue")
     plt.title(f"Датчик {sensor_id} - Влажность")
     plt.xlabel("Время")
     plt.ylabel("Влажность (%)")
     plt.legend()
 
     plt.subplot(3, 1, 3)
-    plt.plot(timestamps, dewpoint, label="Dew Point (°C)", color="green")
+    plt.plot(*downsample(timestamps, dewpoint), label="Dew Point (°C)", color="green")
     plt.title(f"Датчик {sensor_id} - Точка росы")
     plt.xlabel("Время")
     plt.ylabel("Точка росы (°C)")
@@ -574,7 +408,7 @@ async def handle_sensor_selection(update: Update, context: CallbackContext) -> N
 
     await update.message.reply_text(f"📊 Графики за период:\n {start_time} — {end_time}")
 
-    last_data = sensor_data[-1]
+    last_data = sensor_repository.latest(sensor_id, fields=("PM25", "AlarmStatus"))
     message = (
         f"📊 Последние данные для датчика {sensor_id}:\n"
         f"🌫️ PM2.5: {last_data['PM25']}\n"
@@ -583,44 +417,42 @@ async def handle_sensor_selection(update: Update, context: CallbackContext) -> N
     await update.message.reply_text(message)
 
 
-##Проверка на наличие аномалий (Коммент)
-async def check_for_anomalies():
-    while True:
-        print("Начался анализ данных на поиск аномалий")
-        if analysis_enabled:
-            latest_data = list(sensors_collection.find().sort("MsgTimeStamp", -1).limit(1))
-            if not latest_data:
-                print("⚠ Нет данных для анализа.")
-                await asyncio.sleep(10)
-                continue
-            data = latest_data[0]
-            required_keys = ["MacAddress", "TemperatureC", "PM25", "AlarmStatus"]
-            if not all(key in data for key in required_keys):
-                print("⚠ Документ содержит неполные данные.")
-                await asyncio.sleep(10)
-                continue
-
-            sensor_id = data["MacAddress"]
-            value = float(data["TemperatureC"])
-            pm25 = data["PM25"]
-            alarm_status = data["AlarmStatus"]
-
-            is_anomaly = process_sensor_data(sensor_id, value, pm25, alarm_status)
-            if is_anomaly:
-                message = (f"⚠ *Обнаружена аномалия!*\n"
-                           f"📍 Датчик: `{sensor_id}`\n"
-                           f"⏰ Время: `{data['MsgTimeStamp']}`\n"
-                           f"📊 Температура: `{value}°C`\n"
-                           f"🌫️ PM2.5: `{pm25}`\n"
-                           f"🚨 Статус тревоги: `{alarm_status}`")
-                await application.bot.send_message(chat_id=update.message.chat_id, text=message, parse_mode="Markdown")
-
-        await asyncio.sleep(60)
+## Уведомления об аномалиях из конвейера MQTT (event_bus)
+async def notify_anomaly(event):
+    if event.started:
+        message = (f"⚠ *Обнаружена аномалия!*\n"
+                   f"📍 Датчик: `{event.sensor_id}`\n"
+                   f"⏰ Время: `{event.timestamp:%Y-%m-%d %H:%M:%S}`\n"
+                   f"📊 Температура: `{event.value}°C`\n"
+                   f"🌫️ PM2.5: `{event.pm25}`\n"
+                   f"🚨 Статус тревоги: `{event.alarm_status}`")
+    else:
+        message = f"✅ Аномалия на датчике `{event.sensor_id}` закончилась."
+    for chat_id in list(ALERT_CHAT_IDS):
+        try:
+            await application.bot.send_message(chat_id=chat_id, text=message, parse_mode="Markdown")
+        except Exception as e:
+            logging.error(f"Не удалось отправить уведомление в чат {chat_id}: {e}")
+
+
+def subscribe_anomaly_notifications(loop):
+    """События публикуются в рабочих потоках MQTT, отправка выполняется в цикле событий бота"""
+    def handler(event):
+        asyncio.run_coroutine_threadsafe(notify_anomaly(event), loop)
+    bus.subscribe(ANOMALY_STARTED, handler)
+    bus.subscribe(ANOMALY_ENDED, handler)
+
+
+async def close_clients(application):
+    await prometheus.aclose()
+
 
 def main_bot():
     global application
-    asyncio.set_event_loop(asyncio.new_event_loop())
-    application = Application.builder().token(BOT_TOKEN).build()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    application = Application.builder().token(BOT_TOKEN).post_shutdown(close_clients).build()
+    subscribe_anomaly_notifications(loop)
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("test_alert", test_alert))
@@ -633,7 +465,6 @@ def main_bot():
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_sensor_selection))
     application.add_handler(MessageHandler(filters.TEXT & filters.UpdateType.MESSAGE, message_interceptor), group=1)
 
-    #asyncio.get_event_loop().create_task(check_for_anomalies())
     print("✅ Telegram-бот запущен!")
     application.run_polling()
 
@@ -1,27 +1,18 @@
 from pymongo import MongoClient
 import numpy as np
-from datetime import datetime
 import matplotlib.pyplot as plt
 from scipy.fft import fft, fftfreq
 from scipy.signal import welch, lombscargle
+from sensor_repository import SensorRepository
+from history_cache import HistoryCache
 
 client = MongoClient("mongodb://localhost:27017/")
-collection = client["mqtt_database"]["your_collection"]
-data = list(collection.find(
-    {"MacAddress": "000DE0163B58"},
-    {"TemperatureC": 1, "MsgTimeStamp": 1, "_id": 0}
-).limit(20000))
-values = []
-timestamps = []
-for doc in data:
-    try:
-        values.append(float(doc["TemperatureC"]))
-        timestamps.append(datetime.fromisoformat(doc["MsgTimeStamp"]))
-    except:
-        continue
-
-values = np.array(values)
-time_seconds = np.array([(t - timestamps[0]).total_seconds() for t in timestamps])
+cache = HistoryCache(SensorRepository(client["mqtt_database"]["your_collection"]))
+columns = cache.columns("000DE0163B58", fields=("MsgTimeStamp", "TemperatureC"), limit=20000)
+mask = ~np.isnan(columns["TemperatureC"])
+values = columns["TemperatureC"][mask]
+timestamps = columns["MsgTimeStamp"][mask]
+time_seconds = (timestamps - timestamps[0]) / np.timedelta64(1, "s")
 
 
 Ts = np.median(np.diff(time_seconds))
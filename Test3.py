@@ -7,25 +7,20 @@ import json
 from datetime import datetime
 import os
 import glob
+from sensor_repository import SensorRepository
+from history_cache import HistoryCache
 
 
 def save_intervals_to_json():
     """Функция для выбора интервалов и сохранения в JSON"""
     # Подключение к MongoDB и загрузка данных
     client = MongoClient("mongodb://localhost:27017/")
-    collection = client["mqtt_database"]["your_collection"]
-    data = list(collection.find(
-        {"MacAddress": "000DE0163B56"},
-        {"TemperatureC": 1, "MsgTimeStamp": 1, "_id": 0}).limit(1000000))
-
-    # Преобразование в DataFrame и конвертация типов
-    df = pd.DataFrame(data)
-    df['TemperatureC'] = pd.to_numeric(df['TemperatureC'], errors='coerce')
-    df = df.dropna(subset=['TemperatureC'])
-    df['MsgTimeStamp'] = pd.to_datetime(df['MsgTimeStamp'])
-
-    values = df['TemperatureC'].values
-    timestamps = df['MsgTimeStamp'].values
+    cache = HistoryCache(SensorRepository(client["mqtt_database"]["your_collection"]))
+    columns = cache.columns("000DE0163B56", fields=("MsgTimeStamp", "TemperatureC"), limit=1000000)
+    mask = ~np.isnan(columns['TemperatureC'])
+
+    values = columns['TemperatureC'][mask]
+    timestamps = columns['MsgTimeStamp'][mask]
 
     # Визуализация всех данных
     plt.figure(figsize=(14, 5))
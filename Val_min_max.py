@@ -1,30 +1,21 @@
 from pymongo import MongoClient
 import numpy as np
-from datetime import datetime
 import matplotlib.pyplot as plt
 from scipy.fft import fft, fftfreq
 from scipy.signal import welch
+from sensor_repository import SensorRepository
+from history_cache import HistoryCache
 
 # 1. Подключение и загрузка данных
 client = MongoClient("mongodb://localhost:27017/")
-collection = client["mqtt_database"]["your_collection"]
-data = list(collection.find(
-    {"MacAddress": "000DE0163B56"},
-    {"Humidity": 1, "MsgTimeStamp": 1, "_id": 0}
-).limit(100000))
+cache = HistoryCache(SensorRepository(client["mqtt_database"]["your_collection"]))
+columns = cache.columns("000DE0163B56", fields=("MsgTimeStamp", "TemperatureC"), limit=100000)
 
 # 2. Подготовка данных
-values = []
-timestamps = []
-for doc in data:
-    try:
-        values.append(float(doc["TemperatureC"]))
-        timestamps.append(datetime.fromisoformat(doc["MsgTimeStamp"]))
-    except:
-        continue
-
-values = np.array(values)
-time_seconds = np.array([(t - timestamps[0]).total_seconds() for t in timestamps])
+mask = ~np.isnan(columns["TemperatureC"])
+values = columns["TemperatureC"][mask]
+timestamps = columns["MsgTimeStamp"][mask]
+time_seconds = (timestamps - timestamps[0]) / np.timedelta64(1, "s")
 
 # 3. Параметры дискретизации
 Ts = np.median(np.diff(time_seconds))
@@ -5,7 +5,6 @@ import subprocess
 from pathlib import Path
 from dotenv import load_dotenv
 from prometheus_client import start_http_server
-from metricsPromet import create_sensor_metrics
 from Request import start_api_client
 from Telgram_bot.Bot_telegram import  main_bot
 
@@ -45,22 +44,11 @@ def main():
         print("Prometheus server started on port 8000")
         start_http_server(8000)
 
-        from mongo import init_db, fetch_sensor_data_for_day
-        collection_mq = init_db(MONGO_URL, MONGO_DB)
+        from mongo import init_db
+        collection_mq = init_db(MONGO_URL, MONGO_DB, MONGO_COLLECTION or "your_collection",
+                                storage=os.getenv("MONGO_STORAGE", "classic"))
         collection_api = init_db(MONGO_URL, "api_database")
 
-        result_file = fetch_sensor_data_for_day()
-        print(f"Файл сохранен: {result_file}")
-
-
-        sensor_metrics= {
-            "000DE0163B57": create_sensor_metrics("000DE0163B57"),
-            "000DE0163B59": create_sensor_metrics("000DE0163B59"),
-            "000DE0163B58": create_sensor_metrics("000DE0163B58"),
-            "000DE0163B56": create_sensor_metrics("000DE0163B56")
-        }
-        print("Sensor metrics initialized:", sensor_metrics)
-
         from mqqt import start_mqtt_client
 
         #api_client_thread = threading.Thread(target=start_api_client, args=(BASE_URL, collection_api), daemon=True)
@@ -77,7 +65,7 @@ def main():
         print("Telegram bot thread started")
 
         try:
-            start_mqtt_client(MQTT_BROKER_ADDRESS, MQTT_BROKER_PORT, MQTT_TOPICS, collection_mq, sensor_metrics)
+            start_mqtt_client(MQTT_BROKER_ADDRESS, MQTT_BROKER_PORT, MQTT_TOPICS, collection_mq)
         except Exception as e:
             print(f"Ошибка в запуске prometheus {e}")
         try:
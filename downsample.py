@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+
+# Число точек на графике: ширина картинки в пикселях, больше matplotlib всё равно не покажет
+DEFAULT_POINTS = int(os.getenv("CHART_MAX_POINTS", "1000"))
+MODES = ("lttb", "minmax")
+
+
+def _as_float(x):
+    """Ось X в float: время (datetime64, datetime, Timestamp) - в миллисекундах"""
+    x = np.asarray(x)
+    if x.dtype.kind == "O":
+        x = x.astype("datetime64[ms]")
+    if x.dtype.kind == "M":
+        return x.astype("datetime64[ms]").astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def _buckets(start, stop, count):
+    """Границы count корзин примерно равного размера на отрезке [start, stop)"""
+    return np.linspace(start, stop, count + 1).astype(np.int64)
+
+
+def _padded(y, edges, fill):
+    """Корзины в виде матрицы (корзина x позиция), хвосты коротких корзин заполнены fill"""
+    width = int(np.max(np.diff(edges)))
+    index = edges[:-1, None] + np.arange(width)
+    values = y[np.minimum(index, len(y) - 1)]
+    return index, np.where(index < edges[1:, None], values, fill)
+
+
+def minmax_indices(y, threshold=DEFAULT_POINTS):
+    """Огибающая min/max: в каждой из threshold/2 корзин остаются минимум и максимум
+    (в порядке времени), поэтому пики не теряются. Возвращает индексы точек"""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= threshold or threshold < 2:
+        return np.arange(n)
+    edges = _buckets(0, n, threshold // 2)
+    index, low = _padded(np.where(np.isnan(y), np.inf, y), edges, np.inf)
+    _, high = _padded(np.where(np.isnan(y), -np.inf, y), edges, -np.inf)
+    rows = np.arange(len(index))
+    lo = index[rows, np.argmin(low, axis=1)]
+    hi = index[rows, np.argmax(high, axis=1)]
+    return np.unique(np.concatenate([lo, hi]))
+
+
+def lttb_indices(x, y, threshold=DEFAULT_POINTS):
+    """Largest-Triangle-Three-Buckets: первая и последняя точки сохраняются, из каждой
+    промежуточной корзины берётся точка с наибольшей площадью треугольника с выбранной
+    точкой предыдущей корзины и средним следующей. Внутри корзины всё считается в numpy,
+    цикл идёт только по корзинам. Возвращает индексы точек"""
+    x = _as_float(x)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= threshold or threshold < 3:
+        return np.arange(n)
+    edges = _buckets(1, n - 1, threshold - 2)
+    # Средние корзин (последней "следующей" корзиной служит последняя точка)
+    counts = np.diff(edges)
+    mean_x = np.append(np.add.reduceat(x[:n - 1], edges[:-1]) / counts, x[-1])
+    mean_y = np.append(np.add.reduceat(y[:n - 1], edges[:-1]) / counts, y[-1])
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - mean_x[i + 1]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (mean_y[i + 1] - ay))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_indices(x, y, threshold=DEFAULT_POINTS, mode="lttb"):
+    """Индексы точек ряда, оставляемых для графика; точки с NaN отбрасываются"""
+    if mode not in MODES:
+        raise ValueError(f"Неизвестный режим прореживания: {mode}")
+    y = np.asarray(y, dtype=np.float64)
+    finite = np.flatnonzero(~np.isnan(y))
+    if len(finite) <= threshold:
+        return finite
+    if mode == "minmax":
+        return finite[minmax_indices(y[finite], threshold)]
+    return finite[lttb_indices(_as_float(x)[finite], y[finite], threshold)]
+
+
+def downsample(x, y, threshold=DEFAULT_POINTS, mode="lttb"):
+    """Прореженный ряд (x, y) не длиннее threshold точек, массивы numpy"""
+    index = downsample_indices(x, y, threshold, mode)
+    return np.asarray(x)[index], np.asarray(y, dtype=np.float64)[index]
@@ -0,0 +1,40 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Темы событий
+ANOMALY_STARTED = "anomaly.started"
+ANOMALY_ENDED = "anomaly.ended"
+
+
+class EventBus:
+    """Внутрипроцессная шина событий (pub/sub).
+
+    Обработчики вызываются синхронно в потоке, опубликовавшем событие (рабочий поток MQTT),
+    поэтому они не должны блокироваться: долгую работу передают в свою очередь или цикл событий.
+    Ошибка одного обработчика не мешает остальным.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic, handler):
+        with self._lock:
+            self._subscribers[topic] = self._subscribers.get(topic, ()) + (handler,)
+        return handler
+
+    def unsubscribe(self, topic, handler):
+        with self._lock:
+            self._subscribers[topic] = tuple(h for h in self._subscribers.get(topic, ()) if h is not handler)
+
+    def publish(self, topic, event):
+        for handler in self._subscribers.get(topic, ()):
+            try:
+                handler(event)
+            except Exception as e:
+                logger.error(f"Subscriber {handler!r} failed on {topic}: {e}")
+
+
+bus = EventBus()
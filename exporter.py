@@ -0,0 +1,173 @@
+import argparse
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from sensor_reading import NUMERIC_FIELDS, TIME_FIELD
+from sensor_repository import SensorRepository
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = (TIME_FIELD,) + tuple(NUMERIC_FIELDS) + ("AlarmStatus",)
+DEFAULT_FORMAT = "parquet" if pq is not None else "npz"
+EXTENSIONS = {"parquet": ".parquet", "npz": ".npz"}
+PARTIAL_SUFFIX = ".partial"
+
+
+def day_path(out_dir, sensor_id, day, fmt=DEFAULT_FORMAT, partial=False):
+    """Раскладка файлов: <out_dir>/<MAC>/<год>/<YYYY-MM-DD>.<parquet|npz>; незавершённые сутки -
+    <YYYY-MM-DD>.partial.<parquet|npz>"""
+    name = f"{day:%Y-%m-%d}{PARTIAL_SUFFIX if partial else ''}{EXTENSIONS[fmt]}"
+    return os.path.join(out_dir, sensor_id, f"{day:%Y}", name)
+
+
+def is_complete(path, day):
+    """Файл суток записан после их окончания (файлы старых версий без .partial проверяются по mtime)"""
+    return os.path.exists(path) and os.path.getmtime(path) >= (day + timedelta(days=1)).timestamp()
+
+
+def chunk_columns(chunk):
+    """Пачка документов -> столбцы numpy (время в мс, числа float64 с NaN, AlarmStatus 0/1)"""
+    columns = {TIME_FIELD: np.array([doc[TIME_FIELD] for doc in chunk], dtype="datetime64[ms]")}
+    for field in NUMERIC_FIELDS:
+        columns[field] = np.array([doc.get(field) for doc in chunk], dtype=np.float64)
+    columns["AlarmStatus"] = np.array([str(doc.get("AlarmStatus", "")).lower() == "on" for doc in chunk], dtype=np.int8)
+    return columns
+
+
+def _parquet_schema():
+    return pa.schema([(TIME_FIELD, pa.timestamp("ms"))]
+                     + [(field, pa.float64()) for field in NUMERIC_FIELDS]
+                     + [("AlarmStatus", pa.int8())])
+
+
+def export_day(repository, sensor_id, day, out_dir, fmt=DEFAULT_FORMAT, overwrite=False):
+    """Выгрузка одних суток датчика. Пачки курсора пишутся по мере чтения (в Parquet - по группе
+    строк на пачку), файл появляется атомарно. Возвращает путь или None, если данных нет.
+
+    Незавершённые сутки пишутся в файл .partial и перезаписываются при каждом вызове; после
+    окончания суток они выгружаются заново под обычным именем, а .partial удаляется. Готовый
+    файл пропускается, только если он записан после окончания суток.
+    """
+    if fmt == "parquet" and pq is None:
+        raise RuntimeError("Для Parquet нужен pyarrow, используйте fmt='npz'")
+    complete = day + timedelta(days=1) <= datetime.now()
+    path = day_path(out_dir, sensor_id, day, fmt, partial=not complete)
+    if complete and not overwrite and is_complete(path, day):
+        return path
+    chunks = repository.iter_chunks(sensor_id, day, day + timedelta(days=1), fields=EXPORT_FIELDS)
+    first = next(chunks, None)
+    if not first:
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    rows = 0
+    try:
+        if fmt == "parquet":
+            schema = _parquet_schema()
+            with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+                for chunk in chain([first], chunks):
+                    writer.write_table(pa.Table.from_pydict(chunk_columns(chunk), schema=schema))
+                    rows += len(chunk)
+        else:
+            parts = [chunk_columns(chunk) for chunk in chain([first], chunks)]
+            columns = {name: np.concatenate([part[name] for part in parts]) for name in EXPORT_FIELDS}
+            rows = len(columns[TIME_FIELD])
+            with open(tmp_path, "wb") as file:
+                np.savez_compressed(file, **columns)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.error(f"Не удалось выгрузить {sensor_id} за {day:%Y-%m-%d}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if complete:
+        partial_path = day_path(out_dir, sensor_id, day, fmt, partial=True)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    logger.info(f"Exported {rows} readings of {sensor_id} for {day:%Y-%m-%d} to {path}")
+    return path
+
+
+def _export_job(repository, sensor_id, day, out_dir, fmt, overwrite):
+    """Одно задание export_range: (датчик, сутки, путь или None, ошибка или None)"""
+    try:
+        return sensor_id, day, export_day(repository, sensor_id, day, out_dir, fmt, overwrite), None
+    except Exception as e:
+        return sensor_id, day, None, e
+
+
+def export_range(repository, sensors, start, end, out_dir, fmt=DEFAULT_FORMAT, workers=4, overwrite=False):
+    """Выгрузка датчиков за сутки [start, end) параллельно по заданиям (датчик, сутки).
+
+    Уже выгруженные завершённые сутки пропускаются; незавершённые (текущие) перезаписываются
+    в .partial и выгружаются окончательно при первом запуске после их окончания. Ошибка одного
+    задания не прерывает остальные. Возвращает (пути файлов, [(датчик, сутки, ошибка)])
+    """
+    start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    jobs = []
+    day = start
+    while day < end:
+        for sensor_id in sensors:
+            jobs.append((sensor_id, day))
+        day += timedelta(days=1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda job: _export_job(repository, *job, out_dir, fmt, overwrite), jobs))
+    paths = [path for _, _, path, _ in results if path]
+    failed = [(sensor_id, day, error) for sensor_id, day, _, error in results if error is not None]
+    return paths, failed
+
+
+def read_export(path):
+    """Загрузка выгруженных суток в DataFrame"""
+    if path.endswith(EXTENSIONS["parquet"]):
+        return pq.read_table(path).to_pandas()
+    with np.load(path) as data:
+        return pd.DataFrame({name: data[name] for name in data.files})
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Выгрузка показаний датчиков в Parquet/NPZ по суткам")
+    parser.add_argument("--db", default=os.getenv("MONGO_DB", "mqtt_database"))
+    parser.add_argument("--collection", default=os.getenv("MONGO_COLLECTION", "your_collection"))
+    parser.add_argument("--sensors", help="MAC через запятую, по умолчанию все")
+    parser.add_argument("--start", required=True, help="YYYY-MM-DD")
+    parser.add_argument("--end", help="YYYY-MM-DD (включительно), по умолчанию равна --start")
+    parser.add_argument("--out", default=os.getenv("EXPORT_DIR", "exports"))
+    parser.add_argument("--format", choices=sorted(EXTENSIONS), default=DEFAULT_FORMAT)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("EXPORT_WORKERS", "4")))
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args()
+
+    repository = SensorRepository.from_env(args.db, args.collection)
+    try:
+        sensors = args.sensors.split(",") if args.sensors else repository.sensors()
+        start = datetime.strptime(args.start, "%Y-%m-%d")
+        end = datetime.strptime(args.end or args.start, "%Y-%m-%d") + timedelta(days=1)
+        paths, failed = export_range(repository, sensors, start, end, args.out, args.format, args.workers,
+                                     args.overwrite)
+        print(f"Выгружено файлов: {len(paths)}, с ошибкой: {len(failed)}")
+        for sensor_id, day, error in failed:
+            print(f"  {sensor_id} {day:%Y-%m-%d}: {error}")
+        if failed:
+            raise SystemExit(1)
+    finally:
+        repository.close()
+
+
+if __name__ == "__main__":
+    main()
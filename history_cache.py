@@ -0,0 +1,182 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from sensor_reading import NUMERIC_FIELDS, TIME_FIELD
+from sensor_repository import ColumnBuffer, SensorRepository, column_dtype
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CACHE_FIELDS = (TIME_FIELD,) + tuple(NUMERIC_FIELDS)
+STATE_FILE = "state.json"
+EPOCH = datetime(1970, 1, 1)
+
+
+class HistoryCache:
+    """Локальный кэш истории показаний на диске.
+
+    Раскладка: <cache_dir>/<MAC>/<YYYY-MM-DD>/<поле>.bin - сырые столбцы numpy (время -
+    datetime64[ms], числа - float64), читаются через np.memmap без загрузки в память.
+    В <MAC>/state.json хранятся время последнего показания и число строк по суткам.
+
+    Синхронизация инкрементальная: из MongoDB забираются только показания новее последнего
+    закэшированного. Опоздавшие показания (старше него) в кэш не попадают - для них есть
+    rebuild() / `python history_cache.py --rebuild`.
+    """
+
+    def __init__(self, repository, cache_dir=None, raw=True):
+        self.repository = repository
+        self.cache_dir = cache_dir or os.getenv("HISTORY_CACHE_DIR", "history_cache")
+        self.raw = raw
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, db_name=None, collection_name=None, cache_dir=None):
+        return cls(SensorRepository.from_env(db_name, collection_name), cache_dir)
+
+    def close(self):
+        self.repository.close()
+
+    def _sensor_dir(self, sensor_id):
+        return os.path.join(self.cache_dir, sensor_id)
+
+    def _column_path(self, sensor_id, day, field):
+        return os.path.join(self._sensor_dir(sensor_id), day, f"{field}.bin")
+
+    def state(self, sensor_id):
+        path = os.path.join(self._sensor_dir(sensor_id), STATE_FILE)
+        if not os.path.exists(path):
+            return {"last": None, "rows": {}}
+        with open(path) as file:
+            return json.load(file)
+
+    def _save_state(self, sensor_id, state):
+        path = os.path.join(self._sensor_dir(sensor_id), STATE_FILE)
+        with open(path + ".tmp", "w") as file:
+            json.dump(state, file)
+        os.replace(path + ".tmp", path)
+
+    def _append(self, sensor_id, state, columns):
+        """Дописывание пачки в файлы суток. Файлы сначала обрезаются до числа строк из state.json,
+        поэтому хвост от прерванной записи не дублируется"""
+        times = columns[TIME_FIELD]
+        days = times.astype("datetime64[D]")
+        edges = [0, *(np.flatnonzero(days[1:] != days[:-1]) + 1).tolist(), len(times)]
+        for lo, hi in zip(edges, edges[1:]):
+            day = str(days[lo])
+            rows = state["rows"].get(day, 0)
+            os.makedirs(os.path.join(self._sensor_dir(sensor_id), day), exist_ok=True)
+            for field, column in columns.items():
+                path = self._column_path(sensor_id, day, field)
+                with open(path, "ab") as file:
+                    if file.tell() > rows * column.itemsize:
+                        file.truncate(rows * column.itemsize)
+                    file.write(column[lo:hi].tobytes())
+            state["rows"][day] = rows + hi - lo
+        state["last"] = int(times[-1].astype("int64"))
+
+    def sync(self, sensor_id):
+        """Догрузка показаний датчика новее последнего закэшированного; возвращает их число"""
+        with self._lock:
+            state = self.state(sensor_id)
+            start = None if state["last"] is None else EPOCH + timedelta(milliseconds=state["last"] + 1)
+            chunks = self.repository.iter_raw_chunks if self.raw else self.repository.iter_chunks
+            added = 0
+            for chunk in chunks(sensor_id, start, None, CACHE_FIELDS):
+                buffer = ColumnBuffer(CACHE_FIELDS, capacity=len(chunk))
+                buffer.extend(chunk)
+                self._append(sensor_id, state, buffer.arrays())
+                self._save_state(sensor_id, state)
+                added += len(chunk)
+            if added:
+                logger.info(f"History cache {sensor_id}: +{added} readings")
+            return added
+
+    def sync_all(self):
+        return {sensor_id: self.sync(sensor_id) for sensor_id in self.repository.sensors()}
+
+    def rebuild(self, sensor_id):
+        with self._lock:
+            shutil.rmtree(self._sensor_dir(sensor_id), ignore_errors=True)
+        return self.sync(sensor_id)
+
+    def days(self, sensor_id, sync=True):
+        """Сутки, за которые в кэше есть показания датчика"""
+        if sync:
+            self.sync(sensor_id)
+        return [date.fromisoformat(day) for day, rows in sorted(self.state(sensor_id)["rows"].items()) if rows]
+
+    def _open(self, sensor_id, day, field, rows):
+        return np.memmap(self._column_path(sensor_id, day, field), dtype=column_dtype(field), mode="r", shape=(rows,))
+
+    def columns(self, sensor_id, start=None, end=None, fields=None, limit=0, sync=True):
+        """Показания датчика за [start, end) столбцами numpy. Если интервал укладывается в одни
+        сутки, столбцы - срезы np.memmap без копирования"""
+        fields = CACHE_FIELDS if fields is None else tuple(fields)
+        unknown = set(fields) - set(CACHE_FIELDS)
+        if unknown:
+            raise ValueError(f"Поля не кэшируются: {', '.join(sorted(unknown))}")
+        if sync:
+            self.sync(sensor_id)
+        lo = None if start is None else np.datetime64(start, "ms")
+        hi = None if end is None else np.datetime64(end, "ms")
+        parts = []
+        remaining = limit or None
+        for day, rows in sorted(self.state(sensor_id)["rows"].items()):
+            day_start = np.datetime64(day, "ms")
+            if not rows or (lo is not None and day_start + np.timedelta64(1, "D") <= lo) or (hi is not None and day_start >= hi):
+                continue
+            times = self._open(sensor_id, day, TIME_FIELD, rows)
+            i = 0 if lo is None else np.searchsorted(times, lo)
+            j = rows if hi is None else np.searchsorted(times, hi)
+            if remaining is not None:
+                j = min(j, i + remaining)
+            if i < j:
+                parts.append({field: (times if field == TIME_FIELD else self._open(sensor_id, day, field, rows))[i:j]
+                              for field in fields})
+                if remaining is not None:
+                    remaining -= j - i
+                    if not remaining:
+                        break
+        if not parts:
+            return {field: np.empty(0, dtype=column_dtype(field)) for field in fields}
+        if len(parts) == 1:
+            return parts[0]
+        return {field: np.concatenate([part[field] for part in parts]) for field in fields}
+
+    def frame(self, sensor_id, start=None, end=None, fields=None, limit=0, sync=True):
+        return pd.DataFrame(self.columns(sensor_id, start, end, fields, limit, sync))
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Синхронизация локального кэша истории показаний")
+    parser.add_argument("--db", default=os.getenv("MONGO_DB", "mqtt_database"))
+    parser.add_argument("--collection", default=os.getenv("MONGO_COLLECTION", "your_collection"))
+    parser.add_argument("--sensors", help="MAC через запятую, по умолчанию все")
+    parser.add_argument("--dir", default=os.getenv("HISTORY_CACHE_DIR", "history_cache"))
+    parser.add_argument("--rebuild", action="store_true", help="пересобрать кэш датчиков с нуля")
+    args = parser.parse_args()
+
+    cache = HistoryCache.from_env(args.db, args.collection, args.dir)
+    try:
+        sensors = args.sensors.split(",") if args.sensors else cache.repository.sensors()
+        for sensor_id in sensors:
+            added = cache.rebuild(sensor_id) if args.rebuild else cache.sync(sensor_id)
+            rows = sum(cache.state(sensor_id)["rows"].values())
+            print(f"{sensor_id}: +{added}, всего {rows}")
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -16,9 +16,8 @@ from kivymd.uix.card import MDCard
 from kivy.lang import Builder
 import tkinter as tk
 from tkinter import messagebox, Listbox, Button, Label
-from Parse_Mongo_data import parse_and_plot_mongodb_data
+from Parse_Mongo_data import get_loader
 from mongo import init_db
-from metricsPromet import create_sensor_metrics
 from mqqt import start_mqtt_client
 from app import start_http_server
 
@@ -111,7 +110,8 @@ class MainApp(MDApp):
         try:
             mongo_url = os.getenv("MONGO_URL")
             mongo_db = os.getenv("MONGO_DB")
-            collection = init_db(mongo_url, mongo_db)
+            collection = init_db(mongo_url, mongo_db, os.getenv("MONGO_COLLECTION", "your_collection"),
+                                 storage=os.getenv("MONGO_STORAGE", "classic"))
 
             start_http_server(8000)
 
@@ -119,14 +119,7 @@ class MainApp(MDApp):
             mqtt_broker_port = int(os.getenv("MQTT_BROKER_PORT"))
             mqtt_topics = os.getenv("MQTT_TOPICS").split(',')
 
-            sensor_metrics = {
-                "000DE0163B57": create_sensor_metrics("000DE0163B57"),
-                "000DE0163B59": create_sensor_metrics("000DE0163B59"),
-                "000DE0163B58": create_sensor_metrics("000DE0163B58"),
-                "000DE0163B56": create_sensor_metrics("000DE0163B56")
-            }
-
-            start_mqtt_client(mqtt_broker_address, mqtt_broker_port, mqtt_topics, collection, sensor_metrics)
+            start_mqtt_client(mqtt_broker_address, mqtt_broker_port, mqtt_topics, collection)
 
             self.update_ui_on_connection_success()
 
@@ -178,13 +171,14 @@ class DateSelectionWindow(tk.Tk):
         database_name = "mqtt_database"
         collection_name = "your_collection"
 
-        self.df = parse_and_plot_mongodb_data(database_name, collection_name, self.selected_sensor.get())
+        self.loader = get_loader(database_name, collection_name)
+        self.dates_sensor = self.selected_sensor.get()
+        self.dates = self.loader.dates(self.dates_sensor)
 
-        if self.df.empty:
+        if not self.dates:
             self.listbox.delete(0, tk.END)
             self.listbox.insert(tk.END, "Ошибка при получении данных")
         else:
-            self.dates = sorted(self.df['MsgTimeStamp'].dt.date.unique().tolist())
             self.listbox.delete(0, tk.END)
             for date in self.dates:
                 self.listbox.insert(tk.END, date.strftime("%Y-%m-%d"))
@@ -196,16 +190,18 @@ class DateSelectionWindow(tk.Tk):
             return
 
         selected_date = self.dates[selected_index[0]]
-        filtered_df = self.df[self.df['MsgTimeStamp'].dt.date == selected_date]
+        filtered_df = self.loader.day_series(self.dates_sensor, selected_date)
 
         if filtered_df.empty:
             messagebox.showwarning("Предупреждение", "Нет данных для выбранной даты.")
             return
 
+        # Корзины с сервера: линия - средние, заливка - min/max внутри корзины
         plt.figure(figsize=(14, 10))
         # График Humidity по времени
         plt.subplot(3, 2, 1)
-        plt.plot(filtered_df['MsgTimeStamp'], filtered_df['Humidity'], label='Humidity', color='blue')
+        plt.plot(filtered_df['start'], filtered_df['Humidity'], label='Humidity', color='blue')
+        plt.fill_between(filtered_df['start'], filtered_df['Humidity_min'], filtered_df['Humidity_max'], color='blue', alpha=0.2)
         plt.xlabel("Время")
         plt.ylabel("Humidity")
         plt.title(f"Humidity за {selected_date}")
@@ -214,7 +210,8 @@ class DateSelectionWindow(tk.Tk):
 
         # График TemperatureC по времени
         plt.subplot(3, 2, 2)
-        plt.plot(filtered_df['MsgTimeStamp'], filtered_df['TemperatureC'], label='TemperatureC', color='red')
+        plt.plot(filtered_df['start'], filtered_df['TemperatureC'], label='TemperatureC', color='red')
+        plt.fill_between(filtered_df['start'], filtered_df['TemperatureC_min'], filtered_df['TemperatureC_max'], color='red', alpha=0.2)
         plt.xlabel("Время")
         plt.ylabel("TemperatureC")
         plt.title(f"TemperatureC за {selected_date}")
@@ -223,7 +220,8 @@ class DateSelectionWindow(tk.Tk):
 
         # График TemperatureF по времени
         plt.subplot(3, 2, 3)
-        plt.plot(filtered_df['MsgTimeStamp'], filtered_df['TemperatureF'], label='TemperatureF', color='green')
+        plt.plot(filtered_df['start'], filtered_df['TemperatureF'], label='TemperatureF', color='green')
+        plt.fill_between(filtered_df['start'], filtered_df['TemperatureF_min'], filtered_df['TemperatureF_max'], color='green', alpha=0.2)
         plt.xlabel("Время")
         plt.ylabel("TemperatureF")
         plt.title(f"TemperatureF за {selected_date}")
@@ -232,7 +230,8 @@ class DateSelectionWindow(tk.Tk):
 
         # График DewPointC по времени
         plt.subplot(3, 2, 4)
-        plt.plot(filtered_df['MsgTimeStamp'], filtered_df['DewPointC'], label='DewPointC', color='orange')
+        plt.plot(filtered_df['start'], filtered_df['DewPointC'], label='DewPointC', color='orange')
+        plt.fill_between(filtered_df['start'], filtered_df['DewPointC_min'], filtered_df['DewPointC_max'], color='orange', alpha=0.2)
         plt.xlabel("Время")
         plt.ylabel("DewPointC")
         plt.title(f"DewPointC за {selected_date}")
@@ -241,7 +240,8 @@ class DateSelectionWindow(tk.Tk):
 
         # График DewPointF по времени
         plt.subplot(3, 2, 5)
-        plt.plot(filtered_df['MsgTimeStamp'], filtered_df['DewPointF'], label='DewPointF', color='purple')
+        plt.plot(filtered_df['start'], filtered_df['DewPointF'], label='DewPointF', color='purple')
+        plt.fill_between(filtered_df['start'], filtered_df['DewPointF_min'], filtered_df['DewPointF_max'], color='purple', alpha=0.2)
         plt.xlabel("Время")
         plt.ylabel("DewPointF")
         plt.title(f"DewPointF за {selected_date}")
@@ -1,38 +1,84 @@
-from prometheus_client import Counter, Gauge, Summary
+from prometheus_client import Counter, Gauge, Summary, Histogram
+from prometheus_client.core import GaugeMetricFamily
 mqtt_messages_received = Counter('mqtt_messages_received_total', 'Всего полученных данных с Mqtt')
 mongodb_insertions = Counter('mongodb_insertions_total', 'Количество вставленных данных в mongodb')
+mongodb_writer_queue_depth = Gauge('mongodb_writer_queue_depth', 'Документов в очереди на запись в mongodb', ['writer'])
+mongodb_writer_flush_size = Histogram('mongodb_writer_flush_size', 'Документов в одной пачке записи в mongodb', ['writer'],
+                                      buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000))
+mongodb_writer_flush_latency = Histogram('mongodb_writer_flush_latency_seconds', 'Время записи одной пачки в mongodb', ['writer'])
+mongodb_writer_dropped = Counter('mongodb_writer_dropped_total', 'Документы, отброшенные из-за переполнения очереди', ['writer'])
+mqtt_shard_queue_depth = Gauge('mqtt_shard_queue_depth', 'Сообщений в очереди рабочего потока', ['shard'])
+mqtt_shard_lag = Gauge('mqtt_shard_lag_seconds', 'Задержка между приёмом сообщения и началом его обработки', ['shard'])
+mqtt_shard_dropped = Counter('mqtt_shard_dropped_total', 'Сообщения, отброшенные из-за переполнения очереди', ['shard'])
 active_mqtt_subscriptions = Gauge('active_mqtt_subscriptions', 'Количество подключенных датчиков')
 api_requests = Counter('api_requests_total', 'Количество полученных Api-запросов')
 
-def create_sensor_metrics(sensor_name):
-    return {
-        'pm25': Gauge(f'mqtt_{sensor_name}_pm25', f'Последняя отправка PM2.5 на датчике {sensor_name}'),
-        'humidity': Gauge(f'mqtt_{sensor_name}_humidity', f'Последняя отправка Влажности на датчике {sensor_name}'),
-        'temperature_c': Gauge(f'mqtt_{sensor_name}_temperature_c', f'Последняя отправка Температуры в Цельсиях на датчике {sensor_name}'),
-        'temperature_f': Gauge(f'mqtt_{sensor_name}_temperature_f', f'Последняя отправка Температуры в Фаренгейтах на датчике {sensor_name}'),
-        'dew_point_c': Gauge(f'mqtt_{sensor_name}_dew_point_c', f'Последняя отправка Точки росы в Цельсиях на датчике {sensor_name}'),
-        'dew_point_f': Gauge(f'mqtt_{sensor_name}_dew_point_f', f'Последняя отправка Точки росы в Фаренгейтах на датчике {sensor_name}'),
-        'alarm_status': Gauge(f'mqtt_{sensor_name}_alarm_status', f'Последняя отправка Статуса тревоги на датчике {sensor_name}'),
-        'pm25_rate': Gauge(f'mqtt_{sensor_name}_pm25_rate', f'Скорость изменения PM2.5 для датчика {sensor_name}'),
-        'temp_rate': Gauge(f'mqtt_{sensor_name}_temp_rate', f'Скорость изменения температуры для датчика {sensor_name}'),
-        'humidity_rate': Gauge(f'mqtt_{sensor_name}_humidity_rate', f'Скорость изменения влажности для датчика {sensor_name}'),
-        'pm25_stddev': Gauge(f'mqtt_{sensor_name}_pm25_stddev', f'Стандартное отклонение PM2.5 для датчика {sensor_name}'),
-        'temp_stddev': Gauge(f'mqtt_{sensor_name}_temp_stddev', f'Стандартное отклонение температуры для датчика {sensor_name}'),
-        'temp_upper_quantile': Gauge(f'mqtt_{sensor_name}_temp_upper_q', f'Верхняя граница температуры (95% квантиль)'),
-        'temp_lower_quantile': Gauge(f'mqtt_{sensor_name}_temp_lower_q', f'Нижняя граница температуры (5% квантиль)'),
-        'temp_upper_stddev': Gauge(f'mqtt_{sensor_name}_temp_upper_std', f'Верхняя граница температуры (μ+2σ)'),
-        'temp_lower_stddev': Gauge(f'mqtt_{sensor_name}_temp_lower_std', f'Нижняя граница температуры (μ-2σ)'),
-        'humidity_upper_quantile': Gauge(f'mqtt_{sensor_name}_humidity_upper_q', f'Верхняя граница влажности (95% квантиль)'),
-        'humidity_lower_quantile': Gauge(f'mqtt_{sensor_name}_humidity_lower_q', f'Нижняя граница влажности (5% квантиль)'),
-        'dew_point_rate': Gauge(f'mqtt_{sensor_name}_dew_point_rate', f'Скорость изменения точки росы (°C/мин)'),
-        'dew_point_upper_quantile': Gauge(f'mqtt_{sensor_name}_dew_point_upper_q', f'Верхняя граница точки росы (95% квантиль)'),
-        'dew_point_lower_quantile': Gauge(f'mqtt_{sensor_name}_dew_point_lower_q', f'Нижняя граница точки росы (5% квантиль)'),
-        'pm25_alert': Gauge(f'mqtt_{sensor_name}_pm25_alert', 'Предупреждение PM2.5 (1 если > 0)'),
-        'temp_trend': Gauge(f'mqtt_{sensor_name}_temp_trend', 'Тренд температуры (°C/мин)'),
-        'humidity_trend': Gauge(f'mqtt_{sensor_name}_humidity_trend', 'Тренд влажности (%/мин)'),
-        'dew_point_trend': Gauge(f'mqtt_{sensor_name}_dew_point_trend', 'Тренд точки росы (°C/мин)'),
-        'temp_humidity_corr': Gauge(f'mqtt_{sensor_name}_temp_humidity_corr', 'Корреляция температуры и влажности'),
-    }
+# Семейства метрик датчиков: одна метрика на показатель, датчик - в метке sensor
+SENSOR_METRICS = {
+    'pm25': ('pm25', 'Последняя отправка PM2.5'),
+    'humidity': ('humidity', 'Последняя отправка Влажности'),
+    'temperature_c': ('temperature_c', 'Последняя отправка Температуры в Цельсиях'),
+    'temperature_f': ('temperature_f', 'Последняя отправка Температуры в Фаренгейтах'),
+    'dew_point_c': ('dew_point_c', 'Последняя отправка Точки росы в Цельсиях'),
+    'dew_point_f': ('dew_point_f', 'Последняя отправка Точки росы в Фаренгейтах'),
+    'alarm_status': ('alarm_status', 'Последняя отправка Статуса тревоги'),
+    'pm25_rate': ('pm25_rate', 'Скорость изменения PM2.5'),
+    'temp_rate': ('temp_rate', 'Скорость изменения температуры'),
+    'humidity_rate': ('humidity_rate', 'Скорость изменения влажности'),
+    'pm25_stddev': ('pm25_stddev', 'Стандартное отклонение PM2.5'),
+    'temp_stddev': ('temp_stddev', 'Стандартное отклонение температуры'),
+    'temp_upper_quantile': ('temp_upper_q', 'Верхняя граница температуры (95% квантиль)'),
+    'temp_lower_quantile': ('temp_lower_q', 'Нижняя граница температуры (5% квантиль)'),
+    'temp_upper_stddev': ('temp_upper_std', 'Верхняя граница температуры (μ+2σ)'),
+    'temp_lower_stddev': ('temp_lower_std', 'Нижняя граница температуры (μ-2σ)'),
+    'humidity_upper_quantile': ('humidity_upper_q', 'Верхняя граница влажности (95% квантиль)'),
+    'humidity_lower_quantile': ('humidity_lower_q', 'Нижняя граница влажности (5% квантиль)'),
+    'dew_point_rate': ('dew_point_rate', 'Скорость изменения точки росы (°C/мин)'),
+    'dew_point_upper_quantile': ('dew_point_upper_q', 'Верхняя граница точки росы (95% квантиль)'),
+    'dew_point_lower_quantile': ('dew_point_lower_q', 'Нижняя граница точки росы (5% квантиль)'),
+    'pm25_alert': ('pm25_alert', 'Предупреждение PM2.5 (1 если > 0)'),
+    'temp_trend': ('temp_trend', 'Тренд температуры (°C/мин)'),
+    'humidity_trend': ('humidity_trend', 'Тренд влажности (%/мин)'),
+    'dew_point_trend': ('dew_point_trend', 'Тренд точки росы (°C/мин)'),
+    'temp_humidity_corr': ('temp_humidity_corr', 'Корреляция температуры и влажности'),
+    'pm25_high': ('pm25_high', 'Максимум PM2.5 в окне'),
+    'pm25_low': ('pm25_low', 'Минимум PM2.5 в окне'),
+    'temp_high': ('temp_high', 'Максимум температуры в окне'),
+    'temp_low': ('temp_low', 'Минимум температуры в окне'),
+    'humidity_high': ('humidity_high', 'Максимум влажности в окне'),
+    'humidity_low': ('humidity_low', 'Минимум влажности в окне'),
+}
+
+
+
+def sensor_selector(key, sensor_name):
+    """PromQL-селектор метрики датчика, например mqtt_sensor_temp_upper_q{sensor="000DE0163B56"}"""
+    return f'mqtt_sensor_{SENSOR_METRICS[key][0]}{{sensor="{sensor_name}"}}'
+
+
+class SensorStateCollector:
+    """Коллектор, который строит семейства mqtt_sensor_* в момент опроса Prometheus.
+
+    source.sensor_snapshots() возвращает пары (датчик, {ключ SENSOR_METRICS: значение});
+    производные величины считаются там не чаще одного раза за опрос, а не на каждое сообщение.
+    """
+
+    def __init__(self, source):
+        self.source = source
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        families = {
+            key: GaugeMetricFamily(f'mqtt_sensor_{suffix}', description, labels=['sensor'])
+            for key, (suffix, description) in SENSOR_METRICS.items()
+        }
+        for sensor_name, values in self.source.sensor_snapshots():
+            for key, value in values.items():
+                families[key].add_metric([sensor_name], value)
+        return [family for family in families.values() if family.samples]
+
 
 api_successful_requests = Counter('api_successful_requests_total', 'Удачные запросы Api')
 api_failed_requests = Counter('api_failed_requests_total', 'Неудачные запросы Api')
@@ -49,6 +95,7 @@ api_pm10 = Gauge('api_pm10', 'PM10 с API')
 api_pm25_mcp = Gauge('api_pm25_mcp', 'PM2.5 MCP с API')
 
 anomally_detected = Gauge('anomally_detected', 'Обнаружение аномалии')
+anomaly_events = Counter('anomaly_events_total', 'События начала и окончания аномалий', ['sensor', 'event'])
 
 test_alert = Gauge("anomaly_test", "Test_Anomaly")
 
@@ -0,0 +1,102 @@
+import argparse
+import logging
+import os
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from sensor_reading import NUMERIC_FIELDS, TIME_FIELD, typed_document
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Коллекция с контрольными точками миграций
+MIGRATIONS_COLLECTION = "schema_migrations"
+MIGRATION_NAME = "typed_v1"
+SCHEMA_FIELDS = (TIME_FIELD,) + tuple(NUMERIC_FIELDS)
+
+
+def pending_fields(doc):
+    """Поля документа, ещё хранящиеся строками"""
+    return [field for field in SCHEMA_FIELDS if isinstance(doc.get(field), str)]
+
+
+def migrate(collection, batch_size=1000, pause=0.0, restart=False, dry_run=False):
+    """Перевод документов коллекции в типизированную схему пачками по _id.
+
+    Прогресс (последний _id) сохраняется в schema_migrations после каждой пачки, поэтому
+    прерванная миграция продолжается с места остановки. Работает на живой коллекции:
+    новые документы уже пишутся в новой схеме, pause снижает нагрузку на сервер.
+    """
+    state = collection.database[MIGRATIONS_COLLECTION]
+    key = f"{collection.name}:{MIGRATION_NAME}"
+    if restart:
+        state.delete_one({"_id": key})
+    checkpoint = state.find_one({"_id": key}) or {}
+    last_id = checkpoint.get("last_id")
+    converted = checkpoint.get("converted", 0)
+    failed = checkpoint.get("failed", 0)
+    if last_id is not None:
+        logger.info(f"Resuming {collection.name} after _id {last_id} ({converted} converted so far)")
+
+    projection = {field: 1 for field in SCHEMA_FIELDS}
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = list(collection.find(query, projection).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        operations = []
+        for doc in batch:
+            fields = pending_fields(doc)
+            if not fields:
+                continue
+            try:
+                typed = typed_document(doc)
+            except ValueError as e:
+                failed += 1
+                logger.warning(f"Document {doc['_id']} left unchanged: {e}")
+                continue
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {field: typed[field] for field in fields}}))
+        if operations and not dry_run:
+            collection.bulk_write(operations, ordered=False)
+        converted += len(operations)
+        last_id = batch[-1]["_id"]
+        if not dry_run:
+            state.update_one(
+                {"_id": key},
+                {"$set": {"last_id": last_id, "converted": converted, "failed": failed, "updated_at": datetime.utcnow()}},
+                upsert=True,
+            )
+        logger.info(f"{collection.name}: converted {converted}, failed {failed}, last _id {last_id}")
+        if pause:
+            time.sleep(pause)
+
+    remaining = collection.count_documents({TIME_FIELD: {"$type": "string"}})
+    logger.info(f"Migration of {collection.name} finished: {converted} converted, {failed} failed, "
+                f"{remaining} documents with string {TIME_FIELD} remain")
+    return converted, failed, remaining
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Миграция показаний датчиков в типизированную схему (double, BSON date)")
+    parser.add_argument("--db", default=os.getenv("MONGO_DB", "mqtt_database"))
+    parser.add_argument("--collection", default=os.getenv("MONGO_COLLECTION", "your_collection"))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.0, help="пауза между пачками, секунды")
+    parser.add_argument("--restart", action="store_true", help="начать заново, сбросив контрольную точку")
+    parser.add_argument("--dry-run", action="store_true", help="только подсчитать, без записи")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGO_URL", "mongodb://localhost:27017/"))
+    try:
+        migrate(client[args.db][args.collection], batch_size=args.batch_size, pause=args.pause,
+                restart=args.restart, dry_run=args.dry_run)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,21 @@
 from pymongo import MongoClient
 from metricsPromet import mongodb_insertions
+from mongo_storage import ensure_storage
+from sensor_repository import SensorRepository
+from exporter import DEFAULT_FORMAT, export_day
 import pandas as pd
-import json
 from datetime import datetime, timedelta
-import os
 import numpy as np
 
-def save_sensor_data(collection, sensor_data, metrics):
-    """Сохранение данных сенсора и метрик в MongoDB"""
+def save_sensor_data(collection, reading, metrics, writer=None):
+    """Сохранение показания (SensorReading) и метрик в MongoDB (через пакетный writer, если он передан)"""
     doc = {
-        'sensor_id': sensor_data.get('MacAddress'),
-        'timestamp': sensor_data.get('MsgTimeStamp'),
+        'sensor_id': reading.mac_address,
+        'timestamp': reading.timestamp,
         'data': {
-            'pm25': sensor_data.get('PM25'),
-            'temperature_c': sensor_data.get('TemperatureC'),
-            'humidity': sensor_data.get('Humidity')
+            'pm25': reading.pm25,
+            'temperature_c': reading.temperature_c,
+            'humidity': reading.humidity
         },
         'metrics': {
             'current': {
@@ -28,16 +29,24 @@ def save_sensor_data(collection, sensor_data, metrics):
             }
         }
     }
-    collection.insert_one(doc)
+    if writer is not None:
+        writer.submit(doc)
+    else:
+        collection.insert_one(doc)
 
 
-def init_db(mongo_url, db_name):
+def init_db(mongo_url, db_name, collection_name="your_collection", storage=None):
+    """storage: None - коллекция как есть, "classic" - с составными индексами,
+    "timeseries" - нативная time-series коллекция (см. mongo_storage.ensure_storage)"""
     client = MongoClient(mongo_url)
     db = client[db_name]
-    if not db.list_collection_names():
-        db.create_collection("your_collection")
-    collection = db["your_collection"]
-    print(f"Initialized DB: {db_name}")
+    if storage is not None:
+        collection = ensure_storage(db, collection_name, storage)
+    else:
+        if not db.list_collection_names():
+            db.create_collection(collection_name)
+        collection = db[collection_name]
+    print(f"Initialized DB: {db_name} ({storage or 'default'} storage)")
     return collection
 
 
@@ -50,61 +59,35 @@ def insert_data(collection, data):
         print(f"Failed to insert data: {e}")
 
 
-def fetch_data(collection, field_name="MsgTimeStamp", date_format="%Y-%m-%d %H:%M:%S"):
+def fetch_data(collection, sensor_id=None, start=None, end=None):
     try:
-        data = list(collection.find({}, {field_name: 1, 'Humidity': 1, 'TemperatureC': 1, 'TemperatureF': 1, 'DewPointC': 1, 'DewPointF': 1, 'AlarmStatus': 1, '_id': 0}))
+        fields = ('MsgTimeStamp', 'Humidity', 'TemperatureC', 'TemperatureF', 'DewPointC', 'DewPointF', 'AlarmStatus')
+        df = SensorRepository(collection).frame(sensor_id, start, end, fields=fields)
 
-        if not data:
+        if df.empty:
             raise ValueError("Коллекция пуста.")
 
-        df = pd.DataFrame(data)
-
-        if field_name not in df.columns:
-            raise KeyError(f"Поле '{field_name}' не найдено.")
-
-        try:
-            df[field_name] = pd.to_datetime(df[field_name], format=date_format)
-        except (ValueError, TypeError) as e:
-            raise ValueError(f"Ошибка преобразования даты: {e}")
-
         return df
     except Exception as e:
         print(f"Ошибка при получении данных: {e}")
         return pd.DataFrame()
 
-def fetch_sensor_data_for_day():
-    db_name = "mqtt_database"
-    collection_name = "your_collection"
-    mac_address = "000DE0163B56"
-    output_folder = "json_import"
-    target_date = "2024-11-23"
+def fetch_sensor_data_for_day(mac_address="000DE0163B56", target_date="2024-11-23", output_folder="exports",
+                              db_name="mqtt_database", collection_name="your_collection", fmt=DEFAULT_FORMAT):
+    """Выгрузка показаний датчика за сутки в Parquet/NPZ (см. exporter.export_day)"""
     client = MongoClient('mongodb://localhost:27017/')
-    db = client[db_name]
-    collection = db[collection_name]
-
-    regex_pattern = f"^{target_date} .*"
-    query = {
-        "MacAddress": mac_address,
-        "MsgTimeStamp": {
-            "$regex": regex_pattern
-        }
-    }
-    data = list(collection.find(query, {"_id": 0}))
-    client.close()
-    if not data:
+    try:
+        repository = SensorRepository(client[db_name][collection_name])
+        file_path = export_day(repository, mac_address, datetime.strptime(target_date, "%Y-%m-%d"), output_folder, fmt)
+    finally:
+        client.close()
+    if file_path is None:
         print(f"Данные для датчика {mac_address} за {target_date} не найдены.")
         return None
-    json_data = json.dumps(data, indent=4)
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-    filename = f"sensor_data_{mac_address}_{target_date}.json"
-    file_path = os.path.join(output_folder, filename)
-    # Сохраняем JSON в файл
-    with open(file_path, "w", encoding="utf-8") as file:
-        file.write(json_data)
-
     print(f"Данные сохранены в файл: {file_path}")
     return file_path
+
+
 def fetch_data_for_period(collection, period='24h'):
     """
     Функция для получения данных за определенный период.
@@ -126,18 +109,8 @@ def fetch_data_for_period(collection, period='24h'):
         else:
             raise ValueError(f"Неизвестный период: {period}")
 
-        # Формируем запрос для MongoDB
-        query = {
-            'MsgTimeStamp': {
-                '$gte': start_time
-            }
-        }
-
-        # Получаем данные из коллекции
-        data = list(collection.find(query))
-
-        # Преобразуем данные в DataFrame
-        df = pd.DataFrame(data)
+        # Фильтр и проекция выполняются в MongoDB, DataFrame собирается по пачкам
+        df = SensorRepository(collection).frame(start=start_time)
 
         # Если данных нет, возвращаем пустой DataFrame
         if df.empty:
@@ -0,0 +1,179 @@
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.errors import BulkWriteError, CollectionInvalid
+
+from sensor_reading import TIME_FIELD
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+META_FIELD = "MacAddress"
+STORAGE_MODES = ("classic", "timeseries")
+
+# Индексы показаний: выборки по датчику за интервал и по времени для всех датчиков
+READING_INDEXES = [
+    [(META_FIELD, ASCENDING), (TIME_FIELD, ASCENDING)],
+    [(TIME_FIELD, ASCENDING)],
+]
+ANOMALY_INDEXES = [
+    [("sensor_id", ASCENDING), (TIME_FIELD, DESCENDING)],
+    [(TIME_FIELD, DESCENDING)],
+]
+
+
+def ensure_indexes(collection, indexes=READING_INDEXES):
+    for keys in indexes:
+        collection.create_index(keys)
+
+
+def timeseries_options():
+    """Параметры time-series коллекции. Датчики шлют показания раз в несколько секунд -
+    granularity "seconds" (корзины по часу); MONGO_TS_GRANULARITY меняет её, MONGO_TS_TTL задаёт срок хранения"""
+    options = {
+        "timeseries": {
+            "timeField": TIME_FIELD,
+            "metaField": META_FIELD,
+            "granularity": os.getenv("MONGO_TS_GRANULARITY", "seconds"),
+        }
+    }
+    ttl = os.getenv("MONGO_TS_TTL")
+    if ttl:
+        options["expireAfterSeconds"] = int(ttl)
+    return options
+
+
+def is_timeseries(db, name):
+    info = next(db.list_collections(filter={"name": name}), None)
+    return info is not None and info.get("type") == "timeseries"
+
+
+def ensure_storage(db, name, mode="classic"):
+    """Коллекция показаний в режиме classic (обычная + составные индексы) или timeseries
+    (нативная time-series коллекция MongoDB 5+, корзины по датчику со сжатием).
+
+    Существующую обычную коллекцию нельзя превратить в time-series на месте: она остаётся
+    как есть с индексами, а данные переносятся командой `python mongo_storage.py --copy-to <имя>`.
+    """
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Неизвестный режим хранения: {mode}")
+    exists = name in db.list_collection_names()
+    if mode == "timeseries" and not exists:
+        try:
+            db.create_collection(name, **timeseries_options())
+            logger.info(f"Created time-series collection {name}")
+        except CollectionInvalid:
+            pass
+    elif mode == "timeseries" and not is_timeseries(db, name):
+        logger.warning(f"Collection {name} is a classic collection, time-series mode is not applied. "
+                       f"Copy it with: python mongo_storage.py --source {name} --copy-to <new name>")
+    elif not exists:
+        db.create_collection(name)
+    collection = db[name]
+    ensure_indexes(collection)
+    return collection
+
+
+def _insert_ordered(target, batch):
+    """Вставка пачки по порядку. Документ, отклонённый сервером, пропускается с записью в лог,
+    вставка продолжается со следующего. Возвращает число вставленных"""
+    inserted = 0
+    while batch:
+        try:
+            target.insert_many(batch, ordered=True)
+            return inserted + len(batch)
+        except BulkWriteError as e:
+            error = e.details["writeErrors"][0]
+            index = error["index"]
+            inserted += index
+            doc = batch[index]
+            logger.error(f"Document {doc.get(META_FIELD)} {doc.get(TIME_FIELD)} skipped: {error.get('errmsg')}")
+            batch = batch[index + 1:]
+    return inserted
+
+
+def copy_to_timeseries(source, target_name, batch_size=5000):
+    """Перенос показаний из обычной коллекции в time-series коллекцию пачками в порядке времени.
+
+    Уникального ключа у time-series коллекции нет, поэтому повторный запуск не вставляет всё заново,
+    а продолжает с последнего перенесённого показания: копируются показания новее него, а с тем же
+    временем - только датчиков, которых в целевой коллекции за это время ещё нет.
+    """
+    db = source.database
+    target = ensure_storage(db, target_name, "timeseries")
+    query = {TIME_FIELD: {"$type": "date"}}
+    last = target.find_one({}, {TIME_FIELD: 1}, sort=[(TIME_FIELD, DESCENDING)])
+    last_time, copied_at_last = None, set()
+    if last is not None:
+        last_time = last[TIME_FIELD]
+        copied_at_last = set(target.distinct(META_FIELD, {TIME_FIELD: last_time}))
+        query[TIME_FIELD]["$gte"] = last_time
+        logger.info(f"Resuming copy to {target_name} from {last_time}")
+    batch = []
+    copied = 0
+    for doc in source.find(query, {"_id": 0}).sort(TIME_FIELD, ASCENDING):
+        if doc[TIME_FIELD] == last_time and doc.get(META_FIELD) in copied_at_last:
+            continue
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            copied += _insert_ordered(target, batch)
+            batch = []
+            logger.info(f"Copied {copied} documents to {target_name}")
+    if batch:
+        copied += _insert_ordered(target, batch)
+    logger.info(f"Copy to {target_name} finished: {copied} documents")
+    return target
+
+
+def storage_stats(collection):
+    """Размеры коллекции в байтах: данные, на диске, индексы"""
+    stats = next(collection.aggregate([{"$collStats": {"storageStats": {}}}]))["storageStats"]
+    return {
+        "count": stats.get("count", 0),
+        "size": stats.get("size", 0),
+        "storage_size": stats.get("storageSize", 0),
+        "index_size": stats.get("totalIndexSize", 0),
+    }
+
+
+def storage_report(db, names):
+    """Таблица размеров коллекций; для двух коллекций - экономия второй относительно первой"""
+    rows = {name: storage_stats(db[name]) for name in names}
+    for name, stats in rows.items():
+        print(f"{name:30} docs={stats['count']:>12} data={stats['size'] / 2**20:10.1f} MB "
+              f"storage={stats['storage_size'] / 2**20:10.1f} MB indexes={stats['index_size'] / 2**20:10.1f} MB")
+    if len(rows) == 2:
+        before, after = rows.values()
+        for key in ("storage_size", "index_size"):
+            if before[key]:
+                print(f"{key}: {100 * (1 - after[key] / before[key]):.1f}% меньше")
+    return rows
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Хранилище показаний: индексы, time-series коллекция, отчёт о размерах")
+    parser.add_argument("--db", default=os.getenv("MONGO_DB", "mqtt_database"))
+    parser.add_argument("--source", default=os.getenv("MONGO_COLLECTION", "your_collection"))
+    parser.add_argument("--copy-to", help="скопировать показания в time-series коллекцию (повторный запуск продолжает копирование)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGO_URL", "mongodb://localhost:27017/"))
+    try:
+        db = client[args.db]
+        source = ensure_storage(db, args.source, "classic")
+        names = [args.source]
+        if args.copy_to:
+            copy_to_timeseries(source, args.copy_to, args.batch_size)
+            names.append(args.copy_to)
+        storage_report(db, names)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError
+
+from metricsPromet import (
+    mongodb_insertions,
+    mongodb_writer_queue_depth,
+    mongodb_writer_flush_size,
+    mongodb_writer_flush_latency,
+    mongodb_writer_dropped,
+)
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def parse_write_concern(value, default="1"):
+    """Строка вида '0', '1', 'majority' -> WriteConcern"""
+    value = (value or default).strip()
+    if value.isdigit():
+        return WriteConcern(w=int(value))
+    return WriteConcern(w=value)
+
+
+class MongoBatchWriter:
+    """Фоновая пакетная запись документов в MongoDB через ограниченную очередь.
+
+    Пачка сбрасывается через insert_many(ordered=False), как только набрано
+    batch_size документов или с момента первого документа прошло flush_interval секунд.
+    """
+
+    def __init__(self, collection, name="raw", batch_size=500, flush_interval=1.0,
+                 max_queue=10000, put_timeout=0.0, write_concern=None):
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        if write_concern is not None:
+            collection = collection.with_options(write_concern=write_concern)
+        self.collection = collection
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stopping = threading.Event()
+        mongodb_writer_queue_depth.labels(writer=name).set_function(self._queue.qsize)
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name=f"mongo-writer-{self.name}", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, doc):
+        """Поставить документ в очередь. Не блокирует поток MQTT дольше put_timeout."""
+        try:
+            if self.put_timeout:
+                self._queue.put(doc, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(doc)
+            return True
+        except queue.Full:
+            mongodb_writer_dropped.labels(writer=self.name).inc()
+            logger.warning(f"Очередь записи '{self.name}' переполнена, документ отброшен")
+            return False
+
+    def stop(self, timeout=10.0):
+        """Дописать всё, что осталось в очереди, и остановить поток. Не блокируется на переполненной
+        очереди: маркер остановки тогда не ставится, поток увидит флаг и дочитает очередь без ожидания"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        try:
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            stopping = self._stopping.is_set()
+            wait = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get_nowait() if stopping else self._queue.get(timeout=wait)
+            except queue.Empty:
+                item = _STOP if stopping else None
+
+            if item is _STOP:
+                self._flush(batch)
+                return
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            result = self.collection.insert_many(batch, ordered=False)
+            inserted = len(result.inserted_ids) if result.acknowledged else len(batch)
+        except BulkWriteError as e:
+            inserted = e.details.get('nInserted', 0)
+            logger.error(f"Ошибки при пакетной записи '{self.name}': {len(e.details.get('writeErrors', []))}")
+        except Exception as e:
+            inserted = 0
+            logger.error(f"Не удалось записать пачку '{self.name}' из {len(batch)} документов: {e}")
+        mongodb_writer_flush_latency.labels(writer=self.name).observe(time.perf_counter() - started)
+        mongodb_writer_flush_size.labels(writer=self.name).observe(len(batch))
+        mongodb_insertions.inc(inserted)
+
+
+def create_writers(raw_collection, anomaly_collection=None):
+    """Писатели для сырых показаний и аномалий с отдельными write concern.
+
+    Настройки берутся из окружения: MONGO_RAW_WRITE_CONCERN, MONGO_ANOMALY_WRITE_CONCERN,
+    MONGO_WRITER_BATCH_SIZE, MONGO_WRITER_FLUSH_INTERVAL, MONGO_WRITER_MAX_QUEUE.
+    """
+    batch_size = int(os.getenv("MONGO_WRITER_BATCH_SIZE", "500"))
+    flush_interval = float(os.getenv("MONGO_WRITER_FLUSH_INTERVAL", "1.0"))
+    max_queue = int(os.getenv("MONGO_WRITER_MAX_QUEUE", "10000"))
+    writers = {
+        "raw": MongoBatchWriter(
+            raw_collection, name="raw", batch_size=batch_size, flush_interval=flush_interval,
+            max_queue=max_queue, write_concern=parse_write_concern(os.getenv("MONGO_RAW_WRITE_CONCERN"), "1")),
+    }
+    if anomaly_collection is not None:
+        writers["anomalies"] = MongoBatchWriter(
+            anomaly_collection, name="anomalies", batch_size=batch_size, flush_interval=flush_interval,
+            max_queue=max_queue, write_concern=parse_write_concern(os.getenv("MONGO_ANOMALY_WRITE_CONCERN"), "1"))
+    return {name: writer.start() for name, writer in writers.items()}
@@ -1,7 +1,17 @@
-import json
 import logging
+import os
+import threading
+import time
 import paho.mqtt.client as mqtt
-from Analyz.metrics_process import MetricsProcessor, create_sensor_metrics
+from Analyz.metrics_process import MetricsProcessor
+from Anomalies_Detected import anomaly_detector
+from prometheus_client import REGISTRY
+from metricsPromet import SensorStateCollector, active_mqtt_subscriptions
+from mongo_writer import create_writers
+from mongo_storage import ANOMALY_INDEXES, ensure_indexes
+from mqtt_dispatch import ShardedDispatcher
+from rollups import RollupWriter
+from sensor_reading import decode_payload
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,44 +26,60 @@ def on_connect(client, userdata, flags, rc):
         logger.error(f"Failed to connect with code: {rc}")
 
 def on_message(client, userdata, msg):
-    print(f"RAW MQTT message: {msg.payload}")
     try:
-        data = json.loads(msg.payload.decode())
-        logger.info(f"Received message on topic {msg.topic}: {data}")
-        mac_address = data.get('MacAddress')
-        if not mac_address:
+        reading = decode_payload(msg.payload)
+        logger.debug(f"Received message on topic {msg.topic}: {reading}")
+        if not reading.mac_address:
             logger.error("Missing MacAddress in message")
             return
-        logger.info(f"Processing data for sensor {mac_address}")
-        if mac_address not in userdata["sensor_metrics"]:
-            logger.warning(f"No metrics configured for sensor {mac_address}")
-            return
-        metrics = userdata["sensor_metrics"][mac_address]
-        try:
-            metrics_processor.init_sensor(mac_address)
-            metrics['pm25'].set(float(data.get('PM25', 0)))
-            metrics['humidity'].set(float(data.get('Humidity', 0)))
-            metrics['temperature_c'].set(float(data.get('TemperatureC', 0)))
-            metrics['temperature_f'].set(float(data.get('TemperatureF', 0)))
-            metrics['dew_point_c'].set(float(data.get('DewPointC', 0)))
-            metrics['dew_point_f'].set(float(data.get('DewPointF', 0)))
-            metrics['alarm_status'].set(1 if data.get('AlarmStatus', '').lower() == 'on' else 0)
-            metrics_processor.process_metrics(mac_address, metrics, data)
-            if "collection" in userdata:
-                from mongo import insert_data
-                insert_data(userdata["collection"], data)
-                logger.info(f"Data inserted for sensor {mac_address}")
-        except (ValueError, TypeError) as e:
-            logger.error(f"Data conversion error for sensor {mac_address}: {e}")
-        except Exception as e:
-            logger.error(f"Unexpected error processing sensor {mac_address}: {e}")
-    except json.JSONDecodeError:
-        logger.error(f"Failed to decode JSON: {msg.payload.decode()}")
+        userdata["dispatcher"].dispatch(reading.mac_address, reading)
+    except ValueError as e:
+        logger.error(f"Failed to decode message {msg.payload!r}: {e}")
     except Exception as e:
         logger.error(f"Critical error in message handler: {e}")
 
-def start_mqtt_client(broker_address, broker_port, topics, collection, sensor_metrics):
-    mqtt_client = mqtt.Client(userdata={"topics": topics, "collection": collection, "sensor_metrics": sensor_metrics})
+def process_message(userdata, mac_address, reading):
+    logger.info(f"Processing data for sensor {mac_address}")
+    try:
+        metrics_processor.process_metrics(mac_address, reading)
+        anomaly_detector.process_sensor_data(mac_address, reading.temperature_c, reading.pm25,
+                                             reading.raw.get("AlarmStatus"), reading.timestamp)
+        if "writer" in userdata:
+            userdata["writer"].submit(reading.to_document())
+            userdata["rollups"].add(reading)
+            logger.info(f"Data queued for sensor {mac_address}")
+    except Exception as e:
+        logger.error(f"Unexpected error processing sensor {mac_address}: {e}")
+
+def start_sensor_expiry(idle_ttl, interval=60.0):
+    def run():
+        while True:
+            time.sleep(interval)
+            for sensor_id in metrics_processor.expire_idle(idle_ttl):
+                anomaly_detector.forget(sensor_id)
+                logger.info(f"Sensor {sensor_id} expired after {idle_ttl:.0f}s without data")
+    threading.Thread(target=run, name="sensor-expiry", daemon=True).start()
+
+def start_mqtt_client(broker_address, broker_port, topics, collection):
+    REGISTRY.register(SensorStateCollector(metrics_processor))
+    active_mqtt_subscriptions.set_function(lambda: len(metrics_processor.sensor_data))
+    start_sensor_expiry(float(os.getenv("SENSOR_IDLE_TTL", "3600")))
+    database = collection.database
+    anomaly_collection = database[os.getenv("ANOMALY_COLLECTION", "anomalies")]
+    ensure_indexes(anomaly_collection, ANOMALY_INDEXES)
+    writers = create_writers(collection, anomaly_collection)
+    anomaly_detector.subscribe_anomaly_writer(writers["anomalies"])
+    anomaly_detector.subscribe_anomaly_metrics()
+    rollups = RollupWriter.from_env(database).start()
+    userdata = {"topics": topics, "collection": collection,
+                "writer": writers["raw"], "rollups": rollups}
+    dispatcher = ShardedDispatcher(
+        lambda mac_address, reading: process_message(userdata, mac_address, reading),
+        workers=int(os.getenv("MQTT_WORKERS", "4")),
+        max_queue=int(os.getenv("MQTT_WORKER_QUEUE", "10000")),
+    )
+    userdata["dispatcher"] = dispatcher.start()
+    mqtt_client = mqtt.Client(userdata=userdata)
     mqtt_client.on_connect = on_connect
     mqtt_client.on_message = on_message
     try:
@@ -62,5 +88,10 @@ def start_mqtt_client(broker_address, broker_port, topics, collection, sensor_me
         mqtt_client.loop_forever()
     except Exception as e:
         logger.error(f"Failed to connect to MQTT Broker: {e}")
+    finally:
+        dispatcher.stop()
+        rollups.stop()
+        for writer in writers.values():
+            writer.stop()
 
 metrics_processor = MetricsProcessor()
\ No newline at end of file
@@ -0,0 +1,83 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+
+from metricsPromet import mqtt_shard_queue_depth, mqtt_shard_lag, mqtt_shard_dropped
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ShardedDispatcher:
+    """Раздача сообщений по N рабочим очередям с шардированием по ключу (MacAddress).
+
+    Сообщения одного датчика всегда попадают в один и тот же поток, поэтому порядок
+    внутри датчика сохраняется, а разные датчики обрабатываются параллельно.
+    """
+
+    def __init__(self, handler, workers=4, max_queue=10000):
+        self.handler = handler
+        self.workers = max(int(workers), 1)
+        self._queues = [queue.Queue(maxsize=max_queue) for _ in range(self.workers)]
+        self._threads = []
+        self._stopping = threading.Event()
+        for shard, q in enumerate(self._queues):
+            mqtt_shard_queue_depth.labels(shard=str(shard)).set_function(q.qsize)
+
+    def shard_for(self, key):
+        return zlib.crc32(key.encode()) % self.workers
+
+    def start(self):
+        if not self._threads:
+            self._stopping.clear()
+            for shard in range(self.workers):
+                thread = threading.Thread(target=self._run, args=(shard,), name=f"mqtt-worker-{shard}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def dispatch(self, key, item):
+        shard = self.shard_for(key)
+        try:
+            self._queues[shard].put_nowait((time.monotonic(), key, item))
+            return True
+        except queue.Full:
+            mqtt_shard_dropped.labels(shard=str(shard)).inc()
+            logger.warning(f"Shard {shard} queue is full, message from {key} dropped")
+            return False
+
+    def stop(self, timeout=10.0):
+        """Остановить потоки, дообработав очереди. Не блокируется на переполненной очереди:
+        маркер остановки тогда не ставится, поток увидит флаг и разберёт очередь до конца"""
+        self._stopping.set()
+        for q in self._queues:
+            try:
+                q.put_nowait(_STOP)
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self, shard):
+        q = self._queues[shard]
+        lag = mqtt_shard_lag.labels(shard=str(shard))
+        while True:
+            if self._stopping.is_set():
+                try:
+                    entry = q.get_nowait()
+                except queue.Empty:
+                    return
+            else:
+                entry = q.get()
+            if entry is _STOP:
+                return
+            enqueued_at, key, item = entry
+            lag.set(time.monotonic() - enqueued_at)
+            try:
+                self.handler(key, item)
+            except Exception as e:
+                logger.error(f"Worker {shard} failed to process message from {key}: {e}")
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import httpx
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class RangeSeries:
+    """Один ряд ответа query_range: метки, время (секунды Unix, float64) и значения (float64)"""
+
+    __slots__ = ("labels", "timestamps", "values")
+
+    def __init__(self, labels, timestamps, values):
+        self.labels = labels
+        self.timestamps = timestamps
+        self.values = values
+
+    @classmethod
+    def from_result(cls, result):
+        points = np.asarray(result["values"], dtype=np.float64).reshape(-1, 2)
+        return cls(result["metric"], points[:, 0], points[:, 1])
+
+    @property
+    def name(self):
+        return self.labels.get("__name__")
+
+    def times(self):
+        """Время точек в местном часовом поясе (как datetime.fromtimestamp) - datetime64[ms]"""
+        offset = datetime.now().astimezone().utcoffset()
+        local = self.timestamps + offset.total_seconds()
+        return (local * 1000).astype(np.int64).astype("datetime64[ms]")
+
+    def __len__(self):
+        return len(self.values)
+
+
+def step_seconds(step):
+    """Шаг query_range в секундах: "30s", "2m", "1h", "1d" или число"""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    step = str(step)
+    if step[-1] in units:
+        return float(step[:-1]) * units[step[-1]]
+    return float(step)
+
+
+class _CachedRange:
+    __slots__ = ("lo", "hi", "series")
+
+    def __init__(self, lo, hi, series):
+        self.lo = lo
+        self.hi = hi
+        self.series = series  # {метки (frozenset): (метки, время, значения)}
+
+
+class RangeQueryCache:
+    """LRU-кэш результатов query_range по ключу (запрос, шаг).
+
+    Интервал запроса выравнивается по сетке шага, поэтому точки разных запросов совпадают,
+    и для более нового окна из Prometheus догружается только недостающий хвост. Последние
+    settle секунд не кэшируются - Prometheus ещё может дописать в них данные. Память
+    ограничена: max_entries рядов-запросов, в каждом не больше max_window секунд истории.
+    После ошибки запроса запись сбрасывается, и следующий вызов загружает окно целиком.
+    """
+
+    def __init__(self, max_entries=None, max_window=None, settle=None):
+        self.max_entries = max_entries or int(os.getenv("PROM_CACHE_ENTRIES", "128"))
+        self.max_window = max_window or float(os.getenv("PROM_CACHE_WINDOW", str(24 * 3600)))
+        self.settle = float(os.getenv("PROM_CACHE_SETTLE", "30")) if settle is None else settle
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def query_range(self, fetch, query, start, end, step):
+        """Ряды за [start, end] (секунды Unix); fetch(query, start, end, step) -> список RangeSeries или None"""
+        size = step_seconds(step)
+        lo = math.floor(start / size) * size
+        hi = math.floor(end / size) * size
+        key = (query, step)
+        entry = self._entries.pop(key, None)
+        # Окно до кэша, после разрыва или слишком далеко от его конца - запрашивается заново,
+        # иначе догрузка хвоста может превысить лимит точек Prometheus
+        if (entry is None or lo < entry.lo or lo > entry.hi or hi - lo > self.max_window
+                or hi - entry.hi > self.max_window):
+            entry = _CachedRange(lo, lo - size, {})
+        if entry.hi < hi:
+            fetched = await fetch(query, entry.hi + size, hi, step)
+            if fetched is None:
+                return []
+            series = dict(entry.series)
+            for item in fetched:
+                labels_key = frozenset(item.labels.items())
+                _, timestamps, values = series.get(labels_key, (item.labels, item.timestamps[:0], item.values[:0]))
+                series[labels_key] = (item.labels, np.concatenate([timestamps, item.timestamps]),
+                                      np.concatenate([values, item.values]))
+        else:
+            series = entry.series
+        result = []
+        for labels, timestamps, values in series.values():
+            mask = (timestamps >= lo) & (timestamps <= hi)
+            if mask.any():
+                result.append(RangeSeries(labels, timestamps[mask], values[mask]))
+        self._store(key, entry.lo, max(entry.hi, hi), series)
+        return result
+
+    def _store(self, key, lo, hi, series):
+        """Сохранение без неустоявшегося хвоста и истории старше max_window"""
+        size = step_seconds(key[1])
+        hi = min(hi, math.floor((time.time() - self.settle) / size) * size)
+        lo = max(lo, hi - self.max_window)
+        if hi < lo:
+            return
+        kept = {}
+        for labels_key, (labels, timestamps, values) in series.items():
+            mask = (timestamps >= lo) & (timestamps <= hi)
+            if mask.any():
+                kept[labels_key] = (labels, timestamps[mask], values[mask])
+        self._entries[key] = _CachedRange(lo, hi, kept)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class PrometheusQueryClient:
+    """Асинхронный клиент HTTP API Prometheus с общим пулом соединений (httpx.AsyncClient).
+
+    Сессия создаётся при первом запросе внутри работающего цикла событий и переиспользуется;
+    несколько запросов query_range выполняются параллельно (query_many), а ряды нескольких
+    метрик можно получить одним селектором (series_by_name). С cache=RangeQueryCache()
+    повторные и перекрывающиеся окна догружаются только хвостом.
+    """
+
+    def __init__(self, base_url=None, timeout=10.0, max_connections=10, cache=None):
+        self.base_url = base_url or os.getenv("PROMETHEUS_URL", "http://localhost:9090")
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.cache = cache
+        self._client = None
+
+    def _session(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def _fetch(self, query, start, end, step):
+        """Запрос query_range (start, end - секунды Unix); при ошибке - None"""
+        params = {"query": query, "start": start, "end": end, "step": step}
+        try:
+            response = await self._session().get("/api/v1/query_range", params=params)
+            response.raise_for_status()
+            result = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Ошибка при запросе Prometheus: {e}")
+            return None
+        if result.get("status") != "success":
+            logger.error(f"Prometheus вернул ошибку: {result.get('error')}")
+            return None
+        return [RangeSeries.from_result(item) for item in result["data"]["result"]]
+
+    async def query_range(self, query, start, end, step="2m"):
+        """Ряды по PromQL-запросу за [start, end]; при ошибке - пустой список"""
+        if self.cache is not None:
+            return await self.cache.query_range(self._fetch, query, start.timestamp(), end.timestamp(), step)
+        return await self._fetch(query, start.timestamp(), end.timestamp(), step) or []
+
+    async def query_many(self, queries, start, end, step="2m"):
+        """Несколько запросов параллельно по пулу соединений; результаты в порядке запросов"""
+        return await asyncio.gather(*(self.query_range(query, start, end, step) for query in queries))
+
+    async def series_by_name(self, names, labels, start, end, step="2m"):
+        """Ряды нескольких метрик одним запросом: {__name__=~"a|b|c", метки} -> {имя метрики: RangeSeries}"""
+        matchers = [f'__name__=~"{"|".join(names)}"'] + [f'{key}="{value}"' for key, value in labels.items()]
+        series = await self.query_range("{" + ", ".join(matchers) + "}", start, end, step)
+        return {item.name: item for item in series if len(item)}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -1,6 +1,5 @@
-from collections import defaultdict, deque
-import numpy as np
-from prometheus_client import Gauge
+from Analyz.ring_buffer import SensorRingBuffer
+from Analyz.sliding_stats import SlidingMoments, SlidingMinMax
 
 
 class SensorMetrics:
@@ -9,104 +8,65 @@ class SensorMetrics:
         self.window_size = window_size
 
         # История данных
-        self.history = {
-            'pm25': deque(maxlen=window_size),
-            'temperature_c': deque(maxlen=window_size),
-            'humidity': deque(maxlen=window_size),
-            'dew_point_c': deque(maxlen=window_size),
-            'timestamps': deque(maxlen=window_size)
+        self.history = SensorRingBuffer(window_size)
+        self.moments = {
+            'pm25': SlidingMoments(),
+            'temperature_c': SlidingMoments()
         }
-
-        # Инициализация Prometheus метрик
-        self.metrics = {
-            # Базовые метрики
-            'pm25': Gauge(f'mqtt_{sensor_name}_pm25', f'PM2.5 value for {sensor_name}'),
-            'humidity': Gauge(f'mqtt_{sensor_name}_humidity', f'Humidity for {sensor_name}'),
-            'temperature_c': Gauge(f'mqtt_{sensor_name}_temperature_c', f'Temperature (C) for {sensor_name}'),
-            'temperature_f': Gauge(f'mqtt_{sensor_name}_temperature_f', f'Temperature (F) for {sensor_name}'),
-            'dew_point_c': Gauge(f'mqtt_{sensor_name}_dew_point_c', f'Dew point (C) for {sensor_name}'),
-            'dew_point_f': Gauge(f'mqtt_{sensor_name}_dew_point_f', f'Dew point (F) for {sensor_name}'),
-            'alarm_status': Gauge(f'mqtt_{sensor_name}_alarm_status', f'Alarm status for {sensor_name}'),
-
-            # Метрики скорости изменений
-            'pm25_rate': Gauge(f'mqtt_{sensor_name}_pm25_rate', f'PM2.5 change rate for {sensor_name}'),
-            'temp_rate': Gauge(f'mqtt_{sensor_name}_temp_rate', f'Temperature change rate for {sensor_name}'),
-            'humidity_rate': Gauge(f'mqtt_{sensor_name}_humidity_rate', f'Humidity change rate for {sensor_name}'),
-
-            # Метрики статистики
-            'pm25_stddev': Gauge(f'mqtt_{sensor_name}_pm25_stddev', f'PM2.5 standard deviation for {sensor_name}'),
-            'temp_stddev': Gauge(f'mqtt_{sensor_name}_temp_stddev',
-                                 f'Temperature standard deviation for {sensor_name}'),
-
-            # High/Low метрики
-            'pm25_high': Gauge(f'mqtt_{sensor_name}_pm25_high', f'Highest PM2.5 for {sensor_name}'),
-            'pm25_low': Gauge(f'mqtt_{sensor_name}_pm25_low', f'Lowest PM2.5 for {sensor_name}'),
-            'temp_high': Gauge(f'mqtt_{sensor_name}_temp_high', f'Highest temperature for {sensor_name}'),
-            'temp_low': Gauge(f'mqtt_{sensor_name}_temp_low', f'Lowest temperature for {sensor_name}'),
-            'humidity_high': Gauge(f'mqtt_{sensor_name}_humidity_high', f'Highest humidity for {sensor_name}'),
-            'humidity_low': Gauge(f'mqtt_{sensor_name}_humidity_low', f'Lowest humidity for {sensor_name}')
+        self.extremes = {
+            'pm25': SlidingMinMax(),
+            'temperature_c': SlidingMinMax(),
+            'humidity': SlidingMinMax()
         }
-
-    def update(self, sensor_data):
-        """Обновление всех метрик на основе новых данных"""
-        # Преобразование данных
-        pm25 = float(sensor_data.get('PM25', 0))
-        temp_c = float(sensor_data.get('TemperatureC', 0))
-        humidity = float(sensor_data.get('Humidity', 0))
-        dew_point_c = float(sensor_data.get('DewPointC', 0))
-        temp_f = float(sensor_data.get('TemperatureF', 0))
-        dew_point_f = float(sensor_data.get('DewPointF', 0))
-        alarm_status = 1 if sensor_data.get('AlarmStatus', '').lower() == 'on' else 0
-
-        # Обновление истории
-        self.history['pm25'].append(pm25)
-        self.history['temperature_c'].append(temp_c)
-        self.history['humidity'].append(humidity)
-        self.history['dew_point_c'].append(dew_point_c)
-        self.history['timestamps'].append(sensor_data.get('MsgTimeStamp'))
-
-        # Обновление базовых метрик
-        self.metrics['pm25'].set(pm25)
-        self.metrics['humidity'].set(humidity)
-        self.metrics['temperature_c'].set(temp_c)
-        self.metrics['temperature_f'].set(temp_f)
-        self.metrics['dew_point_c'].set(dew_point_c)
-        self.metrics['dew_point_f'].set(dew_point_f)
-        self.metrics['alarm_status'].set(alarm_status)
-
-        # Вычисление скоростей изменений
-        self._calculate_rates()
-
-        # Вычисление статистики
-        self._calculate_statistics()
-
-        # Обновление high/low значений
-        self._update_high_low()
-
-    def _calculate_rates(self):
-        """Вычисление скоростей изменений"""
-        if len(self.history['pm25']) > 1:
-            self.metrics['pm25_rate'].set(self.history['pm25'][-1] - self.history['pm25'][-2])
-        if len(self.history['temperature_c']) > 1:
-            self.metrics['temp_rate'].set(self.history['temperature_c'][-1] - self.history['temperature_c'][-2])
-        if len(self.history['humidity']) > 1:
-            self.metrics['humidity_rate'].set(self.history['humidity'][-1] - self.history['humidity'][-2])
-
-    def _calculate_statistics(self):
-        """Вычисление стандартных отклонений"""
-        if len(self.history['pm25']) > 1:
-            self.metrics['pm25_stddev'].set(np.std(list(self.history['pm25'])))
-        if len(self.history['temperature_c']) > 1:
-            self.metrics['temp_stddev'].set(np.std(list(self.history['temperature_c'])))
-
-    def _update_high_low(self):
-        """Обновление high/low значений"""
-        if self.history['pm25']:
-            self.metrics['pm25_high'].set(max(self.history['pm25']))
-            self.metrics['pm25_low'].set(min(self.history['pm25']))
-        if self.history['temperature_c']:
-            self.metrics['temp_high'].set(max(self.history['temperature_c']))
-            self.metrics['temp_low'].set(min(self.history['temperature_c']))
-        if self.history['humidity']:
-            self.metrics['humidity_high'].set(max(self.history['humidity']))
-            self.metrics['humidity_low'].set(min(self.history['humidity']))
\ No newline at end of file
+        self.last_reading = None
+
+    def update(self, reading):
+        """Учёт нового показания (SensorReading). Значения метрик собираются
+        при опросе Prometheus через snapshot()/sensor_snapshots() (metricsPromet.SensorStateCollector)"""
+        row = (reading.pm25 or 0.0, reading.temperature_c or 0.0, reading.humidity or 0.0, reading.dew_point_c or 0.0)
+        self._record(reading.ts, row)
+        self.last_reading = reading
+
+    def _record(self, ts, row):
+        evicted = self.history.append(ts, row) or (None,) * len(row)
+        for name, value, old in zip(self.history.CHANNELS, row, evicted):
+            moments = self.moments.get(name)
+            if moments is not None:
+                moments.push(value, old)
+                if moments.stale:
+                    moments.reset(self.history.present(name).tolist())
+            extremes = self.extremes.get(name)
+            if extremes is not None:
+                extremes.push(value, old)
+
+    def snapshot(self):
+        values = {}
+        reading = self.last_reading
+        if reading is None:
+            return values
+
+        # Базовые метрики
+        for name in ('pm25', 'humidity', 'temperature_c', 'temperature_f', 'dew_point_c', 'dew_point_f'):
+            values[name] = getattr(reading, name) or 0.0
+        values['alarm_status'] = reading.alarm_status
+
+        if len(self.history) > 1:
+            # Скорости изменений
+            for name, metric in (('pm25', 'pm25_rate'), ('temperature_c', 'temp_rate'), ('humidity', 'humidity_rate')):
+                previous, current = self.history.last(name, 2)
+                values[metric] = current - previous
+            # Стандартные отклонения
+            values['pm25_stddev'] = self.moments['pm25'].pstddev
+            values['temp_stddev'] = self.moments['temperature_c'].pstddev
+
+        # High/Low значения
+        values['pm25_high'] = self.extremes['pm25'].max
+        values['pm25_low'] = self.extremes['pm25'].min
+        values['temp_high'] = self.extremes['temperature_c'].max
+        values['temp_low'] = self.extremes['temperature_c'].min
+        values['humidity_high'] = self.extremes['humidity'].max
+        values['humidity_low'] = self.extremes['humidity'].min
+        return values
+
+    def sensor_snapshots(self):
+        yield self.sensor_name, self.snapshot()
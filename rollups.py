@@ -0,0 +1,444 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+from dotenv import load_dotenv
+from pymongo import ASCENDING, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from metricsPromet import mongodb_writer_flush_latency, mongodb_writer_flush_size, mongodb_writer_queue_depth
+from mongo_writer import parse_write_concern
+from sensor_reading import NUMERIC_FIELDS, TIME_FIELD
+from sensor_repository import BUCKET_STATS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+META_FIELD = "MacAddress"
+# Разрешения агрегатов: имя -> (длительность корзины, усечение времени до начала корзины)
+RESOLUTIONS = {
+    "minute": (timedelta(minutes=1), lambda ts: ts.replace(second=0, microsecond=0)),
+    "hour": (timedelta(hours=1), lambda ts: ts.replace(minute=0, second=0, microsecond=0)),
+    "day": (timedelta(days=1), lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0)),
+}
+_MAX_DATE = datetime(9999, 12, 31)
+
+
+def rollup_prefix():
+    return os.getenv("MONGO_ROLLUP_PREFIX", "rollup_")
+
+
+class _FieldStats:
+    __slots__ = ('count', 'sum', 'sumsq', 'min', 'max', 'first', 'first_ts', 'last', 'last_ts')
+
+    def __init__(self, value, ts):
+        self.count = 1
+        self.sum = value
+        self.sumsq = value * value
+        self.min = self.max = self.first = self.last = value
+        self.first_ts = self.last_ts = ts
+
+    def add(self, value, ts):
+        self.count += 1
+        self.sum += value
+        self.sumsq += value * value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if ts < self.first_ts:
+            self.first, self.first_ts = value, ts
+        if ts >= self.last_ts:
+            self.last, self.last_ts = value, ts
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        self.sumsq += other.sumsq
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if other.first_ts < self.first_ts:
+            self.first, self.first_ts = other.first, other.first_ts
+        if other.last_ts >= self.last_ts:
+            self.last, self.last_ts = other.last, other.last_ts
+
+
+def _update_pipeline(count, fields, first_ts, last_ts):
+    """Обновление корзины одним конвейером: результат не зависит от порядка и дробления сбросов.
+    count, first_ts и last_ts обновляются и для показаний без числовых полей (fields пуст)"""
+    stage = {"count": {"$add": [{"$ifNull": ["$count", 0]}, count]}}
+    stage["first_ts"] = {"$min": ["$first_ts", first_ts]}
+    stage["last_ts"] = {"$max": ["$last_ts", last_ts]}
+    for field, stats in fields.items():
+        new_count = {"$add": [{"$ifNull": [f"${field}.count", 0]}, stats.count]}
+        new_sum = {"$add": [{"$ifNull": [f"${field}.sum", 0]}, stats.sum]}
+        stage[f"{field}.count"] = new_count
+        stage[f"{field}.sum"] = new_sum
+        stage[f"{field}.sumsq"] = {"$add": [{"$ifNull": [f"${field}.sumsq", 0]}, stats.sumsq]}
+        stage[f"{field}.mean"] = {"$divide": [new_sum, new_count]}
+        stage[f"{field}.min"] = {"$min": [f"${field}.min", stats.min]}
+        stage[f"{field}.max"] = {"$max": [f"${field}.max", stats.max]}
+        missing = {"$eq": [{"$ifNull": [f"${field}.count", None]}, None]}
+        stage[f"{field}.first"] = {"$cond": [
+            {"$or": [missing, {"$lt": [stats.first_ts, {"$ifNull": ["$first_ts", _MAX_DATE]}]}]},
+            stats.first, f"${field}.first"]}
+        stage[f"{field}.last"] = {"$cond": [
+            {"$or": [missing, {"$gte": [stats.last_ts, {"$ifNull": ["$last_ts", stats.last_ts]}]}]},
+            stats.last, f"${field}.last"]}
+    return [{"$set": stage}]
+
+
+def ensure_rollup_indexes(db, prefix=None):
+    prefix = rollup_prefix() if prefix is None else prefix
+    for resolution in RESOLUTIONS:
+        db[prefix + resolution].create_index([("sensor", ASCENDING), ("start", ASCENDING)], unique=True)
+
+
+class RollupWriter:
+    """Поминутные, почасовые и посуточные агрегаты по датчикам (count, min, max, mean, sum, sumsq, first/last).
+
+    Показания из потока MQTT копятся в памяти по корзинам и раз в flush_interval секунд
+    записываются пачкой upsert-ов (bulk_write, ordered=False) - по одному обновлению на корзину.
+    Корзины, которые не удалось записать, возвращаются в память и пишутся при следующем сбросе.
+    """
+
+    def __init__(self, db, prefix=None, flush_interval=5.0, write_concern=None):
+        prefix = rollup_prefix() if prefix is None else prefix
+        self.db = db
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.collections = {}
+        for resolution in RESOLUTIONS:
+            collection = db[prefix + resolution]
+            if write_concern is not None:
+                collection = collection.with_options(write_concern=write_concern)
+            self.collections[resolution] = collection
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        mongodb_writer_queue_depth.labels(writer="rollups").set_function(lambda: len(self._pending))
+
+    @classmethod
+    def from_env(cls, db):
+        return cls(db, flush_interval=float(os.getenv("MONGO_ROLLUP_FLUSH_INTERVAL", "5.0")),
+                   write_concern=parse_write_concern(os.getenv("MONGO_ROLLUP_WRITE_CONCERN"), "1"))
+
+    def start(self):
+        if self._thread is None:
+            ensure_rollup_indexes(self.db, self.prefix)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="rollup-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def add(self, reading):
+        """Учесть показание (SensorReading) во всех разрешениях"""
+        ts = reading.timestamp
+        if ts is None:
+            return
+        values = [(field, getattr(reading, attr)) for field, attr in NUMERIC_FIELDS.items()]
+        with self._lock:
+            for resolution, (_, truncate) in RESOLUTIONS.items():
+                key = (resolution, reading.mac_address, truncate(ts))
+                bucket = self._pending.get(key)
+                if bucket is None:
+                    bucket = self._pending[key] = [0, {}, ts, ts]
+                bucket[0] += 1
+                if ts < bucket[2]:
+                    bucket[2] = ts
+                if ts > bucket[3]:
+                    bucket[3] = ts
+                fields = bucket[1]
+                for field, value in values:
+                    if value is None:
+                        continue
+                    stats = fields.get(field)
+                    if stats is None:
+                        fields[field] = _FieldStats(value, ts)
+                    else:
+                        stats.add(value, ts)
+
+    def stop(self, timeout=10.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        operations = {resolution: ([], []) for resolution in RESOLUTIONS}
+        for key, (count, fields, first_ts, last_ts) in pending.items():
+            resolution, sensor, start = key
+            keys, batch = operations[resolution]
+            keys.append(key)
+            batch.append(UpdateOne({"sensor": sensor, "start": start},
+                                   _update_pipeline(count, fields, first_ts, last_ts), upsert=True))
+        started = time.perf_counter()
+        failed = []
+        for resolution, (keys, batch) in operations.items():
+            if not batch:
+                continue
+            try:
+                self.collections[resolution].bulk_write(batch, ordered=False)
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                logger.error(f"Ошибки при записи агрегатов '{resolution}': {len(errors)}, повтор при следующем сбросе")
+                failed.extend(keys[error["index"]] for error in errors)
+            except Exception as e:
+                logger.error(f"Не удалось записать {len(batch)} агрегатов '{resolution}', повтор при следующем сбросе: {e}")
+                failed.extend(keys)
+        if failed:
+            self._restore({key: pending[key] for key in failed})
+        mongodb_writer_flush_latency.labels(writer="rollups").observe(time.perf_counter() - started)
+        mongodb_writer_flush_size.labels(writer="rollups").observe(len(pending))
+
+    def _restore(self, failed):
+        """Вернуть незаписанные корзины в очередь: они сливаются с накопленными за это время"""
+        with self._lock:
+            for key, (count, fields, first_ts, last_ts) in failed.items():
+                bucket = self._pending.get(key)
+                if bucket is None:
+                    self._pending[key] = [count, fields, first_ts, last_ts]
+                    continue
+                bucket[0] += count
+                bucket[2] = min(bucket[2], first_ts)
+                bucket[3] = max(bucket[3], last_ts)
+                for field, stats in fields.items():
+                    current = bucket[1].get(field)
+                    if current is None:
+                        bucket[1][field] = stats
+                    else:
+                        current.merge(stats)
+
+
+def _merge_pipeline():
+    """whenMatched для $merge: корзины из показаний ($$new) складываются с уже записанными, а не заменяют их"""
+    stage = {
+        "count": {"$add": [{"$ifNull": ["$count", 0]}, "$$new.count"]},
+        "first_ts": {"$min": ["$first_ts", "$$new.first_ts"]},
+        "last_ts": {"$max": ["$last_ts", "$$new.last_ts"]},
+    }
+    for field in NUMERIC_FIELDS:
+        new_count = {"$add": [{"$ifNull": [f"${field}.count", 0]}, f"$$new.{field}.count"]}
+        new_sum = {"$add": [{"$ifNull": [f"${field}.sum", 0]}, f"$$new.{field}.sum"]}
+        stage[f"{field}.count"] = new_count
+        stage[f"{field}.sum"] = new_sum
+        stage[f"{field}.sumsq"] = {"$add": [{"$ifNull": [f"${field}.sumsq", 0]}, f"$$new.{field}.sumsq"]}
+        stage[f"{field}.mean"] = {"$cond": [{"$gt": [new_count, 0]}, {"$divide": [new_sum, new_count]}, None]}
+        stage[f"{field}.min"] = {"$min": [f"${field}.min", f"$$new.{field}.min"]}
+        stage[f"{field}.max"] = {"$max": [f"${field}.max", f"$$new.{field}.max"]}
+        stage[f"{field}.first"] = {"$cond": [
+            {"$lt": ["$$new.first_ts", {"$ifNull": ["$first_ts", _MAX_DATE]}]}, f"$$new.{field}.first", f"${field}.first"]}
+        stage[f"{field}.last"] = {"$cond": [
+            {"$gte": ["$$new.last_ts", {"$ifNull": ["$last_ts", "$$new.last_ts"]}]}, f"$$new.{field}.last", f"${field}.last"]}
+    return [{"$set": stage}]
+
+
+def backfill_pipeline(resolution, start, end, sensor_id=None, prefix=None, merge=False):
+    """Пересчёт корзин интервала [start, end) из сырых показаний на сервере ($dateTrunc, MongoDB 5+).
+    merge=True - корзины не заменяются, а дополняются (для интервала, которого RollupWriter не видел)"""
+    prefix = rollup_prefix() if prefix is None else prefix
+    match = {TIME_FIELD: {"$gte": start, "$lt": end}}
+    if sensor_id is not None:
+        match[META_FIELD] = sensor_id
+    group = {
+        "_id": {"sensor": f"${META_FIELD}", "start": {"$dateTrunc": {"date": f"${TIME_FIELD}", "unit": resolution}}},
+        "count": {"$sum": 1},
+        "first_ts": {"$min": f"${TIME_FIELD}"},
+        "last_ts": {"$max": f"${TIME_FIELD}"},
+    }
+    project = {"_id": 0, "sensor": "$_id.sensor", "start": "$_id.start", "count": 1, "first_ts": 1, "last_ts": 1}
+    for field in NUMERIC_FIELDS:
+        group[f"{field}__count"] = {"$sum": {"$cond": [{"$isNumber": f"${field}"}, 1, 0]}}
+        group[f"{field}__sum"] = {"$sum": f"${field}"}
+        group[f"{field}__sumsq"] = {"$sum": {"$multiply": [f"${field}", f"${field}"]}}
+        group[f"{field}__min"] = {"$min": f"${field}"}
+        group[f"{field}__max"] = {"$max": f"${field}"}
+        group[f"{field}__first"] = {"$first": f"${field}"}
+        group[f"{field}__last"] = {"$last": f"${field}"}
+        project[field] = {
+            "count": f"${field}__count",
+            "sum": f"${field}__sum",
+            "sumsq": f"${field}__sumsq",
+            "mean": {"$cond": [{"$gt": [f"${field}__count", 0]},
+                               {"$divide": [f"${field}__sum", f"${field}__count"]}, None]},
+            "min": f"${field}__min",
+            "max": f"${field}__max",
+            "first": f"${field}__first",
+            "last": f"${field}__last",
+        }
+    return [
+        {"$match": match},
+        {"$sort": {META_FIELD: 1, TIME_FIELD: 1}},
+        {"$group": group},
+        {"$project": project},
+        {"$merge": {"into": prefix + resolution, "on": ["sensor", "start"],
+                    "whenMatched": _merge_pipeline() if merge else "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+def _backfill_partial(collection, start, end, sensor_id=None, prefix=None):
+    """Неполные сутки [start, end): живые корзины RollupWriter-а не заменяются - в них добавляются
+    только показания раньше первого учтённого им (first_ts его первой минутной корзины), поэтому
+    повторный запуск ничего не удваивает"""
+    prefix = rollup_prefix() if prefix is None else prefix
+    minutes = collection.database[prefix + "minute"]
+    sensors = [sensor_id] if sensor_id is not None else collection.distinct(
+        META_FIELD, {TIME_FIELD: {"$gte": start, "$lt": end}})
+    for sensor in sensors:
+        live = minutes.find_one({"sensor": sensor, "start": {"$gte": start, "$lt": end}}, {"first_ts": 1},
+                                sort=[("start", ASCENDING)])
+        cutoff = min(end, live["first_ts"]) if live and live.get("first_ts") else end
+        if cutoff <= start:
+            continue
+        for resolution in RESOLUTIONS:
+            collection.aggregate(backfill_pipeline(resolution, start, cutoff, sensor, prefix, merge=True),
+                                 allowDiskUse=True)
+    logger.info(f"Rollups merged for {start:%Y-%m-%d} up to {end:%H:%M:%S}")
+
+
+def backfill(collection, start, end, sensor_id=None, prefix=None):
+    """Пересчёт агрегатов по истории посуточно. Полные сутки пересчитываются целиком, поэтому
+    повторный запуск идемпотентен; неполные последние сутки (обычно текущие) до end дополняются
+    через _backfill_partial без перезаписи живых корзин"""
+    day = RESOLUTIONS["day"][1]
+    start, last_day = day(start), day(end)
+    ensure_rollup_indexes(collection.database, prefix)
+    current = start
+    while current < last_day:
+        following = current + timedelta(days=1)
+        for resolution in RESOLUTIONS:
+            collection.aggregate(backfill_pipeline(resolution, current, following, sensor_id, prefix), allowDiskUse=True)
+        logger.info(f"Rollups rebuilt for {current:%Y-%m-%d}")
+        current = following
+    if last_day < end:
+        _backfill_partial(collection, last_day, end, sensor_id, prefix)
+
+
+class RollupRepository:
+    """Чтение агрегатов для графиков: разрешение выбирается по длине интервала"""
+
+    def __init__(self, db, prefix=None):
+        self.db = db
+        self.prefix = rollup_prefix() if prefix is None else prefix
+
+    @staticmethod
+    def resolution_for(start, end, max_points=1500):
+        span = end - start
+        for resolution, (width, _) in RESOLUTIONS.items():
+            if span / width <= max_points:
+                return resolution
+        return "day"
+
+    def frame(self, sensor_id, start, end, fields=None, resolution=None, max_points=1500):
+        """DataFrame корзин [start, end): столбец start, count и для каждого поля F - F_first, F_min, F_max,
+        F (среднее), F_last (те же столбцы, что у SensorRepository.buckets)"""
+        fields = tuple(NUMERIC_FIELDS) if fields is None else tuple(fields)
+        resolution = resolution or self.resolution_for(start, end, max_points)
+        projection = {"_id": 0, "start": 1, "count": 1}
+        for field in fields:
+            projection[field] = 1
+        cursor = (self.db[self.prefix + resolution]
+                  .find({"sensor": sensor_id, "start": {"$gte": start, "$lt": end}}, projection)
+                  .sort("start", ASCENDING))
+        rows = []
+        for doc in cursor:
+            row = {"start": doc["start"], "count": doc.get("count", 0)}
+            for field in fields:
+                stats = doc.get(field) or {}
+                row[f"{field}_first"] = stats.get("first")
+                row[f"{field}_min"] = stats.get("min")
+                row[f"{field}_max"] = stats.get("max")
+                row[field] = stats.get("mean")
+                row[f"{field}_last"] = stats.get("last")
+            rows.append(row)
+        columns = ["start", "count"] + [field if stat == "mean" else f"{field}_{stat}"
+                                        for field in fields for stat in BUCKET_STATS]
+        return pd.DataFrame(rows, columns=columns)
+
+    def missing(self, frame, start, end, resolution=None, max_points=1500):
+        """Части интервала [start, end) без корзин во frame - до первой и после последней
+        (агрегаты включены посреди окна, backfill не запускался, сброс не удался)"""
+        resolution = resolution or self.resolution_for(start, end, max_points)
+        if frame.empty:
+            return [(start, end)]
+        width = RESOLUTIONS[resolution][0]
+        first = frame["start"].iloc[0].to_pydatetime()
+        last = frame["start"].iloc[-1].to_pydatetime() + width
+        gaps = []
+        if first - start >= width:
+            gaps.append((start, first))
+        if end - last >= width:
+            gaps.append((last, end))
+        return gaps
+
+    def days(self, sensor_id):
+        """Сутки с показаниями датчика по суточным корзинам (индекс {sensor, start})"""
+        cursor = (self.db[self.prefix + "day"]
+                  .find({"sensor": sensor_id}, {"_id": 0, "start": 1})
+                  .sort("start", ASCENDING))
+        return [doc["start"].date() for doc in cursor]
+
+    def summary(self, sensor_id, field, start=None, end=None):
+        """Точные min/max/среднее поля за интервал по суточным корзинам"""
+        query = {"sensor": sensor_id, f"{field}.count": {"$gt": 0}}
+        if start is not None or end is not None:
+            query["start"] = {}
+            if start is not None:
+                query["start"]["$gte"] = start
+            if end is not None:
+                query["start"]["$lt"] = end
+        result = next(self.db[self.prefix + "day"].aggregate([
+            {"$match": query},
+            {"$group": {"_id": None, "min": {"$min": f"${field}.min"}, "max": {"$max": f"${field}.max"},
+                        "sum": {"$sum": f"${field}.sum"}, "count": {"$sum": f"${field}.count"}}},
+        ]), None)
+        if result is None or not result["count"]:
+            return None
+        return {"min": result["min"], "max": result["max"], "mean": result["sum"] / result["count"],
+                "count": result["count"]}
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Пересчёт агрегатов (minute/hour/day) по истории показаний")
+    parser.add_argument("--db", default=os.getenv("MONGO_DB", "mqtt_database"))
+    parser.add_argument("--collection", default=os.getenv("MONGO_COLLECTION", "your_collection"))
+    parser.add_argument("--sensor", help="MAC датчика, по умолчанию все")
+    parser.add_argument("--start", help="YYYY-MM-DD, по умолчанию первое показание")
+    parser.add_argument("--end", help="YYYY-MM-DD (не включая), по умолчанию текущий момент")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGO_URL", "mongodb://localhost:27017/"))
+    try:
+        collection = client[args.db][args.collection]
+        if args.start:
+            start = datetime.strptime(args.start, "%Y-%m-%d")
+        else:
+            first = collection.find_one({}, {TIME_FIELD: 1}, sort=[(TIME_FIELD, ASCENDING)])
+            if first is None:
+                print("Коллекция пуста.")
+                return
+            start = first[TIME_FIELD]
+        end = datetime.strptime(args.end, "%Y-%m-%d") if args.end else datetime.now()
+        backfill(collection, start, end, args.sensor)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import json
+import time
+from datetime import datetime
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Схема хранимого документа: числа - double, MsgTimeStamp - BSON date.
+# Время датчика хранится как есть (наивное, без перевода в UTC), как и прежние строки.
+TIME_FIELD = 'MsgTimeStamp'
+NUMERIC_FIELDS = {
+    'PM25': 'pm25',
+    'TemperatureC': 'temperature_c',
+    'TemperatureF': 'temperature_f',
+    'Humidity': 'humidity',
+    'DewPointC': 'dew_point_c',
+    'DewPointF': 'dew_point_f',
+}
+
+
+def _to_float(value):
+    if value is None or value == '':
+        return None
+    return float(value)
+
+
+def _to_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if value:
+        return datetime.fromisoformat(value)
+    return None
+
+
+def typed_document(data):
+    """Документ в типизированной схеме (прочие поля без изменений). Бросает ValueError при некорректных значениях"""
+    doc = dict(data)
+    if TIME_FIELD in doc:
+        doc[TIME_FIELD] = _to_datetime(doc[TIME_FIELD])
+    for field in NUMERIC_FIELDS:
+        if field in doc:
+            doc[field] = _to_float(doc[field])
+    return doc
+
+
+class SensorReading:
+    """Одно показание датчика: числа и время разобраны один раз при получении сообщения"""
+
+    __slots__ = ('mac_address', 'timestamp', 'ts', 'pm25', 'temperature_c', 'temperature_f',
+                 'humidity', 'dew_point_c', 'dew_point_f', 'alarm_status', 'raw')
+
+    def __init__(self, mac_address, timestamp, ts, pm25, temperature_c, temperature_f,
+                 humidity, dew_point_c, dew_point_f, alarm_status, raw):
+        self.mac_address = mac_address
+        self.timestamp = timestamp
+        self.ts = ts
+        self.pm25 = pm25
+        self.temperature_c = temperature_c
+        self.temperature_f = temperature_f
+        self.humidity = humidity
+        self.dew_point_c = dew_point_c
+        self.dew_point_f = dew_point_f
+        self.alarm_status = alarm_status
+        self.raw = raw
+
+    @classmethod
+    def from_dict(cls, data):
+        timestamp = _to_datetime(data.get(TIME_FIELD))
+        return cls(
+            mac_address=data.get('MacAddress'),
+            timestamp=timestamp,
+            ts=timestamp.timestamp() if timestamp is not None else time.time(),
+            pm25=_to_float(data.get('PM25')),
+            temperature_c=_to_float(data.get('TemperatureC')),
+            temperature_f=_to_float(data.get('TemperatureF')),
+            humidity=_to_float(data.get('Humidity')),
+            dew_point_c=_to_float(data.get('DewPointC')),
+            dew_point_f=_to_float(data.get('DewPointF')),
+            alarm_status=1 if str(data.get('AlarmStatus', '')).lower() == 'on' else 0,
+            raw=data,
+        )
+
+    def to_document(self):
+        """Документ для записи в MongoDB в типизированной схеме (уже разобранные значения)"""
+        doc = dict(self.raw)
+        if TIME_FIELD in doc:
+            doc[TIME_FIELD] = self.timestamp
+        for field, attr in NUMERIC_FIELDS.items():
+            if field in doc:
+                doc[field] = getattr(self, attr)
+        return doc
+
+    def __repr__(self):
+        return (f"SensorReading({self.mac_address}, {self.timestamp}, pm25={self.pm25}, "
+                f"t={self.temperature_c}, h={self.humidity}, dp={self.dew_point_c})")
+
+
+def decode_payload(payload):
+    """bytes из MQTT -> SensorReading. orjson используется, если установлен.
+
+    Бросает ValueError при некорректном JSON или значениях.
+    """
+    return SensorReading.from_dict(_loads(payload))
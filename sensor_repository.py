@@ -0,0 +1,216 @@
+import os
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+import bson
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING, DESCENDING, MongoClient
+
+from sensor_reading import NUMERIC_FIELDS, TIME_FIELD
+
+META_FIELD = "MacAddress"
+READING_FIELDS = (META_FIELD, TIME_FIELD) + tuple(NUMERIC_FIELDS) + ("AlarmStatus",)
+# Ширины корзин для графиков: выбирается наименьшая, при которой корзин не больше max_points
+BUCKET_WIDTHS = tuple(timedelta(seconds=s) for s in (
+    1, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400))
+BUCKET_STATS = ("first", "min", "max", "mean", "last")
+
+
+def bucket_width(span, max_points):
+    for width in BUCKET_WIDTHS:
+        if span / width <= max_points:
+            return width
+    days = -(-span // (BUCKET_WIDTHS[-1] * max_points))
+    return BUCKET_WIDTHS[-1] * days
+
+
+def column_dtype(field):
+    if field == TIME_FIELD:
+        return np.dtype("datetime64[ms]")
+    if field in NUMERIC_FIELDS:
+        return np.dtype(np.float64)
+    return np.dtype(object)
+
+
+class ColumnBuffer:
+    """Столбцы numpy под показания: память выделяется заранее и удваивается при заполнении,
+    пачки документов раскладываются по столбцам без промежуточных списков.
+    Время - datetime64[ms] (NaT, если нет), числа - float64 (NaN, если нет), прочее - object."""
+
+    def __init__(self, fields, capacity=65536):
+        self.fields = tuple(fields)
+        self.size = 0
+        self.capacity = max(int(capacity), 1)
+        self.columns = {field: np.empty(self.capacity, dtype=column_dtype(field)) for field in self.fields}
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, count):
+        needed = self.size + count
+        if needed <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        for field, column in self.columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[field] = grown
+        self.capacity = capacity
+
+    def extend(self, docs):
+        count = len(docs)
+        if not count:
+            return
+        self._reserve(count)
+        end = self.size + count
+        for field, column in self.columns.items():
+            column[self.size:end] = np.fromiter((doc.get(field) for doc in docs), dtype=column.dtype, count=count)
+        self.size = end
+
+    def arrays(self):
+        """Заполненная часть столбцов; при большом запасе ёмкости столбцы копируются, чтобы отдать лишнюю память"""
+        if self.size * 4 < self.capacity * 3:
+            return {field: column[:self.size].copy() for field, column in self.columns.items()}
+        return {field: column[:self.size] for field, column in self.columns.items()}
+
+
+class SensorRepository:
+    """Единая точка чтения показаний из MongoDB.
+
+    Фильтр по датчику и интервалу времени и проекция полей всегда выполняются на сервере,
+    курсор читается пачками по chunk_size документов. Интервал полуоткрытый: [start, end).
+    """
+
+    def __init__(self, collection, chunk_size=5000):
+        self.collection = collection
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_env(cls, db_name=None, collection_name=None, mongo_url=None, **kwargs):
+        client = MongoClient(mongo_url or os.getenv("MONGO_URL", "mongodb://localhost:27017/"))
+        db = client[db_name or os.getenv("MONGO_DB", "mqtt_database")]
+        return cls(db[collection_name or os.getenv("MONGO_COLLECTION", "your_collection")], **kwargs)
+
+    def close(self):
+        self.collection.database.client.close()
+
+    @staticmethod
+    def query(sensor_id=None, start=None, end=None):
+        query = {}
+        if sensor_id is not None:
+            query[META_FIELD] = sensor_id
+        if start is not None or end is not None:
+            query[TIME_FIELD] = {}
+            if start is not None:
+                query[TIME_FIELD]["$gte"] = start
+            if end is not None:
+                query[TIME_FIELD]["$lt"] = end
+        return query
+
+    @staticmethod
+    def projection(fields=None):
+        fields = READING_FIELDS if fields is None else fields
+        projection = {field: 1 for field in fields}
+        projection["_id"] = 0
+        return projection
+
+    def find(self, sensor_id=None, start=None, end=None, fields=None, descending=False, limit=0):
+        """Курсор по показаниям, отсортированным по времени"""
+        return (self.collection
+                .find(self.query(sensor_id, start, end), self.projection(fields))
+                .sort(TIME_FIELD, DESCENDING if descending else ASCENDING)
+                .limit(limit)
+                .batch_size(self.chunk_size))
+
+    def iter_chunks(self, sensor_id=None, start=None, end=None, fields=None, chunk_size=None, limit=0):
+        """Показания списками по chunk_size документов"""
+        chunk_size = chunk_size or self.chunk_size
+        cursor = self.find(sensor_id, start, end, fields, limit=limit)
+        while True:
+            chunk = list(islice(cursor, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def iter_raw_chunks(self, sensor_id=None, start=None, end=None, fields=None, limit=0):
+        """Пачки курсора сырыми BSON-батчами, разобранными целиком в C (bson.decode_all)
+        без построчной обработки курсора в Python"""
+        cursor = (self.collection
+                  .find_raw_batches(self.query(sensor_id, start, end), self.projection(fields))
+                  .sort(TIME_FIELD, ASCENDING)
+                  .limit(limit)
+                  .batch_size(self.chunk_size))
+        for batch in cursor:
+            yield bson.decode_all(batch)
+
+    def columns(self, sensor_id=None, start=None, end=None, fields=None, limit=0, raw=False):
+        """Показания столбцами numpy {поле: массив}, отсортированные по времени.
+
+        raw=True читает курсор сырыми BSON-батчами - быстрее на больших выборках.
+        """
+        fields = READING_FIELDS if fields is None else fields
+        buffer = ColumnBuffer(fields, capacity=min(limit, 65536) if limit else 65536)
+        chunks = self.iter_raw_chunks if raw else self.iter_chunks
+        for chunk in chunks(sensor_id, start, end, fields, limit=limit):
+            buffer.extend(chunk)
+        return buffer.arrays()
+
+    def frame(self, sensor_id=None, start=None, end=None, fields=None, limit=0, raw=False):
+        """DataFrame из показаний (собирается из столбцов numpy, без промежуточного списка всех документов)"""
+        return pd.DataFrame(self.columns(sensor_id, start, end, fields, limit, raw))
+
+    def buckets(self, sensor_id, start, end, fields=None, max_points=1000, width=None):
+        """Ряд, сгруппированный по корзинам времени на сервере: на корзину - start, count и для
+        каждого поля F - F_first, F_min, F_max, F (среднее), F_last. Клиенту приходит не больше
+        max_points документов независимо от длины интервала [start, end)"""
+        fields = tuple(NUMERIC_FIELDS) if fields is None else tuple(fields)
+        width_ms = int((width or bucket_width(end - start, max_points)).total_seconds() * 1000)
+        # Миллисекунды от эпохи: разность дат в MongoDB - число мс
+        timestamp = {"$subtract": [f"${TIME_FIELD}", datetime(1970, 1, 1)]}
+        group = {"_id": {"$subtract": [timestamp, {"$mod": [timestamp, width_ms]}]}, "count": {"$sum": 1}}
+        for field in fields:
+            group[f"{field}_first"] = {"$first": f"${field}"}
+            group[f"{field}_min"] = {"$min": f"${field}"}
+            group[f"{field}_max"] = {"$max": f"${field}"}
+            group[field] = {"$avg": f"${field}"}
+            group[f"{field}_last"] = {"$last": f"${field}"}
+        pipeline = [
+            {"$match": self.query(sensor_id, start, end)},
+            {"$sort": {TIME_FIELD: ASCENDING}},
+            {"$group": group},
+            {"$sort": {"_id": ASCENDING}},
+        ]
+        docs = list(self.collection.aggregate(pipeline, allowDiskUse=True))
+        columns = ["start", "count"] + [
+            field if stat == "mean" else f"{field}_{stat}" for field in fields for stat in BUCKET_STATS]
+        frame = pd.DataFrame(docs, columns=["_id"] + columns[1:]).rename(columns={"_id": "start"})
+        frame["start"] = pd.to_datetime(frame["start"].astype("int64"), unit="ms")
+        return frame.astype({"count": np.int64, **{column: np.float64 for column in columns[2:]}})
+
+    def latest(self, sensor_id=None, fields=None):
+        return self.collection.find_one(self.query(sensor_id), self.projection(fields), sort=[(TIME_FIELD, DESCENDING)])
+
+    def time_bounds(self, sensor_id=None):
+        """Время первого и последнего показания (None, None), если данных нет"""
+        query = self.query(sensor_id)
+        projection = self.projection((TIME_FIELD,))
+        first = self.collection.find_one(query, projection, sort=[(TIME_FIELD, ASCENDING)])
+        last = self.collection.find_one(query, projection, sort=[(TIME_FIELD, DESCENDING)])
+        if first is None:
+            return None, None
+        return first[TIME_FIELD], last[TIME_FIELD]
+
+    def days(self, sensor_id=None, start=None, end=None):
+        """Сутки, за которые есть показания, - группировка на сервере, клиенту приходят только даты"""
+        pipeline = [
+            {"$match": self.query(sensor_id, start, end)},
+            {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": f"${TIME_FIELD}"}}}},
+            {"$sort": {"_id": ASCENDING}},
+        ]
+        return [date.fromisoformat(doc["_id"]) for doc in self.collection.aggregate(pipeline)]
+
+    def sensors(self):
+        return sorted(self.collection.distinct(META_FIELD))
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import numpy as np
+
+from prom_query import RangeQueryCache, RangeSeries
+
+STEP = "2m"
+SIZE = 120
+
+
+class FakePrometheus:
+    """Подставной fetch: ряд с точкой на каждый шаг, value = время; fail=True - ошибка запроса"""
+
+    def __init__(self):
+        self.calls = []
+        self.fail = False
+
+    async def __call__(self, query, start, end, step):
+        self.calls.append((start, end))
+        if self.fail:
+            return None
+        points = (end - start) // SIZE + 1
+        assert points <= 11000, "Prometheus отклонит запрос больше 11000 точек"
+        timestamps = start + np.arange(points, dtype=np.float64) * SIZE
+        return [RangeSeries({"__name__": "m"}, timestamps, timestamps.copy())]
+
+
+def query(cache, fetch, start, end):
+    return asyncio.run(cache.query_range(fetch, "m", start, end, STEP))
+
+
+def aligned(ts):
+    return ts // SIZE * SIZE
+
+
+def test_repeated_window_is_served_from_cache():
+    cache, fetch = RangeQueryCache(settle=0), FakePrometheus()
+    end = aligned(time.time()) - 3600
+    first = query(cache, fetch, end - 1800, end)
+    second = query(cache, fetch, end - 1800, end)
+    assert len(fetch.calls) == 1
+    assert np.array_equal(first[0].timestamps, second[0].timestamps)
+    assert len(second[0]) == 16
+
+
+def test_newer_window_fetches_only_tail():
+    cache, fetch = RangeQueryCache(settle=0), FakePrometheus()
+    end = aligned(time.time()) - 3600
+    query(cache, fetch, end - 1800, end)
+    result = query(cache, fetch, end - 1800 + 2 * SIZE, end + 2 * SIZE)
+    assert fetch.calls[-1] == (end + SIZE, end + 2 * SIZE)
+    assert len(result[0]) == 16
+    assert result[0].timestamps[-1] == end + 2 * SIZE
+
+
+def test_large_gap_starts_fresh_entry():
+    cache, fetch = RangeQueryCache(settle=0), FakePrometheus()
+    now = aligned(time.time()) - 3600
+    old = now - 30 * 86400
+    query(cache, fetch, old - 1800, old)
+    result = query(cache, fetch, now - 1800, now)
+    assert fetch.calls[-1] == (now - 1800, now)
+    assert len(result[0]) == 16
+
+
+def test_failed_fetch_is_not_cached():
+    cache, fetch = RangeQueryCache(settle=0), FakePrometheus()
+    end = aligned(time.time()) - 3600
+    query(cache, fetch, end - 1800, end)
+    fetch.fail = True
+    assert query(cache, fetch, end - 1800 + SIZE, end + SIZE) == []
+    assert len(cache) == 0
+    fetch.fail = False
+    result = query(cache, fetch, end - 1800 + SIZE, end + SIZE)
+    assert fetch.calls[-1] == (end - 1800 + SIZE, end + SIZE)
+    assert len(result[0]) == 16